@@ -130,7 +130,7 @@ export const ReportTemplate = React.forwardRef<HTMLDivElement, ReportTemplatePro
 
     const getProxyUrl = (url?: string) => {
         if (!url) return undefined;
-        if (url.includes(window.location.host) || url.includes('/api/proxy') || url.includes('data:image')) return url;
+        if (url.startsWith('/') || url.includes(window.location.host) || url.includes('/api/proxy') || url.includes('data:image')) return url;
         return `/api/proxy-image?url=${encodeURIComponent(url)}`;
     };
 
@@ -0,0 +1,54 @@
+import datetime
+
+import state_store
+
+# Sensors checked before a /satellite recomputation (see satellite_analysis.list_acquisitions)
+SENSORS = ("s2", "s1", "landsat")
+
+
+def known_ids(farm_key, since=None, seen_ids=None):
+    """
+    Acquisition ids already reflected in the caller's last reading: the ids it sent, plus the ids
+    this service recorded when it produced that reading. The stored ids only count when the
+    caller's watermark (`since`) is at least the stored run date, i.e. that run was persisted.
+    """
+    ids = set(seen_ids or [])
+    stored = state_store.load_json("acquisitions", farm_key)
+    if stored and since and str(since)[:10] >= stored.get("date", ""):
+        ids.update(stored.get("ids", []))
+    return ids
+
+
+def new_acquisitions(listing, since=None, known=None):
+    """
+    {sensor: [scenes]} not yet processed. With known ids, a scene is new when its id is unknown;
+    with only a `since` date, when it was acquired on or after that day (scenes from the day of
+    the last sync are re-checked rather than risk missing a late one).
+    """
+    since_ms = None
+    if since:
+        since_day = datetime.datetime.fromisoformat(str(since)[:10]).replace(tzinfo=datetime.timezone.utc)
+        since_ms = since_day.timestamp() * 1000
+    new = {}
+    for sensor in SENSORS:
+        scenes = listing.get(sensor, [])
+        if known:
+            new[sensor] = [s for s in scenes if s["id"] not in known]
+        elif since_ms is not None:
+            new[sensor] = [s for s in scenes if (s.get("time") or 0) >= since_ms]
+        else:
+            new[sensor] = list(scenes)
+    return new
+
+
+def summary(listing, new):
+    return {sensor: {"total": len(listing.get(sensor, [])), "new": len(new.get(sensor, []))} for sensor in SENSORS}
+
+
+def record(farm_key, date, listing):
+    """Remembers the scenes behind the reading dated `date` (non-fatal on disk errors)."""
+    ids = sorted(s["id"] for sensor in SENSORS for s in listing.get(sensor, []))
+    try:
+        state_store.save_json("acquisitions", farm_key, {"date": str(date)[:10], "ids": ids})
+    except OSError as state_err:
+        print(f"⚠️ Could not persist acquisition watermark (non-fatal): {state_err}")
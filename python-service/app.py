@@ -1,12 +1,16 @@
 import os
 import json
 import math
-from fastapi import FastAPI, HTTPException
+import time
+import contextlib
+from fastapi import FastAPI, HTTPException, Header, Request, Response
+from fastapi.encoders import jsonable_encoder
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
-from typing import List, Optional
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, ValidationError, field_validator
+from typing import List, Literal, Optional
 import sys
-import ee
+from ee_backend import ee
 import pandas as pd
 import numpy as np
 from sklearn.ensemble import RandomForestRegressor
@@ -17,9 +21,32 @@ import datetime
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 import satellite_analysis
 import cluster
+import encoding
+import state_store
+import pixel_cube
+import zone_stability
+import local_raster
+import datacube
+import acquisitions
+import ee_registry
+import image_store
+import metrics
+import profiling
+import tracing
+import coalesce
+import jobs
+import deadline
+import ee_gateway
 
 app = FastAPI()
 
+# Threads serving the sync endpoints per worker (Starlette/AnyIO default: 40)
+THREADPOOL_SIZE = int(os.environ.get("THREADPOOL_SIZE", "0"))
+
+# /cluster k bounds; in k_range every k is a full fit plus a silhouette in the same request
+K_RANGE_MAX = 10
+K_RANGE_MAX_VALUES = 5
+
 class PredictionRequest(BaseModel):
     history: List[dict]  # Expected keys: date, ndvi, ndwi (optional), temperature (optional)
     target_date: str
@@ -90,6 +117,7 @@ FEATURES = ['month', 'day_of_year', 'season', 'temperature',
             'ndvi_lag_1', 'ndvi_lag_2', 'ndvi_lag_3', 'ndvi_trend', 'ndwi_last']
 
 @app.post("/predict")
+@profiling.profiled
 async def predict_ndvi(req: PredictionRequest):
     try:
         if not req.history or len(req.history) < 5:
@@ -98,14 +126,17 @@ async def predict_ndvi(req: PredictionRequest):
         # Convert to DataFrame
         df = pd.DataFrame(req.history)
         df['date'] = pd.to_datetime(df['date'])
-        df = build_features(df)
+        with metrics.stage("feature_build"):
+            df = build_features(df)
         
         # Train Model
         X = df[FEATURES]
         y = df['ndvi']
         
         model = RandomForestRegressor(n_estimators=50, random_state=42, max_depth=8)
-        model.fit(X, y)
+        with metrics.stage("model_fit"):
+            model.fit(X, y)
+        forecast_started = time.perf_counter()
         
         # Generate forecast points (every 7 days)
         forecast_days = min(req.forecast_days or 30, 90)
@@ -158,6 +189,8 @@ async def predict_ndvi(req: PredictionRequest):
             # Update trend
             recent_trend = (recent_ndvi[-1] - recent_ndvi[0]) / len(recent_ndvi) if len(recent_ndvi) > 1 else 0
         
+        metrics.record("forecast", (time.perf_counter() - forecast_started) * 1000)
+
         # Overall prediction (average of forecast)
         avg_prediction = np.mean([f['ndvi'] for f in forecast])
         
@@ -221,6 +254,11 @@ async def startup_event():
     # Initialize Earth Engine with explicit credentials
     satellite_analysis.init_earth_engine(project_id, credentials)
 
+    if THREADPOOL_SIZE > 0:
+        import anyio.to_thread
+        anyio.to_thread.current_default_thread_limiter().total_tokens = THREADPOOL_SIZE
+        print(f"Threadpool: {THREADPOOL_SIZE} threads for sync endpoints")
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"], # In production, restrict this to your Vercel domains
@@ -229,88 +267,575 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.middleware("http")
+async def timing_middleware(request: Request, call_next):
+    started = time.perf_counter()
+    profile = contextlib.nullcontext()
+    if profiling.ENABLED and profiling.wanted(request.headers, request.query_params):
+        profile = profiling.request_scope(request.url.path)
+    with tracing.span(f"{request.method} {request.url.path}") as root, \
+            metrics.request_scope() as timings, profile as profile_info, \
+            deadline.request_scope(deadline.budget_ms(request.headers, request.query_params)) as budget:
+        response = await call_next(request)
+        # Route template (e.g. /images/{digest}) keeps label cardinality bounded
+        route = getattr(request.scope.get("route"), "path", "unmatched")
+        if root is not None:
+            root.tag(route=route, status_code=response.status_code)
+            response.headers["X-Trace-Id"] = root.trace.id
+    if budget is not None and budget.degraded:
+        response.headers["X-Degraded"] = ",".join(budget.degraded)
+        for part in budget.degraded:
+            metrics.count("yvy_degraded_total", route=route, part=part)
+    # Only handlers decorated with @profiling.profiled write a profile
+    if profile_info and profile_info["saved"]:
+        response.headers["X-Profile-Id"] = profile_info["id"]
+    total_ms = (time.perf_counter() - started) * 1000
+    metrics.observe("yvy_request_duration_ms", total_ms, route=route,
+                    method=request.method, status=str(response.status_code))
+    breakdown = timings.server_timing()
+    response.headers["Server-Timing"] = f"{breakdown}, total;dur={total_ms:.1f}" if breakdown else f"total;dur={total_ms:.1f}"
+    return response
+
+@app.get("/metrics")
+def get_metrics():
+    return Response(content=metrics.render(), media_type="text/plain; version=0.0.4")
+
 @app.get("/ping")
 def ping():
     return {"status": "ok", "message": "YVY Python AI Engine is awake"}
 
 class SatelliteRequest(BaseModel):
+    farm_id: Optional[int] = None  # Keys the farm's local datacube (pipeline="local"); ROI hash if missing
     lat: float
     lon: float
     size: float
     polygon: Optional[list] = None  # [[lon,lat], [lon,lat], ...] GeoJSON order
+    pipeline: Optional[Literal["ee", "local"]] = "ee"  # "ee" (server-side indices) or "local" (band arrays + NumPy)
+    since: Optional[str] = None  # Date of the caller's last reading; no new scene since -> "no_new_data"
+    seen_ids: Optional[List[str]] = None  # Acquisition ids (system:index) already reflected in that reading
 
 class ClusterRequest(BaseModel):
+    farm_id: Optional[int] = None  # Keys per-farm state (warm-start centroids); ROI hash if missing
     lat: float
     lon: float
     size: float
     k: Optional[int] = 3
     polygon: Optional[list] = None  # [[lon,lat], ...] GeoJSON order
+    speculative: Optional[bool] = None  # Fetch all date windows concurrently (default: CLUSTER_SPECULATIVE_FETCH)
+    engine: Optional[Literal["auto", "kmeans", "minibatch", "kdtree"]] = "auto"  # "auto": by pixel count; "kdtree": geometric
+    k_range: Optional[List[int]] = None  # [k_min, k_max] inclusive: cluster all k from one pixel fetch
+    selected_k: Optional[int] = None  # With k_range: k used for the raster (default: best silhouette)
+    talhoes: Optional[List[dict]] = None  # [{"name": str, "polygon": [[lon,lat], ...]}] for per-talhão statistics
+    features: Optional[Literal["spatial", "temporal"]] = "spatial"  # "spatial" (30-day composite) or "temporal" (seasonal NDVI pixel cube)
+    season_days: Optional[int] = 180  # Season length for features="temporal"
+    pipeline: Optional[Literal["ee", "local"]] = "ee"  # "ee" (sampled indices) or "local" (band arrays + NumPy)
+
+    @field_validator("k_range")
+    @classmethod
+    def check_k_range(cls, value):
+        if value is None:
+            return value
+        if len(value) != 2 or not 2 <= value[0] <= value[1] <= K_RANGE_MAX:
+            raise ValueError(f"k_range deve ser [k_min, k_max] com 2 <= k_min <= k_max <= {K_RANGE_MAX}")
+        if value[1] - value[0] + 1 > K_RANGE_MAX_VALUES:
+            raise ValueError(f"k_range cobre no máximo {K_RANGE_MAX_VALUES} valores de k")
+        return value
+
+    @field_validator("k", "selected_k")
+    @classmethod
+    def check_k(cls, value):
+        if value is not None and not 2 <= value <= K_RANGE_MAX:
+            raise ValueError(f"k deve estar entre 2 e {K_RANGE_MAX}")
+        return value
+
+class StabilityRequest(BaseModel):
+    farm_id: Optional[int] = None
+    lat: float
+    lon: float
+    size: float
+    polygon: Optional[list] = None  # [[lon,lat], ...] GeoJSON order
+    features: Optional[Literal["spatial", "temporal"]] = "spatial"  # History of "spatial" or "temporal" /cluster runs
 
 @app.get("/")
 def health_check():
     return {"status": "ok", "service": "yvy-python-microservice"}
 
+# Response formats per endpoint, in server preference order (JSON stays the default)
+SATELLITE_FORMATS = [encoding.JSON, encoding.MSGPACK]
+CLUSTER_FORMATS = [encoding.JSON, encoding.MSGPACK, encoding.ARROW,
+                   encoding.LABEL_GRID, encoding.PNG, encoding.WEBP]
+
+def negotiate_format(accept, formats):
+    fmt = encoding.negotiate(accept, [f for f in formats if encoding.is_available(f)])
+    if fmt is None:
+        raise HTTPException(status_code=406, detail=f"Formatos suportados: {', '.join(formats)}")
+    return fmt
+
+def binary_response(body, fmt, encode_ms, endpoint, headers=None):
+    print(f"📦 {endpoint} encoded as {fmt}: {len(body)} bytes in {encode_ms:.1f}ms")
+    headers = dict(headers or {})
+    headers["X-Encode-Time-Ms"] = f"{encode_ms:.2f}"
+    return Response(content=body, media_type=fmt, headers=headers)
+
 @app.post("/satellite")
-def analyze_satellite(req: SatelliteRequest):
+@profiling.profiled
+@ee_registry.scoped("/satellite")
+def analyze_satellite(req: SatelliteRequest, accept: Optional[str] = Header(None)):
+    fmt = negotiate_format(accept, SATELLITE_FORMATS)
+    # Identical requests in flight (dashboard, map and report opening the same farm) share one run
+    # A caller with a deadline may get a degraded result: only share it with the same deadline
+    key = coalesce.request_key("/satellite", jsonable_encoder(req), fmt, datetime.date.today(),
+                               deadline.current_budget_ms())
     try:
-        # We need to capture stdout from the script or modify the script to return data
-        # modifying the script to be importable is better, but it prints to stdout/stderr.
-        # For now, let's capture stdout if we call the function directly.
-        # Actually satellite_analysis.analyze_farm prints JSON to stdout.
-        
-        # We will redirect stdout to capture the output
-        from io import StringIO
-        import contextlib
-
-        f = StringIO()
-        with contextlib.redirect_stdout(f):
-            # Setup ROI: use polygon if available, otherwise circular buffer
-            if req.polygon and len(req.polygon) >= 3:
-                roi = ee.Geometry.Polygon([req.polygon])
-                print(f"Using polygon ROI with {len(req.polygon)} vertices")
-            else:
-                point = ee.Geometry.Point([req.lon, req.lat])
-                area_m2 = req.size * 10000
-                radius_m = math.sqrt(area_m2 / math.pi)
-                roi = point.buffer(radius_m)
-                print(f"Using circular ROI with radius {radius_m:.0f}m")
-            
-            end_date = datetime.datetime.now()
-            start_date = end_date - datetime.timedelta(days=30)
-            
-            satellite_analysis.analyze_farm(roi, start_date, end_date, req.size)
-            
-        output = f.getvalue()
-        try:
-            # Parse the last line which should be the JSON result
-            lines = output.strip().split('\n')
-            result = json.loads(lines[-1])
-            return result
-        except json.JSONDecodeError:
-            return {"error": "Failed to parse script output", "raw": output}
-            
+        return coalesce.run(key, lambda: satellite_result(req, fmt), "/satellite")
+    except deadline.DeadlineExceeded as e:
+        # Ran out of time waiting on an identical request that is still in flight
+        return satellite_response(stale_result("satellite", satellite_last_key(req), e), fmt)
+
+def satellite_last_key(req):
+    farm_key = state_store.farm_key(req.farm_id, req.lat, req.lon, req.size, req.polygon)
+    return coalesce.request_key("/satellite", farm_key, req.pipeline)
+
+def satellite_result(req, fmt):
+    farm_key = state_store.farm_key(req.farm_id, req.lat, req.lon, req.size, req.polygon)
+    tracing.annotate(farm=farm_key)
+
+    # Incremental sync: skip the analysis when no scene landed since the caller's last reading
+    listing, new = None, None
+    if req.since or req.seen_ids:
+        listing, new = check_acquisitions(req, farm_key)
+        if listing is not None and not any(new.values()):
+            print(f"🛰️ /satellite {farm_key}: no new acquisitions since {req.since}, skipping analysis")
+            return satellite_response({
+                "status": "no_new_data",
+                "since": req.since,
+                "checked_at": datetime.datetime.now().strftime('%Y-%m-%d'),
+                "acquisitions": acquisitions.summary(listing, new),
+            }, fmt)
+
+    last_key = satellite_last_key(req)
+    try:
+        if req.pipeline == "local":
+            try:
+                result = local_raster.analyze_farm_local(req.lat, req.lon, req.size, req.polygon, cube_key=farm_key)
+            except (deadline.DeadlineExceeded, ee_gateway.CircuitOpen):
+                raise
+            except Exception as e:
+                raise HTTPException(status_code=500, detail=str(e))
+        else:
+            result = run_analyze_farm(req)
+    except (deadline.DeadlineExceeded, ee_gateway.CircuitOpen) as e:
+        return satellite_response(stale_result("satellite", last_key, e), fmt)
+
+    if "error" not in result:
+        if deadline.degraded():
+            result["degraded"] = deadline.degraded()
+        else:
+            remember_result("satellite", last_key, result)
+
+    if listing is not None and "error" not in result:
+        acquisitions.record(farm_key, result.get("date"), listing)
+        result["status"] = "ok"
+        result["acquisitions"] = acquisitions.summary(listing, new)
+    return satellite_response(result, fmt)
+
+def remember_result(kind, key, result):
+    """Keeps the last complete result, served marked stale when a later request cannot finish (see stale_result)."""
+    try:
+        state_store.save_json(f"last_{kind}", key, {"saved_at": datetime.datetime.now().isoformat(timespec="seconds"),
+                                                     "result": result})
+    except (OSError, TypeError, ValueError) as e:
+        print(f"⚠️ Could not keep last {kind} result (non-fatal): {e}")
+
+def stale_result(kind, key, error):
+    """
+    Last complete result for `key`, marked stale, when the deadline ran out or Earth Engine is
+    unavailable; 504 (deadline) or 503 (EE down) if there is none or key is None.
+    """
+    entry = state_store.load_json(f"last_{kind}", key) if key else None
+    if entry is None:
+        status = 504 if isinstance(error, deadline.DeadlineExceeded) else 503
+        raise HTTPException(status_code=status, detail=str(error))
+    print(f"🕰️ /{kind}: serving last result from {entry['saved_at']} ({error})")
+    deadline.degrade("stale")
+    return {**entry["result"], "stale": True, "stale_since": entry["saved_at"], "stale_reason": str(error),
+            "degraded": deadline.degraded()}
+
+def satellite_response(result, fmt):
+    if fmt == encoding.MSGPACK:
+        body, encode_ms = encoding.timed_encode(encoding.encode_msgpack, result)
+        return binary_response(body, fmt, encode_ms, "/satellite")
+    return result
+
+def check_acquisitions(req, farm_key):
+    """
+    Lists the scenes of the analysis window (one getInfo) and returns (listing, new scenes per sensor).
+    (None, None) if the check fails, so the caller falls back to a full analysis.
+    """
+    end_date = datetime.datetime.now()
+    start_date = end_date - datetime.timedelta(days=30)
+    try:
+        roi = cluster.build_roi(req.lat, req.lon, req.size, req.polygon)
+        listing = satellite_analysis.list_acquisitions(roi, start_date.strftime('%Y-%m-%d'), end_date.strftime('%Y-%m-%d'))
+    except Exception as e:
+        print(f"⚠️ Acquisition check failed, running full analysis: {e}")
+        return None, None
+    known = acquisitions.known_ids(farm_key, req.since, req.seen_ids)
+    return listing, acquisitions.new_acquisitions(listing, req.since, known)
+
+def run_analyze_farm(req, end_date=None):
+    """Earth Engine pipeline: satellite_analysis.analyze_farm for the request's ROI over the last 30 days."""
+    try:
+        # The result is returned, not captured from stdout: redirect_stdout swaps the
+        # process-wide sys.stdout, so concurrent requests read each other's output
+
+        # Setup ROI: use polygon if available, otherwise circular buffer
+        if req.polygon and len(req.polygon) >= 3:
+            roi = ee.Geometry.Polygon([req.polygon])
+            print(f"Using polygon ROI with {len(req.polygon)} vertices")
+        else:
+            point = ee.Geometry.Point([req.lon, req.lat])
+            area_m2 = req.size * 10000
+            radius_m = math.sqrt(area_m2 / math.pi)
+            roi = point.buffer(radius_m)
+            print(f"Using circular ROI with radius {radius_m:.0f}m")
+
+        end_date = end_date or datetime.datetime.now()
+        start_date = end_date - datetime.timedelta(days=30)
+
+        with metrics.stage("analyze_farm"):
+            return satellite_analysis.analyze_farm(roi, start_date, end_date, req.size,
+                                                   image_key=state_store.roi_key(req.lat, req.lon, req.size, req.polygon),
+                                                   roi_box=cluster.roi_bounds(req.lat, req.lon, req.size, req.polygon))
+
+    except (deadline.DeadlineExceeded, ee_gateway.CircuitOpen):
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/images/{digest}")
+def get_image(digest: str, if_none_match: Optional[str] = Header(None)):
+    """Stored thumbnails/overlays by content hash; immutable, so cacheable forever."""
+    headers = {"Cache-Control": image_store.CACHE_CONTROL, "ETag": f'"{digest}"'}
+    if if_none_match and digest in if_none_match:
+        return Response(status_code=304, headers=headers)
+    stored = image_store.get(digest)
+    if stored is None:
+        raise HTTPException(status_code=404, detail="Imagem não encontrada")
+    data, media_type = stored
+    return Response(content=data, media_type=media_type, headers=headers)
+
+@app.get("/stats/ee-builds")
+def ee_build_stats():
+    """Per-endpoint EE collection lookups vs distinct builds since startup (lookups - builds = shared)."""
+    return ee_registry.snapshot()
+
+@app.post("/satellite/history")
+@profiling.profiled
+def satellite_history(req: SatelliteRequest):
+    """Index means per datacube time step over the farm, read from disk (no Earth Engine call)."""
+    farm_key = state_store.farm_key(req.farm_id, req.lat, req.lon, req.size, req.polygon)
+    tracing.annotate(farm=farm_key)
+    index = datacube.load_index(farm_key)
+    if not index:
+        raise HTTPException(status_code=404, detail="Nenhum datacube para esta fazenda. Sincronize com pipeline=local primeiro.")
+    mask = local_raster.roi_mask(index["grid"], req.lat, req.lon, req.size, req.polygon)
+    return {"step_days": datacube.STEP_DAYS, "series": datacube.time_series(farm_key, mask)}
+
 @app.post("/cluster")
-def analyze_cluster(req: ClusterRequest):
+@profiling.profiled
+@ee_registry.scoped("/cluster")
+def analyze_cluster(req: ClusterRequest, accept: Optional[str] = Header(None)):
+    fmt = negotiate_format(accept, CLUSTER_FORMATS)
+    key = coalesce.request_key("/cluster", jsonable_encoder(req), fmt, datetime.date.today(),
+                               deadline.current_budget_ms())
     try:
-        pixels = cluster.get_real_pixels(req.lat, req.lon, req.size, polygon=req.polygon)
-        zones, labels, sorted_indices, clean_pixels = cluster.cluster_pixels(pixels, req.k, return_internals=True)
+        return coalesce.run(key, lambda: cluster_result(req, fmt), "/cluster")
+    except deadline.DeadlineExceeded as e:
+        # Ran out of time waiting on an identical request that is still in flight
+        return stale_result("cluster", coalesce.request_key("/cluster", jsonable_encoder(req))
+                            if fmt == encoding.JSON else None, e)
+
+def cluster_result(req, fmt):
+    if req.features == "temporal" and req.k_range:
+        raise HTTPException(status_code=400, detail="k_range não é suportado com features=temporal")
+    last_key = coalesce.request_key("/cluster", jsonable_encoder(req))
+    try:
+        fetch_attempts = []
+        # Warm start from this farm's previous centroids (keeps zone ids stable between syncs)
+        farm_key = state_store.farm_key(req.farm_id, req.lat, req.lon, req.size, req.polygon)
+        tracing.annotate(farm=farm_key)
+        solutions = None
+        cube_info = None
+        if req.features == "temporal":
+            k = req.k
+            clustering = {}
+            zones, labels, sorted_indices, clean_pixels, cube_info = cluster_from_cube(req, farm_key, clustering)
+        else:
+            if req.pipeline == "local":
+                pixels = local_raster.farm_pixels(req.lat, req.lon, req.size, req.polygon,
+                                                  attempts=fetch_attempts, cube_key=farm_key)
+            else:
+                pixels = cluster.get_real_pixels(req.lat, req.lon, req.size, polygon=req.polygon,
+                                                 speculative=req.speculative, attempts=fetch_attempts)
+            print(f"⏱️ Pixel fetch attempts: {json.dumps(fetch_attempts)}")
+            if req.k_range:
+                k_values = list(range(req.k_range[0], req.k_range[1] + 1))
+                previous = {k: state_store.load_json("centroids", f"{farm_key}-k{k}") for k in k_values}
+                solutions, clean_pixels = cluster.cluster_k_range(pixels, k_values, engine=req.engine, previous=previous)
+                for sol in solutions:
+                    save_centroids(f"{farm_key}-k{sol['k']}", sol["clustering"].pop("state"))
+                best = cluster.best_solution(solutions, req.selected_k)
+                k, zones, labels, sorted_indices = best["k"], best["zones"], best["labels"], best["sorted_indices"]
+                clustering = best["clustering"]
+            else:
+                k = req.k
+                clustering = {}
+                zones, labels, sorted_indices, clean_pixels = cluster.cluster_pixels(
+                    pixels, k, return_internals=True, engine=req.engine,
+                    previous=state_store.load_json("centroids", f"{farm_key}-k{k}"), diagnostics=clustering)
+                save_centroids(f"{farm_key}-k{k}", clustering.pop("state"))
+
+        extra = {"fetch_attempts": fetch_attempts, "clustering": clustering}
+        if req.talhoes:
+            extra["talhoes"] = cluster.talhao_statistics(clean_pixels, req.talhoes)
+        if cube_info is not None:
+            extra["pixel_cube"] = cube_info
+        stability = None
+        if not req.k_range and req.engine in (None, "auto"):
+            # Only the default setting feeds the history; sweeps and engine trials would skew it
+            composite_date = cube_info["composite_end"] if cube_info else datetime.date.today().isoformat()
+            stability = record_stability(req, farm_key, clean_pixels, labels, sorted_indices, zones, k,
+                                         composite_date)
+        if stability is not None:
+            extra["stability"] = stability
+        if solutions is not None:
+            extra["k"] = k
+            extra["solutions"] = [
+                {key: sol[key] for key in ("k", "inertia", "silhouette", "zones", "clustering")}
+                for sol in solutions
+            ]
+
+        if fmt != encoding.JSON:
+            return encode_cluster_response(fmt, req, k, zones, labels, sorted_indices, clean_pixels, extra)
         
-        # Generate raster image overlay
+        # Generate raster image overlay (only for the selected k); the zones come first under a deadline
         raster_image = None
         raster_bounds = None
-        try:
-            raster_image, raster_bounds = cluster.generate_raster_image(clean_pixels, labels, sorted_indices, req.k, polygon=req.polygon, zones=zones)
-            print(f"🖼️ Raster generated: {len(raster_image)} chars, bounds={raster_bounds}")
-        except Exception as raster_err:
-            print(f"⚠️ Raster generation failed (non-fatal): {raster_err}")
+        if deadline.allows("raster", "raster_render"):
+            try:
+                raster_image, raster_bounds = cluster.generate_raster_image(clean_pixels, labels, sorted_indices, k, polygon=req.polygon, zones=zones)
+                print(f"🖼️ Raster generated: {len(raster_image)} chars, bounds={raster_bounds}")
+            except deadline.DeadlineExceeded:
+                deadline.degrade("raster")
+            except Exception as raster_err:
+                print(f"⚠️ Raster generation failed (non-fatal): {raster_err}")
         
-        return {
+        result = {
             "zones": zones,
             "raster_image": raster_image,
-            "raster_bounds": raster_bounds
+            "raster_bounds": raster_bounds,
+            **extra
         }
+        if deadline.degraded():
+            result["degraded"] = deadline.degraded()
+        else:
+            remember_result("cluster", last_key, result)
+        return result
+    except (deadline.DeadlineExceeded, ee_gateway.CircuitOpen) as e:
+        # Binary formats are encoded per request: only JSON results are kept for stale serving
+        return stale_result("cluster", last_key if fmt == encoding.JSON else None, e)
     except Exception as e:
         raise HTTPException(status_code=503, detail=f"Zonas de manejo indisponíveis: {str(e)}")
+
+@app.post("/cluster/stability")
+@profiling.profiled
+def cluster_stability(req: StabilityRequest, accept: Optional[str] = Header(None)):
+    """
+    Zone stability from the class grids stored by previous /cluster runs (no Earth Engine call).
+    Grids are row-major, top row first, over "bounds":
+    modal/current: productivity class index into "classes" (255 = outside the farm or never observed),
+    stability: % of the cell's runs spent in its modal class,
+    change: current class minus the previous run's class (-128 = no data).
+    """
+    fmt = negotiate_format(accept, SATELLITE_FORMATS)
+    farm_key = state_store.farm_key(req.farm_id, req.lat, req.lon, req.size, req.polygon)
+    tracing.annotate(farm=farm_key)
+    maps = zone_stability.stability_maps(stability_key(farm_key, req.features))
+    if maps is None:
+        raise HTTPException(status_code=404, detail="Nenhum histórico de zonas para esta fazenda. Execute /cluster primeiro.")
+
+    maps["stability"] = np.rint(maps["stability"] * 100).astype(np.uint8)
+    payload = {key: value.tolist() if isinstance(value, np.ndarray) else value for key, value in maps.items()}
+    if fmt == encoding.MSGPACK:
+        body, encode_ms = encoding.timed_encode(encoding.encode_msgpack, payload)
+        return binary_response(body, fmt, encode_ms, "/cluster/stability")
+    return payload
+
+def cluster_from_cube(req, farm_key, clustering):
+    """Temporal zoning: update the farm's NDVI pixel cube (new windows only) and cluster the season's profiles."""
+    roi = cluster.build_roi(req.lat, req.lon, req.size, req.polygon)
+    plan = cluster.plan_sampling(cluster.roi_area_m2(req.size, req.polygon))
+    cube, fetched = pixel_cube.update_cube(
+        farm_key, roi, state_store.roi_key(req.lat, req.lon, req.size, req.polygon), plan["scale"],
+        season_days=req.season_days or pixel_cube.SEASON_DAYS)
+    lats, lons, values, days = pixel_cube.season_slice(cube, season_days=req.season_days or pixel_cube.SEASON_DAYS)
+
+    state_key = f"{farm_key}-temporal-k{req.k}"
+    zones, labels, sorted_indices, clean_pixels = cluster.cluster_temporal(
+        lats, lons, values, days, req.k, engine=req.engine,
+        previous=state_store.load_json("centroids", state_key), diagnostics=clustering)
+    save_centroids(state_key, clustering.pop("state"))
+
+    cube_info = {"windows": int(values.shape[0]), "pixels": int(values.shape[1]),
+                 "fetched_windows": fetched, "step_days": pixel_cube.STEP_DAYS,
+                 "composite_end": pixel_cube.window_dates(max(cube["meta"]["windows"]))[1].isoformat()}
+    return zones, labels, sorted_indices, clean_pixels, cube_info
+
+def stability_key(farm_key, features):
+    return f"{farm_key}-temporal" if features == "temporal" else farm_key
+
+def record_stability(req, farm_key, clean_pixels, labels, sorted_indices, zones, k, composite_date):
+    """
+    Adds this run's productivity-class grid to the farm's stability history (non-fatal).
+    One run per (composite date, engine, k, features): repeats of the same composite are not counted.
+    """
+    try:
+        classes, bounds = zone_stability.class_grid(clean_pixels, labels, sorted_indices, zones, k,
+                                                    req.lat, req.lon, req.size, req.polygon)
+        run_id = f"{composite_date}|{req.engine or 'auto'}|k{k}|{req.features or 'spatial'}"
+        summary = zone_stability.record_run(stability_key(farm_key, req.features), classes, bounds, run_id)
+        return {key: summary[key] for key in ("runs", "mean_stability", "changed_fraction")}
+    except Exception as state_err:
+        print(f"⚠️ Could not update zone stability (non-fatal): {state_err}")
+        return None
+
+def save_centroids(key, state):
+    try:
+        state_store.save_json("centroids", key, state)
+    except OSError as state_err:
+        print(f"⚠️ Could not persist centroids (non-fatal): {state_err}")
+
+def encode_cluster_response(fmt, req, k, zones, labels, sorted_indices, clean_pixels, extra=None):
+    """Compact (non-JSON) /cluster responses: overlay bytes, label grid, MessagePack or Arrow."""
+    if fmt == encoding.ARROW:
+        body, encode_ms = encoding.timed_encode(encoding.encode_zone_table, zones, clean_pixels, labels, sorted_indices,
+                                                cluster.grid_bounds(clean_pixels))
+        return binary_response(body, fmt, encode_ms, "/cluster")
+
+    grid, mask, bounds = cluster.render_zone_grid(clean_pixels, labels, sorted_indices, k, polygon=req.polygon)
+    bounds_header = {"X-Raster-Bounds": json.dumps(bounds)}
+
+    if fmt == encoding.LABEL_GRID:
+        if mask is not None:
+            grid = np.where(mask > 0, grid, cluster.NO_ZONE).astype(np.uint8)
+        body, encode_ms = encoding.timed_encode(encoding.encode_label_grid, grid, k, bounds)
+        return binary_response(body, fmt, encode_ms, "/cluster", bounds_header)
+
+    img = cluster.paint_zone_grid(grid, cluster.zone_colors_rgba(zones, k), mask)
+    if fmt in (encoding.PNG, encoding.WEBP):
+        body, encode_ms = encoding.timed_encode(encoding.encode_overlay, img, fmt)
+        return binary_response(body, fmt, encode_ms, "/cluster", bounds_header)
+
+    # MessagePack: same shape as the JSON response, with the overlay as raw palette PNG bytes
+    started = time.perf_counter()
+    payload = {
+        "zones": zones,
+        "raster_image": encoding.encode_overlay(img, encoding.PNG),
+        "raster_format": encoding.PNG,
+        "raster_bounds": bounds,
+        **(extra or {})
+    }
+    body = encoding.encode_msgpack(payload)
+    return binary_response(body, fmt, (time.perf_counter() - started) * 1000, "/cluster")
+
+# --- Async jobs ---------------------------------------------------------------------------
+
+class JobRequest(BaseModel):
+    kind: str  # "satellite", "cluster" or "backfill"
+    request: dict  # SatelliteRequest fields (satellite, backfill) or ClusterRequest fields (cluster)
+    months: Optional[int] = 6  # backfill: one 30-day window per month, going back this many months
+
+def run_satellite_job(payload, progress):
+    req = SatelliteRequest(**payload["request"])
+    with ee_registry.request_scope("/jobs/satellite"), tracing.span("job satellite"):
+        return satellite_result(req, encoding.JSON)
+
+def run_cluster_job(payload, progress):
+    req = ClusterRequest(**payload["request"])
+    with ee_registry.request_scope("/jobs/cluster"), tracing.span("job cluster"):
+        return cluster_result(req, encoding.JSON)
+
+def run_backfill_job(payload, progress):
+    """Past readings, one 30-day window per month (what scripts/backfill_readings.ts runs one by one)."""
+    req = SatelliteRequest(**payload["request"])
+    months = payload["months"]
+    now = datetime.datetime.now()
+    readings = []
+    with tracing.span("job backfill", months=months):
+        for i in range(1, months + 1):
+            end_date = now - datetime.timedelta(days=30 * i)
+            progress((i - 1) / months, f"Janela até {end_date.strftime('%Y-%m-%d')} ({i}/{months})")
+            with ee_registry.request_scope("/jobs/backfill"):
+                result = run_analyze_farm(req, end_date=end_date)
+            readings.append(result)
+    failed = sum(1 for r in readings if "error" in r)
+    return {"months": months, "failed": failed, "readings": readings}
+
+JOB_RUNNERS = {
+    "satellite": (SatelliteRequest, run_satellite_job),
+    "cluster": (ClusterRequest, run_cluster_job),
+    "backfill": (SatelliteRequest, run_backfill_job),
+}
+
+@app.post("/jobs", status_code=202)
+def submit_job(req: JobRequest):
+    """Queues long-running work and returns its id at once; the same payload returns the existing job."""
+    if req.kind not in JOB_RUNNERS:
+        raise HTTPException(status_code=400, detail=f"Tipo de job desconhecido: {req.kind} (use {', '.join(JOB_RUNNERS)})")
+    model, runner = JOB_RUNNERS[req.kind]
+    try:
+        request = jsonable_encoder(model(**req.request))
+    except ValidationError as e:
+        raise HTTPException(status_code=422, detail=jsonable_encoder(e.errors()))
+    payload = {"request": request}
+    if req.kind == "backfill":
+        payload["months"] = max(1, min(req.months or 6, 24))
+    key = coalesce.request_key("/jobs", req.kind, payload, datetime.date.today())
+    job, existing = jobs.submit(req.kind, payload, key, runner)
+    job.pop("result", None)
+    return {**job, "existing": existing, "poll": f"/jobs/{job['id']}", "events": f"/jobs/{job['id']}/events"}
+
+@app.get("/jobs/{job_id}")
+def get_job(job_id: str):
+    job = jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job não encontrado (ou expirado)")
+    return job
+
+@app.get("/jobs/{job_id}/events")
+async def job_events(job_id: str):
+    """Server-sent events: a `progress` event on every change, then `done`/`failed` with the job."""
+    import asyncio
+
+    if jobs.get(job_id) is None:
+        raise HTTPException(status_code=404, detail="Job não encontrado (ou expirado)")
+
+    async def stream():
+        last = None
+        while True:
+            job = await asyncio.to_thread(jobs.get, job_id)
+            if job is None:
+                yield "event: failed\ndata: {\"error\": \"expired\"}\n\n"
+                return
+            if job["status"] in jobs.FINISHED:
+                yield f"event: {job['status']}\ndata: {json.dumps(jsonable_encoder(job))}\n\n"
+                return
+            state = (job["status"], job["progress"], job["message"])
+            if state != last:
+                last = state
+                body = {key: job[key] for key in ("id", "status", "progress", "message")}
+                yield f"event: progress\ndata: {json.dumps(body)}\n\n"
+            await asyncio.sleep(1)
+
+    return StreamingResponse(stream(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
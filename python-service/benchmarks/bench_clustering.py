@@ -0,0 +1,95 @@
+"""
+Full KMeans vs the chunked MiniBatchKMeans engine and the geometric kdtree
+(recursive bisection) zoning on synthetic fields.
+
+Reports wall time, peak RSS (each run in a fresh process) and zone agreement with
+full KMeans (adjusted Rand index, inertia ratio). On square, uniform-density fields
+several partitions have the same inertia, so a low ARI with an inertia ratio near
+1.0 means an equally good (rotated) zoning rather than a worse one.
+
+Also compares warm-started runs (seeded with the previous run's centroids, as
+/cluster does for a farm between syncs) against cold runs: iterations and latency.
+
+Usage: python benchmarks/bench_clustering.py [--sizes 10000 100000 1000000] [--k 3]
+"""
+import argparse
+import multiprocessing
+import os
+import resource
+import sys
+import time
+
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+
+def normalized_field(n, seed=42):
+    from synthetic import synthetic_field
+    lats, lons, _, _ = synthetic_field(n, seed=seed)
+    # Jitter positions a little so consecutive "syncs" are not identical
+    rng = np.random.default_rng(seed)
+    lats = lats + rng.normal(0, 1e-5, n)
+    lons = lons + rng.normal(0, 1e-5, n)
+    return np.column_stack(((lats - lats.min()) / np.ptp(lats), (lons - lons.min()) / np.ptp(lons)))
+
+
+def run_engine(args):
+    """Runs in a child process so ru_maxrss is the peak of this engine alone."""
+    engine, n, k = args
+    import cluster
+
+    data = normalized_field(n)
+    started = time.perf_counter()
+    labels, centers, _ = cluster.fit_zones(data, k, engine)
+    elapsed = time.perf_counter() - started
+    inertia = float(((data - centers[labels]) ** 2).sum())
+    peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024  # KiB on Linux
+    return {"engine": engine, "n": n, "seconds": elapsed, "peak_rss_mb": peak_mb,
+            "inertia": inertia, "labels": labels}
+
+
+def warm_vs_cold(n, k, engine="kmeans"):
+    import cluster
+
+    previous_sync = normalized_field(n, seed=1)
+    _, _, info = cluster.fit_zones(previous_sync, k, engine)
+    data = normalized_field(n, seed=2)
+    rows = []
+    for mode, previous in (("cold", None), ("warm", info["state"])):
+        _, _, run = cluster.fit_zones(data, k, engine, previous=previous)
+        rows.append((mode, run["mode"], run["n_iter"], run["elapsed_ms"], run["inertia"]))
+    return rows
+
+
+def main():
+    from sklearn.metrics import adjusted_rand_score
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000, 1000000])
+    parser.add_argument("--k", type=int, default=3)
+    parser.add_argument("--engines", nargs="+", default=["kmeans", "minibatch", "kdtree"])
+    args = parser.parse_args()
+
+    ctx = multiprocessing.get_context("spawn")
+    print(f"{'pixels':>10}  {'engine':<10} {'time (s)':>9} {'peak RSS':>10} {'ARI':>6} {'inertia x':>9}")
+    for n in args.sizes:
+        results = {}
+        for engine in ["kmeans"] + [e for e in args.engines if e != "kmeans"]:
+            with ctx.Pool(1, maxtasksperchild=1) as pool:
+                results[engine] = pool.apply(run_engine, ((engine, n, args.k),))
+        reference = results["kmeans"]
+        for engine, r in results.items():
+            ari = adjusted_rand_score(reference["labels"], r["labels"])
+            ratio = r["inertia"] / reference["inertia"]
+            print(f"{n:>10,d}  {engine:<10} {r['seconds']:>9.2f} {r['peak_rss_mb']:>8.0f}MB {ari:>6.3f} {ratio:>9.3f}")
+
+    print(f"\n{'pixels':>10}  {'run':<6} {'mode':<14} {'iters':>6} {'ms':>9} {'inertia':>10}")
+    for n in args.sizes:
+        for requested, mode, n_iter, elapsed_ms, inertia in warm_vs_cold(n, args.k):
+            print(f"{n:>10,d}  {requested:<6} {mode:<14} {n_iter:>6} {elapsed_ms:>9.1f} {inertia:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
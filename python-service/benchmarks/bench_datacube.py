@@ -0,0 +1,82 @@
+"""
+Read latency of the per-farm datacube for full-season queries, loose chunks vs packed,
+against re-downloading (simulated with a fixed per-request latency).
+
+Usage: python benchmarks/bench_datacube.py [--size 400] [--steps 12] [--repeat 5] [--fetch-ms 4000]
+"""
+import argparse
+import datetime
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+STATE_DIR = tempfile.mkdtemp(prefix="yvy-datacube-")
+os.environ["YVY_STATE_DIR"] = STATE_DIR
+os.environ["DATACUBE_COMPACT_AFTER"] = "1000"  # compaction is triggered explicitly below
+import cluster
+import datacube
+import local_raster
+from synthetic import synthetic_bands
+
+LAT, LON = -15.78, -47.93
+
+
+def measure(fn, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - started) * 1000)
+    return round(float(np.median(timings)), 2)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size", type=float, default=400, help="farm size (ha)")
+    parser.add_argument("--steps", type=int, default=12, help="time steps in the season")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--fetch-ms", type=float, default=4000, help="assumed latency of one EE download")
+    args = parser.parse_args()
+
+    key = "bench"
+    bounds = local_raster.expand_bounds(cluster.roi_bounds(LAT, LON, args.size), local_raster.CONTEXT_FACTOR)
+    end_date = datetime.datetime(2026, 10, 1)
+    fetch = lambda grid, start, end, bands: synthetic_bands(grid, bands, seed=start.toordinal())
+    index, fetched = datacube.sync(key, bounds, "bench", end_date, days=args.steps * datacube.STEP_DAYS, fetch=fetch)
+    grid = index["grid"]
+    mask = local_raster.roi_mask(grid, LAT, LON, args.size)
+    season = datacube.steps_for_days(end_date, args.steps * datacube.STEP_DAYS)
+    last_30 = datacube.steps_for_days(end_date, 30)
+
+    queries = [
+        ("season time series (index means)", lambda: datacube.time_series(key, mask)),
+        ("season NDVI stack", lambda: [np.asarray(datacube.read_step(key, s)["B8"]) for s in season]),
+        ("30-day composite (all bands)", lambda: datacube.composite(key, last_30)),
+        ("single step read", lambda: {b: np.asarray(v) for b, v in datacube.read_step(key, season[-1]).items()}),
+    ]
+
+    print(f"Grid {grid['width']}x{grid['height']} @ {grid['scale']}m, {len(index['bands'])} bands, "
+          f"{len(fetched)} steps, {datacube.size_bytes(key) / 1e6:.1f}MB on disk")
+    loose = {name: measure(fn, args.repeat) for name, fn in queries}
+    # Make every step complete so compaction packs the whole season
+    index = datacube.load_index(key)
+    for entry in index["steps"].values():
+        entry["complete"] = True
+    datacube.compact(key, index)
+    packed = {name: measure(fn, args.repeat) for name, fn in queries}
+
+    print(f"\n{'query':36} {'loose ms':>10} {'packed ms':>10} {'re-download ms':>15}")
+    for name, _ in queries:
+        downloads = len(season) if "season" in name else (len(last_30) if "30-day" in name else 1)
+        print(f"{name:36} {loose[name]:>10} {packed[name]:>10} {downloads * args.fetch_ms:>15.0f}")
+    shutil.rmtree(STATE_DIR, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""
+Bytes on the wire and encode time for each /cluster response format.
+
+Usage: python benchmarks/bench_encoding.py [--pixels 4000] [--k 3] [--repeat 5]
+"""
+import argparse
+import base64
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+import cluster
+import encoding
+from synthetic import synthetic_pixels
+
+
+def measure(name, fn, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        body = fn()
+        timings.append((time.perf_counter() - started) * 1000)
+    return {"format": name, "bytes": len(body), "encode_ms": round(float(np.median(timings)), 2)}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--pixels", type=int, default=4000)
+    parser.add_argument("--k", type=int, default=3)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    pixels = synthetic_pixels(args.pixels)
+    zones, labels, sorted_indices, clean = cluster.cluster_pixels(pixels, args.k, return_internals=True)
+    grid, mask, bounds = cluster.render_zone_grid(clean, labels, sorted_indices, args.k)
+    img = cluster.paint_zone_grid(grid, cluster.zone_colors_rgba(zones, args.k), mask)
+
+    def json_body():
+        raster, raster_bounds = cluster.generate_raster_image(clean, labels, sorted_indices, args.k, zones=zones)
+        return json.dumps({"zones": zones, "raster_image": raster, "raster_bounds": raster_bounds}).encode()
+
+    def rgba_png():
+        raster, _ = cluster.generate_raster_image(clean, labels, sorted_indices, args.k, zones=zones)
+        return base64.b64decode(raster.split(",", 1)[1])
+
+    cases = [
+        ("json (base64 RGBA PNG)", json_body),
+        ("rgba png (raw)", rgba_png),
+        (encoding.PNG + " (palette)", lambda: encoding.encode_overlay(img, encoding.PNG)),
+        (encoding.WEBP, lambda: encoding.encode_overlay(img, encoding.WEBP)),
+        (encoding.LABEL_GRID, lambda: encoding.encode_label_grid(grid, args.k, bounds)),
+    ]
+    if encoding.is_available(encoding.MSGPACK):
+        cases.append((encoding.MSGPACK, lambda: encoding.encode_msgpack({
+            "zones": zones, "raster_image": encoding.encode_overlay(img), "raster_bounds": bounds})))
+    if encoding.is_available(encoding.ARROW):
+        cases.append((encoding.ARROW, lambda: encoding.encode_zone_table(zones, clean, labels, sorted_indices, bounds)))
+
+    results = [measure(name, fn, args.repeat) for name, fn in cases]
+    width = max(len(r["format"]) for r in results)
+    for r in results:
+        print(f"{r['format']:<{width}}  {r['bytes']:>10,d} B  {r['encode_ms']:>8.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
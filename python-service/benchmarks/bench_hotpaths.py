@@ -0,0 +1,215 @@
+"""
+Latency percentiles, throughput and peak memory for the service hot paths, per function
+(build_features, the /predict training + forecast loop, cluster_pixels, generate_raster_image,
+JSON serialization) and per endpoint (/predict, /cluster, /satellite handlers in-process,
+Earth Engine replaced by the fake backend).
+
+Results are written as JSON; with --baseline each case is compared against a stored run
+and the script exits 1 when p50 latency or peak memory grew by more than --tolerance.
+
+Usage: python benchmarks/bench_hotpaths.py [--quick] [--only cluster] [--out results.json]
+                                           [--baseline benchmarks/baseline.json] [--save-baseline]
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+# Endpoints run against the offline Earth Engine stand-in and a throwaway state dir
+os.environ.setdefault("EE_BACKEND", "fake")
+os.environ.setdefault("YVY_STATE_DIR", tempfile.mkdtemp(prefix="yvy-bench-"))
+# Hot-path timings should not include the EE gateway's rate limit
+os.environ.setdefault("EE_RATE_PER_S", "0")
+from synthetic import synthetic_farm, synthetic_history
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+LAT, LON = -15.78, -47.93
+
+
+def measure(fn, repeat, items=1, warmup=1):
+    """Runs fn warmup + repeat times; latency percentiles (ms), items/s at p50 and peak traced memory."""
+    for _ in range(warmup):
+        fn()
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - started) * 1000)
+    # Separate traced run: tracemalloc slows allocation-heavy code, so it is kept out of the timings
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    p50, p95, p99 = np.percentile(timings, [50, 95, 99])
+    return {
+        "p50_ms": round(float(p50), 2), "p95_ms": round(float(p95), 2), "p99_ms": round(float(p99), 2),
+        "mean_ms": round(float(np.mean(timings)), 2),
+        "throughput_per_s": round(items / (p50 / 1000), 1) if p50 > 0 else None,
+        "items": items,
+        "peak_mb": round(peak / 1e6, 2),
+        "repeat": repeat,
+    }
+
+
+def farm_pixels(n):
+    lats, lons, ndvi, ndwi = synthetic_farm(n)
+    return [{"lat": float(a), "lon": float(b), "ndvi": float(v), "ndwi": float(w)}
+            for a, b, v, w in zip(lats, lons, ndvi, ndwi)]
+
+
+def function_cases(sizes, history_sizes):
+    import pandas as pd
+    import app
+    import cluster
+
+    cases = []
+    for n in history_sizes:
+        history = synthetic_history(n)
+
+        def features(history=history):
+            df = pd.DataFrame(history)
+            df["date"] = pd.to_datetime(df["date"])
+            return app.build_features(df)
+
+        cases.append((f"build_features[{n}]", features, n))
+        cases.append((f"predict_loop[{n}]",
+                      lambda history=history: predict({"history": history, "target_date": history[-1]["date"],
+                                                       "forecast_days": 90}), n))
+
+    for n in sizes:
+        pixels = farm_pixels(n)
+        zones, labels, sorted_indices, clean = quietly(cluster.cluster_pixels, pixels, 3, return_internals=True)
+        cases.append((f"cluster_pixels[{n}]", lambda pixels=pixels: cluster.cluster_pixels(pixels, 3), n))
+        cases.append((f"generate_raster_image[{n}]",
+                      lambda clean=clean, labels=labels, idx=sorted_indices, zones=zones:
+                      cluster.generate_raster_image(clean, labels, idx, 3, zones=zones), n))
+        raster, bounds = quietly(cluster.generate_raster_image, clean, labels, sorted_indices, 3, zones=zones)
+        body = {"zones": zones, "raster_image": raster, "raster_bounds": bounds}
+        cases.append((f"json_serialize_cluster[{n}]", lambda body=body: json.dumps(body).encode(), n))
+        cases.append((f"json_serialize_pixels[{n}]", lambda pixels=pixels: json.dumps(pixels).encode(), n))
+    return cases
+
+
+def endpoint_cases(size_ha):
+    """Handlers called in-process (no HTTP), bodies serialized the way FastAPI returns them."""
+    import app
+    from fastapi.encoders import jsonable_encoder
+
+    def respond(result):
+        if hasattr(result, "body"):
+            return result.body
+        return json.dumps(jsonable_encoder(result)).encode()
+
+    history = synthetic_history(120)
+    cluster_req = app.ClusterRequest(farm_id=1, lat=LAT, lon=LON, size=size_ha)
+    satellite_req = app.SatelliteRequest(farm_id=1, lat=LAT, lon=LON, size=size_ha)
+    return [
+        ("POST /predict", lambda: respond(predict({"history": history, "target_date": history[-1]["date"]})), 1),
+        ("POST /cluster", lambda: respond(app.analyze_cluster(cluster_req, accept=None)), 1),
+        ("POST /satellite", lambda: respond(app.analyze_satellite(satellite_req, accept=None)), 1),
+    ]
+
+
+def predict(body):
+    import app
+
+    result = asyncio.run(app.predict_ndvi(app.PredictionRequest(**body)))
+    if "error" in result:
+        raise RuntimeError(result["error"])
+    return result
+
+
+def quietly(fn, *args, **kwargs):
+    """The service logs every step to stdout; keep it out of the benchmark output."""
+    with contextlib.redirect_stdout(io.StringIO()):
+        return fn(*args, **kwargs)
+
+
+def compare(results, baseline, tolerance):
+    """Cases whose p50 latency or peak memory exceeds the baseline by more than tolerance."""
+    regressions = []
+    for name, r in results.items():
+        base = baseline.get("results", {}).get(name)
+        if not base:
+            continue
+        for metric in ("p50_ms", "peak_mb"):
+            # Floor of 1 (ms or MB) so noise on tiny cases is not flagged
+            before = max(base[metric], 1.0)
+            if r[metric] > before * (1 + tolerance):
+                regressions.append((name, metric, before, r[metric]))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000, 1000000], help="pixels per farm")
+    parser.add_argument("--history", type=int, nargs="+", default=[30, 365], help="readings per /predict history")
+    parser.add_argument("--size-ha", type=float, default=100, help="farm size for the endpoint cases")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--quick", action="store_true", help="small sizes, for CI smoke runs")
+    parser.add_argument("--only", nargs="+", help="run cases whose name contains any of these")
+    parser.add_argument("--skip-endpoints", action="store_true")
+    parser.add_argument("--out", default="bench_hotpaths.json")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--save-baseline", action="store_true", help="write this run as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed relative growth before flagging")
+    args = parser.parse_args()
+    if args.quick:
+        args.sizes, args.history, args.repeat = [5000], [30], 3
+
+    cases = quietly(function_cases, args.sizes, args.history)
+    if not args.skip_endpoints:
+        cases += quietly(endpoint_cases, args.size_ha)
+    if args.only:
+        cases = [c for c in cases if any(word in c[0] for word in args.only)]
+
+    results = {}
+    print(f"{'case':<34} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'items/s':>12} {'peak MB':>8}")
+    for name, fn, items in cases:
+        r = quietly(measure, fn, args.repeat, items=items)
+        results[name] = r
+        throughput = f"{r['throughput_per_s']:,.0f}" if r["throughput_per_s"] else "-"
+        print(f"{name:<34} {r['p50_ms']:>9.2f} {r['p95_ms']:>9.2f} {r['p99_ms']:>9.2f} {throughput:>12} {r['peak_mb']:>8.1f}")
+
+    run = {
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "ee_backend": os.environ["EE_BACKEND"],
+        "results": results,
+    }
+    with open(args.out, "w") as f:
+        json.dump(run, f, indent=2)
+    print(f"\nResults written to {args.out}")
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(run, f, indent=2)
+        print(f"Baseline saved to {args.baseline}")
+        return
+    if not os.path.exists(args.baseline):
+        print(f"No baseline at {args.baseline}; run with --save-baseline to create one")
+        return
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    regressions = compare(results, baseline, args.tolerance)
+    for name, metric, before, after in regressions:
+        print(f"⚠️ REGRESSION {name} {metric}: {before} -> {after} (+{(after / before - 1) * 100:.0f}%)")
+    if regressions:
+        sys.exit(1)
+    print(f"No regressions against {args.baseline} (tolerance {args.tolerance:.0%})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,337 @@
+"""
+End-to-end load test: starts the service under uvicorn with the fake Earth Engine backend,
+drives /predict, /cluster and /satellite with a weighted request mix from N concurrent
+clients (closed loop), and samples CPU and RSS of the server processes while it runs.
+
+Every (workers, threadpool) configuration is swept over the --concurrency levels; the
+report gives throughput, p50/p95/p99 latency and error rate per level, per endpoint, and
+where throughput stops growing (the saturation point). Full results, including the
+CPU/RSS time series, are written as JSON.
+
+The fake backend evaluates its synthetic scenes inside the server processes, so part of the
+server CPU is the stand-in's, not the service's: each level reports the fake's CPU
+("fake %", share of the server CPU) from what the workers write to EE_FAKE_CPU_DIR.
+
+Usage: python benchmarks/loadtest.py [--workers 1 2 4] [--threadpool 40] [--concurrency 1 4 16 32]
+                                     [--mix predict=5 cluster=3 satellite=2] [--duration 30]
+                                     [--ee-latency 300-800] [--env CLUSTER_SPECULATIVE_FETCH=1]
+"""
+import argparse
+import http.client
+import itertools
+import json
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+
+import numpy as np
+
+SERVICE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from synthetic import synthetic_history
+
+LAT, LON = -15.78, -47.93
+CLOCK_TICKS = os.sysconf("SC_CLK_TCK")
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+
+
+def request_bodies(farms, seed=0):
+    """Request body generators per endpoint; farms spread over ~50km so caches see distinct ROIs."""
+    rng = random.Random(seed)
+    sites = [(LAT + rng.uniform(-0.25, 0.25), LON + rng.uniform(-0.25, 0.25), rng.choice([20, 100, 400]))
+             for _ in range(farms)]
+    histories = [synthetic_history(n, seed=i) for i, n in enumerate([30, 90, 365])]
+
+    def farm(rng):
+        i = rng.randrange(farms)
+        lat, lon, size = sites[i]
+        return {"farm_id": 10000 + i, "lat": lat, "lon": lon, "size": size}
+
+    return {
+        "predict": lambda rng: {"history": rng.choice(histories), "target_date": "2026-01-01", "forecast_days": 30},
+        "cluster": lambda rng: {**farm(rng), "k": 3},
+        "satellite": farm,
+    }
+
+
+# --- server ---------------------------------------------------------------------------------
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(workers, threadpool, env_overrides, ee_latency, failure_rate):
+    port = free_port()
+    state_dir = tempfile.mkdtemp(prefix="yvy-load-")
+    env = dict(os.environ, EE_BACKEND="fake", YVY_STATE_DIR=state_dir, EE_FAKE_LATENCY_MS=ee_latency,
+               EE_FAKE_FAILURE_RATE=str(failure_rate), THREADPOOL_SIZE=str(threadpool or 0),
+               EE_FAKE_CPU_DIR=os.path.join(state_dir, "fake_cpu"), **env_overrides)
+    cmd = [sys.executable, "-m", "uvicorn", "app:app", "--host", "127.0.0.1", "--port", str(port),
+           "--workers", str(workers), "--log-level", "warning"]
+    # stderr goes to a file: an unread pipe fills up with the service's warnings and blocks the server
+    log_path = os.path.join(state_dir, "server.log")
+    with open(log_path, "wb") as log:
+        proc = subprocess.Popen(cmd, cwd=SERVICE_DIR, env=env, stdout=subprocess.DEVNULL, stderr=log)
+    base_url = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + 120
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            with open(log_path, "rb") as log:
+                raise RuntimeError(f"uvicorn exited: {log.read().decode(errors='replace')[-2000:]}")
+        try:
+            with urllib.request.urlopen(base_url + "/ping", timeout=2):
+                return proc, base_url, state_dir
+        except OSError:
+            time.sleep(0.5)
+    proc.kill()
+    raise RuntimeError("uvicorn did not answer /ping within 120s")
+
+
+def stop_server(proc, state_dir):
+    proc.terminate()
+    try:
+        proc.wait(timeout=15)
+    except subprocess.TimeoutExpired:
+        proc.kill()
+    shutil.rmtree(state_dir, ignore_errors=True)
+
+
+def process_tree(root):
+    """root and all its descendants (uvicorn master + worker processes), from /proc."""
+    children = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        children.setdefault(ppid, []).append(int(entry))
+    tree, stack = [], [root]
+    while stack:
+        pid = stack.pop()
+        tree.append(pid)
+        stack.extend(children.get(pid, []))
+    return tree
+
+
+def cpu_seconds_and_rss(pid):
+    with open(f"/proc/{pid}/stat") as f:
+        fields = f.read().rsplit(")", 1)[1].split()
+    with open(f"/proc/{pid}/statm") as f:
+        resident = int(f.read().split()[1])
+    return (int(fields[11]) + int(fields[12])) / CLOCK_TICKS, resident * PAGE_SIZE
+
+
+def fake_cpu_seconds(state_dir):
+    """CPU seconds the workers spent in the fake EE backend so far (ee_backend EE_FAKE_CPU_DIR files)."""
+    directory = os.path.join(state_dir, "fake_cpu")
+    total = 0.0
+    for name in os.listdir(directory) if os.path.isdir(directory) else []:
+        if name.endswith(".json"):
+            try:
+                with open(os.path.join(directory, name)) as f:
+                    total += json.load(f)["cpu_s"]
+            except (OSError, ValueError, KeyError):
+                continue
+    return total
+
+
+class ResourceSampler(threading.Thread):
+    """Samples CPU% (sum over the tree, 100 = one core) and RSS of the server processes."""
+
+    def __init__(self, root_pid, interval=1.0):
+        super().__init__(daemon=True)
+        self.root_pid, self.interval = root_pid, interval
+        self.samples = []
+        self._done = threading.Event()
+        self._last = {}
+
+    def run(self):
+        started = time.monotonic()
+        while not self._done.wait(self.interval):
+            now = time.monotonic()
+            cpu_pct, rss, workers = 0.0, 0, 0
+            for pid in process_tree(self.root_pid):
+                try:
+                    cpu_s, pid_rss = cpu_seconds_and_rss(pid)
+                except (OSError, IndexError, ValueError):
+                    continue
+                last = self._last.get(pid)
+                if last:
+                    cpu_pct += (cpu_s - last[0]) / (now - last[1]) * 100
+                self._last[pid] = (cpu_s, now)
+                rss += pid_rss
+                workers += 1
+            self.samples.append({"t": round(now - started, 2), "cpu_pct": round(cpu_pct, 1),
+                                 "rss_mb": round(rss / 1e6, 1), "processes": workers})
+
+    def stop(self):
+        self._done.set()
+        self.join()
+
+
+# --- load generator -------------------------------------------------------------------------
+
+def run_level(base_url, concurrency, duration, mix, bodies, timeout, seed):
+    """Closed loop: each client sends its next request as soon as the previous one returns."""
+    endpoints = list(mix)
+    weights = [mix[e] for e in endpoints]
+    records = []
+    lock = threading.Lock()
+    stop_at = time.monotonic() + duration
+
+    def client(i):
+        rng = random.Random(seed * 1000 + i)
+        while time.monotonic() < stop_at:
+            endpoint = rng.choices(endpoints, weights)[0]
+            data = json.dumps(bodies[endpoint](rng)).encode()
+            req = urllib.request.Request(f"{base_url}/{endpoint}", data=data,
+                                         headers={"Content-Type": "application/json"})
+            started = time.monotonic()
+            status, error = 0, None
+            try:
+                with urllib.request.urlopen(req, timeout=timeout) as response:
+                    status = response.status
+                    body = response.read()
+                # The handlers report some failures in a 200 body ({"error": ...})
+                if body.startswith(b'{"error"'):
+                    error = "error body"
+            except urllib.error.HTTPError as e:
+                status, error = e.code, f"HTTP {e.code}"
+            except (OSError, http.client.HTTPException) as e:
+                error = type(e).__name__
+            with lock:
+                records.append({"endpoint": endpoint, "start": started, "ms": (time.monotonic() - started) * 1000,
+                                "status": status, "error": error})
+
+    threads = [threading.Thread(target=client, args=(i,), daemon=True) for i in range(concurrency)]
+    started = time.monotonic()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return records, time.monotonic() - started
+
+
+def summarize(records, elapsed):
+    def stats(rows):
+        ok = [r["ms"] for r in rows if r["error"] is None]
+        p50, p95, p99 = np.percentile(ok, [50, 95, 99]) if ok else (float("nan"),) * 3
+        return {"requests": len(rows), "throughput_rps": round(len(ok) / elapsed, 2),
+                "error_rate": round(1 - len(ok) / len(rows), 4) if rows else 0.0,
+                "p50_ms": round(float(p50), 1), "p95_ms": round(float(p95), 1), "p99_ms": round(float(p99), 1)}
+
+    summary = stats(records)
+    summary["endpoints"] = {endpoint: stats([r for r in records if r["endpoint"] == endpoint])
+                            for endpoint in sorted({r["endpoint"] for r in records})}
+    errors = {}
+    for r in records:
+        if r["error"]:
+            errors[r["error"]] = errors.get(r["error"], 0) + 1
+    summary["errors"] = errors
+    return summary
+
+
+def saturation_point(levels, gain=0.10):
+    """First concurrency whose throughput is less than `gain` above the previous level's."""
+    for prev, cur in zip(levels, levels[1:]):
+        if cur["throughput_rps"] < prev["throughput_rps"] * (1 + gain):
+            return prev["concurrency"]
+    return None
+
+
+def parse_pairs(values, cast=str):
+    pairs = {}
+    for value in values or []:
+        key, _, v = value.partition("=")
+        pairs[key.strip()] = cast(v)
+    return pairs
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, nargs="+", default=[1], help="uvicorn worker counts to compare")
+    parser.add_argument("--threadpool", type=int, nargs="+", default=[0],
+                        help="threads for sync endpoints per worker (0 = AnyIO default of 40)")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16, 32])
+    parser.add_argument("--mix", nargs="+", default=["predict=5", "cluster=3", "satellite=2"],
+                        help="endpoint=weight")
+    parser.add_argument("--duration", type=float, default=30, help="seconds per concurrency level")
+    parser.add_argument("--warmup", type=float, default=5, help="seconds of load discarded before each config")
+    parser.add_argument("--farms", type=int, default=50, help="distinct farms in /cluster and /satellite bodies")
+    parser.add_argument("--ee-latency", default="300-800", help="fake EE latency per round-trip (ms or lo-hi)")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="fake EE failure rate (0..1)")
+    parser.add_argument("--env", nargs="+", help="extra server env vars, KEY=VALUE")
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--sample-interval", type=float, default=1.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", default="loadtest.json")
+    args = parser.parse_args()
+
+    mix = parse_pairs(args.mix, float)
+    unknown = set(mix) - {"predict", "cluster", "satellite"}
+    if unknown:
+        parser.error(f"unknown endpoints in --mix: {', '.join(sorted(unknown))}")
+    bodies = request_bodies(args.farms, args.seed)
+    env_overrides = parse_pairs(args.env)
+
+    runs = []
+    for workers, threadpool in itertools.product(args.workers, args.threadpool):
+        label = f"workers={workers} threadpool={threadpool or 'default'}"
+        print(f"\n=== {label}, mix {mix}, EE latency {args.ee_latency}ms")
+        proc, base_url, state_dir = start_server(workers, threadpool, env_overrides, args.ee_latency, args.failure_rate)
+        sampler = ResourceSampler(proc.pid, args.sample_interval)
+        sampler.start()
+        levels = []
+        try:
+            if args.warmup > 0:
+                run_level(base_url, max(args.concurrency), args.warmup, mix, bodies, args.timeout, args.seed)
+            print(f"{'clients':>8} {'rps':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'errors':>7} "
+                  f"{'cpu %':>7} {'fake %':>7} {'rss MB':>8}")
+            for concurrency in args.concurrency:
+                since = len(sampler.samples)
+                fake_before = fake_cpu_seconds(state_dir)
+                records, elapsed = run_level(base_url, concurrency, args.duration, mix, bodies,
+                                             args.timeout, args.seed + concurrency)
+                level = {"concurrency": concurrency, "seconds": round(elapsed, 1), **summarize(records, elapsed)}
+                window = sampler.samples[since:]
+                level["cpu_pct_mean"] = round(float(np.mean([s["cpu_pct"] for s in window])), 1) if window else None
+                level["rss_mb_max"] = max((s["rss_mb"] for s in window), default=None)
+                # Fake EE CPU (100 = one core) and its share of the server CPU
+                level["fake_ee_cpu_pct"] = round((fake_cpu_seconds(state_dir) - fake_before) / elapsed * 100, 1)
+                level["fake_ee_cpu_share"] = (round(min(level["fake_ee_cpu_pct"] / level["cpu_pct_mean"], 1.0), 3)
+                                              if level["cpu_pct_mean"] else None)
+                levels.append(level)
+                print(f"{concurrency:>8} {level['throughput_rps']:>8.2f} {level['p50_ms']:>9.1f} "
+                      f"{level['p95_ms']:>9.1f} {level['p99_ms']:>9.1f} {level['error_rate']:>7.1%} "
+                      f"{level['cpu_pct_mean'] or 0:>7.0f} {level['fake_ee_cpu_share'] or 0:>7.0%} "
+                      f"{level['rss_mb_max'] or 0:>8.0f}")
+        finally:
+            sampler.stop()
+            stop_server(proc, state_dir)
+        saturation = saturation_point(levels)
+        print(f"Saturation: {f'~{saturation} clients' if saturation else 'not reached'}")
+        runs.append({"workers": workers, "threadpool": threadpool, "levels": levels,
+                     "saturation_concurrency": saturation, "resources": sampler.samples})
+
+    with open(args.out, "w") as f:
+        json.dump({"created_at": time.strftime("%Y-%m-%dT%H:%M:%S"), "mix": mix, "duration_s": args.duration,
+                   "ee_latency_ms": args.ee_latency, "failure_rate": args.failure_rate, "env": env_overrides,
+                   "runs": runs}, f, indent=2)
+    print(f"\nResults written to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
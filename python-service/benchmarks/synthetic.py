@@ -0,0 +1,82 @@
+"""Synthetic farm fields for benchmarks (no Earth Engine access needed)."""
+import numpy as np
+
+
+def synthetic_field(n, lat=-15.78, lon=-47.93, span=0.01, seed=42):
+    """
+    Regular grid of about n pixels around (lat, lon) with a west-east vigor gradient,
+    so zones land in different productivity classes. Returns (lats, lons, ndvi, ndwi) arrays.
+    """
+    rng = np.random.default_rng(seed)
+    side = int(np.ceil(np.sqrt(n)))
+    lats, lons = np.meshgrid(np.linspace(lat - span, lat + span, side), np.linspace(lon - span, lon + span, side))
+    lats, lons = lats.ravel()[:n], lons.ravel()[:n]
+    ndvi = 0.55 + 0.3 * (lons - lon) / span + rng.normal(0, 0.03, n)
+    ndwi = -0.2 + ndvi * 0.1 + rng.normal(0, 0.02, n)
+    return lats, lons, ndvi, ndwi
+
+
+def synthetic_pixels(n, **kwargs):
+    """Same field as synthetic_field, in the list-of-dicts shape returned by get_real_pixels."""
+    lats, lons, ndvi, ndwi = synthetic_field(n, **kwargs)
+    return [{"lat": float(a), "lon": float(b), "ndvi": float(v), "ndwi": float(w)}
+            for a, b, v, w in zip(lats, lons, ndvi, ndwi)]
+
+
+def synthetic_bands(grid, bands=None, seed=42, cloud_fraction=0.1):
+    """
+    Composite band arrays shaped like local_raster downloads for `grid` (see local_raster.raster_grid):
+    S2 reflectances with a west-east vigor gradient, S1 linear VV/VH, Landsat ST_B10 DN.
+    Cloudy S2 cells are set to the NODATA fill value, as computePixels returns them.
+    """
+    rng = np.random.default_rng(seed)
+    shape = (grid["height"], grid["width"])
+    vigor = np.broadcast_to(np.linspace(0.2, 0.9, shape[1]), shape) + rng.normal(0, 0.03, shape)
+    red = 0.12 - 0.08 * vigor
+    nir = 0.15 + 0.35 * vigor
+    arrays = {
+        "B2": red * 0.6, "B3": red * 0.9, "B4": red,
+        "B5": red + 0.4 * (nir - red) * 0.5, "B6": red + 0.7 * (nir - red), "B7": nir * 0.95,
+        "B8": nir, "B11": 0.25 - 0.1 * vigor,
+        "VV": 0.05 + 0.02 * vigor, "VH": 0.01 + 0.01 * vigor,
+        "ST_B10": np.full(shape, (303.15 - 149.0) / 0.00341802) + rng.normal(0, 100, shape),
+    }
+    cloudy = rng.random(shape) < cloud_fraction
+    for name in ("B2", "B3", "B4", "B5", "B6", "B7", "B8", "B11"):
+        arrays[name] = np.where(cloudy, -9999, arrays[name])
+    names = bands or list(arrays)
+    return {name: arrays[name].astype(np.float32) for name in names}
+
+
+def synthetic_farm(n, lat=-15.78, lon=-47.93, span=0.01, seed=42, cloud_fraction=0.05):
+    """
+    Vectorized successor of scripts/cluster.py's generate_mock_pixels, scaled to millions of pixels:
+    a healthier center, a few smooth management-zone blobs, planting-row stripes and
+    patchy cloud holes (NDVI below the cloud filter). Returns (lats, lons, ndvi, ndwi) arrays.
+    """
+    rng = np.random.default_rng(seed)
+    side = int(np.ceil(np.sqrt(n)))
+    y, x = np.meshgrid(np.linspace(-1, 1, side), np.linspace(-1, 1, side), indexing="ij")
+    y, x = y.ravel()[:n], x.ravel()[:n]
+    ndvi = 0.8 - 0.25 * np.sqrt(x ** 2 + y ** 2)
+    for cy, cx, radius, depth in rng.uniform([-1, -1, 0.15, -0.25], [1, 1, 0.45, 0.15], (4, 4)):
+        ndvi += depth * np.exp(-((x - cx) ** 2 + (y - cy) ** 2) / radius ** 2)
+    ndvi += 0.03 * np.sin(x * side * 0.8)  # planting rows
+    ndvi = np.clip(ndvi + rng.normal(0, 0.03, n), 0.1, 0.9)
+    # Clouds come in patches, not salt-and-pepper
+    cloud = np.sin(x * 7 + rng.uniform(0, 6)) * np.cos(y * 5 + rng.uniform(0, 6))
+    ndvi = np.where(cloud > 1 - 2 * cloud_fraction, 0.02, ndvi)
+    ndwi = -0.2 + ndvi * 0.1 + rng.normal(0, 0.02, n)
+    return lat + y * span, lon + x * span, ndvi, ndwi
+
+
+def synthetic_history(n, start="2024-01-01", every_days=5, seed=42):
+    """NDVI readings every few days with a seasonal cycle, in the /predict `history` shape."""
+    rng = np.random.default_rng(seed)
+    dates = np.datetime64(start) + np.arange(n) * every_days
+    day = (dates - dates.astype("datetime64[Y]")).astype(int)
+    ndvi = 0.55 + 0.25 * np.sin(2 * np.pi * (day - 30) / 365) + rng.normal(0, 0.03, n)
+    ndwi = -0.1 + 0.1 * ndvi + rng.normal(0, 0.02, n)
+    temperature = 25 + 4 * np.cos(2 * np.pi * day / 365) + rng.normal(0, 1, n)
+    return [{"date": str(d), "ndvi": round(float(v), 4), "ndwi": round(float(w), 4), "temperature": round(float(t), 1)}
+            for d, v, w, t in zip(dates, ndvi, ndwi, temperature)]
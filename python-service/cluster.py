@@ -2,20 +2,77 @@
 import argparse
 import json
 import base64
+import contextvars
 import io
+import math
+import os
+import time
 import numpy as np
-from sklearn.cluster import KMeans
+from sklearn.cluster import KMeans, MiniBatchKMeans
+import deadline
+import ee_gateway
+import metrics
+import tracing
+import zonal_stats
 
-def get_real_pixels(lat, lon, size_ha, polygon=None):
+# Target number of sampled pixels per fetch; bounds the sample().getInfo() payload size
+PIXEL_BUDGET = int(os.environ.get("CLUSTER_PIXEL_BUDGET", "5000"))
+MIN_SCALE_M = 20    # S2 is 10m; 20m was the historical default
+MAX_SCALE_M = 500
+MIN_PIXELS = 10
+EARTH_RADIUS_M = 6371008.8
+
+# Candidate compositing windows (days), in priority order
+DATE_WINDOWS = [30, 90, 180]
+
+# Issue all date windows concurrently instead of probing first (opt-in)
+SPECULATIVE_FETCH = os.environ.get("CLUSTER_SPECULATIVE_FETCH", "0") == "1"
+
+# Legacy progressive retry (days, scale), used only if the availability probe fails
+RETRY_ATTEMPTS = [
+    (30, 20),   # 30 days, 20m scale
+    (90, 30),   # 90 days, 30m scale  
+    (180, 50),  # 180 days, 50m scale
+]
+
+def roi_area_m2(size_ha, polygon=None):
+    """ROI area computed locally (shoelace on an equirectangular projection), no EE round-trip."""
+    if polygon and len(polygon) >= 3:
+        pts = np.array([c[:2] for c in polygon], dtype=float)
+        ref_lat = np.radians(pts[:, 1].mean())
+        x = np.radians(pts[:, 0]) * EARTH_RADIUS_M * np.cos(ref_lat)
+        y = np.radians(pts[:, 1]) * EARTH_RADIUS_M
+        return float(0.5 * abs(np.dot(x, np.roll(y, -1)) - np.dot(y, np.roll(x, -1))))
+    return float(size_ha or 0) * 10000
+
+def roi_bounds(lat, lon, size_ha, polygon=None):
+    """Fixed [[lat_min, lon_min], [lat_max, lon_max]] box of the ROI (polygon bbox or circle bbox)."""
+    if polygon and len(polygon) >= 3:
+        pts = np.array([c[:2] for c in polygon], dtype=float)
+        return [[float(pts[:, 1].min()), float(pts[:, 0].min())], [float(pts[:, 1].max()), float(pts[:, 0].max())]]
+    radius_m = math.sqrt(float(size_ha or 0) * 10000 / math.pi)
+    dlat = math.degrees(radius_m / EARTH_RADIUS_M)
+    dlon = dlat / max(math.cos(math.radians(lat)), 1e-6)
+    return [[lat - dlat, lon - dlon], [lat + dlat, lon + dlon]]
+
+def plan_sampling(area_m2, pixel_budget=None):
     """
-    Fetches real Sentinel-2 pixels from Google Earth Engine for clustering.
-    No mock fallback — raises an exception if GEE data is unavailable.
+    Picks the sampling scale so that the ROI yields about `pixel_budget` pixels.
+    Scale is rounded up to 10m steps and clamped to [MIN_SCALE_M, MAX_SCALE_M].
     """
-    import satellite_analysis
-    import ee
-    import datetime
-    import math
-    
+    budget = pixel_budget or PIXEL_BUDGET
+    scale = math.sqrt(max(area_m2, 1.0) / budget)
+    scale = int(min(MAX_SCALE_M, max(MIN_SCALE_M, math.ceil(scale / 10) * 10)))
+    return {
+        "scale": scale,
+        "expected_pixels": int(area_m2 / scale ** 2),
+        "pixel_budget": budget
+    }
+
+def build_roi(lat, lon, size_ha, polygon=None):
+    """EE geometry for the farm: polygon if available, else circular buffer of size_ha."""
+    from ee_backend import ee
+
     # Ensure EE is initialized
     try:
         if not ee.data._credentials:
@@ -33,29 +90,348 @@ def get_real_pixels(lat, lon, size_ha, polygon=None):
         point = ee.Geometry.Point([lon, lat])
         roi = point.buffer(radius_m)
         print(f"Using circular ROI with radius {radius_m:.0f}m for clustering")
+    return roi
+
+def get_real_pixels(lat, lon, size_ha, polygon=None, pixel_budget=None, speculative=None, attempts=None):
+    """
+    Fetches real Sentinel-2 pixels from Google Earth Engine for clustering.
+    Scale comes from the locally computed ROI area (see plan_sampling), and a single
+    server-side probe picks the first date window with enough valid pixels, so the
+    common case is one probe plus one bounded fetch.
+    With speculative=True (or CLUSTER_SPECULATIVE_FETCH=1) all windows are fetched
+    concurrently instead, and the first adequate one in priority order wins.
+    If `attempts` is a list, one timing entry per probe/fetch is appended to it.
+    When the request's deadline leaves no room for the usual probe + fetch, a quarter of the
+    pixel budget is sampled (about twice the scale) and "coarse_scale" is marked degraded.
+    No mock fallback — raises an exception if GEE data is unavailable.
+    """
+    import satellite_analysis
+    import datetime
+
+    roi = build_roi(lat, lon, size_ha, polygon)
     
     end_date = datetime.datetime.now()
-    
-    # Progressive retry: try wider time ranges and coarser scales
-    attempts = [
-        (30, 20),   # 30 days, 20m scale
-        (90, 30),   # 90 days, 30m scale  
-        (180, 50),  # 180 days, 50m scale
-    ]
-    
+
+    area_m2 = roi_area_m2(size_ha, polygon)
+    if not deadline.allows("coarse_scale", "ee_s2_probe", "ee_s2_sample"):
+        pixel_budget = max((pixel_budget or PIXEL_BUDGET) // 4, MIN_PIXELS)
+    plan = plan_sampling(area_m2, pixel_budget)
+    scale, budget = plan["scale"], plan["pixel_budget"]
+    print(f"Sampling plan: {area_m2 / 10000:.1f}ha -> scale={scale}m, ~{plan['expected_pixels']} pixels (budget {budget})")
+
+    if attempts is None:
+        attempts = []
+    if speculative is None:
+        speculative = SPECULATIVE_FETCH
+    if speculative:
+        return _fetch_speculative(satellite_analysis, roi, end_date, scale, budget, attempts)
+
+    started = time.perf_counter()
+    try:
+        probe = satellite_analysis.probe_sentinel2_windows(roi, end_date, DATE_WINDOWS, scale)
+        attempts.append(_attempt_entry("probe", None, scale, None, started))
+    except (deadline.DeadlineExceeded, ee_gateway.CircuitOpen):
+        # No time left / EE down: the retry ladder would only fail the same way, window after window
+        attempts.append(_attempt_entry("probe", None, scale, None, started, status="error"))
+        raise
+    except Exception as e:
+        attempts.append(_attempt_entry("probe", None, scale, None, started, status="error"))
+        print(f"⚠️ Availability probe failed ({e}), falling back to progressive retry")
+        return _fetch_with_retries(satellite_analysis, roi, end_date, attempts)
+
     last_count = 0
-    for days, scale in attempts:
+    for days in DATE_WINDOWS:
+        info = probe.get(days, {"images": 0, "valid": 0})
+        last_count = info["valid"]
+        if info["valid"] < MIN_PIXELS:
+            print(f"Window {days}d: {info['images']} images, {info['valid']} valid pixels, skipping")
+            continue
+
         start_date = end_date - datetime.timedelta(days=days)
-        pixels = satellite_analysis.get_sentinel2_pixels(roi, start_date, end_date, scale=scale)
-        last_count = len(pixels) if pixels else 0
-        if pixels and len(pixels) >= 10:
+        num_pixels = budget if info["valid"] > budget else None
+        started = time.perf_counter()
+        with tracing.span("cluster.fetch", kind="fetch", days=days, scale=scale) as span:
+            pixels = satellite_analysis.get_sentinel2_pixels(roi, start_date, end_date, scale=scale, num_pixels=num_pixels)
+            last_count = len(pixels) if pixels else 0
+            _tag_attempt(span, last_count)
+        attempts.append(_attempt_entry("fetch", days, scale, last_count, started,
+                                       status="used" if last_count >= MIN_PIXELS else "inadequate"))
+        if last_count >= MIN_PIXELS:
+            print(f"Using {last_count} real Sentinel-2 pixels (range={days}d, scale={scale}m)")
+            return pixels
+        print(f"Window {days}d/{scale}m returned {last_count} pixels despite probe, trying next window...")
+
+    raise ValueError(f"Dados insuficientes do Sentinel-2 ({last_count} pixels válidos em até {DATE_WINDOWS[-1]} dias). Verifique se a área delimitada está correta.")
+
+def _fetch_with_retries(satellite_analysis, roi, end_date, attempts):
+    """Progressive retry: try wider time ranges and coarser scales."""
+    import datetime
+
+    last_count = 0
+    for attempt, (days, scale) in enumerate(RETRY_ATTEMPTS, 1):
+        start_date = end_date - datetime.timedelta(days=days)
+        started = time.perf_counter()
+        with tracing.span("cluster.fetch", kind="retry", attempt=attempt, days=days, scale=scale) as span:
+            pixels = satellite_analysis.get_sentinel2_pixels(roi, start_date, end_date, scale=scale)
+            last_count = len(pixels) if pixels else 0
+            _tag_attempt(span, last_count)
+        attempts.append(_attempt_entry("retry", days, scale, last_count, started,
+                                       status="used" if last_count >= MIN_PIXELS else "inadequate"))
+        if pixels and len(pixels) >= MIN_PIXELS:
             print(f"Using {len(pixels)} real Sentinel-2 pixels (range={days}d, scale={scale}m)")
             return pixels
         print(f"Attempt {days}d/{scale}m returned {last_count} pixels, retrying...")
     
-    raise ValueError(f"Dados insuficientes do Sentinel-2 ({last_count} pixels após 3 tentativas). Verifique se a área delimitada está correta.")
+    raise ValueError(f"Dados insuficientes do Sentinel-2 ({last_count} pixels após {len(RETRY_ATTEMPTS)} tentativas). Verifique se a área delimitada está correta.")
+
+def _fetch_speculative(satellite_analysis, roi, end_date, scale, budget, attempts):
+    """
+    Fetches every date window concurrently and returns the first adequate result in
+    priority order (shortest window first). Windows not yet started are cancelled;
+    ones already running are discarded when they finish.
+    """
+    import datetime
+    from concurrent.futures import ThreadPoolExecutor
+
+    def fetch(days, entry):
+        started = time.perf_counter()
+        entry["status"] = "running"
+        try:
+            start_date = end_date - datetime.timedelta(days=days)
+            with tracing.span("cluster.fetch", kind="speculative", days=days, scale=scale) as span:
+                pixels = satellite_analysis.get_sentinel2_pixels(roi, start_date, end_date, scale=scale, num_pixels=budget)
+                _tag_attempt(span, len(pixels) if pixels else 0)
+            return pixels
+        finally:
+            entry["elapsed_ms"] = round((time.perf_counter() - started) * 1000, 1)
+
+    executor = ThreadPoolExecutor(max_workers=len(DATE_WINDOWS), thread_name_prefix="s2-speculative")
+    submitted = []
+    for days in DATE_WINDOWS:
+        entry = {"kind": "speculative", "days": days, "scale": scale, "pixels": None,
+                 "elapsed_ms": None, "status": "pending"}
+        attempts.append(entry)
+        # Each window runs in the request's context (shared EE object registry)
+        submitted.append((days, entry, executor.submit(contextvars.copy_context().run, fetch, days, entry)))
+
+    result = None
+    last_count = 0
+    try:
+        for days, entry, future in submitted:
+            if result is not None:
+                if future.cancel():
+                    entry["status"] = "cancelled"
+                else:
+                    entry["status"] = "discarded"
+                continue
+            pixels = future.result()
+            last_count = len(pixels) if pixels else 0
+            entry["pixels"] = last_count
+            if last_count >= MIN_PIXELS:
+                entry["status"] = "used"
+                result = pixels
+                print(f"Using {last_count} real Sentinel-2 pixels (speculative, range={days}d, scale={scale}m, {entry['elapsed_ms']}ms)")
+            else:
+                entry["status"] = "inadequate"
+    finally:
+        # Don't wait for discarded windows; their threads finish in the background
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    if result is None:
+        raise ValueError(f"Dados insuficientes do Sentinel-2 ({last_count} pixels em até {DATE_WINDOWS[-1]} dias). Verifique se a área delimitada está correta.")
+    return result
+
+def _tag_attempt(span, count):
+    if span is not None:
+        span.tag(pixels=count, adequate=count >= MIN_PIXELS)
+
+def _attempt_entry(kind, days, scale, pixels, started, status="ok"):
+    return {
+        "kind": kind,
+        "days": days,
+        "scale": scale,
+        "pixels": pixels,
+        "elapsed_ms": round((time.perf_counter() - started) * 1000, 1),
+        "status": status
+    }
+
+# Above this many pixels the streaming MiniBatchKMeans engine replaces full KMeans
+MINIBATCH_THRESHOLD = int(os.environ.get("CLUSTER_MINIBATCH_THRESHOLD", "50000"))
+CHUNK_SIZE = int(os.environ.get("CLUSTER_CHUNK_SIZE", "4096"))
+MINIBATCH_EPOCHS = 3
+
+# Warm starts are rejected when inertia per pixel grows more than this vs the previous run
+WARM_START_TOLERANCE = float(os.environ.get("CLUSTER_WARM_START_TOLERANCE", "0.10"))
+
+def fit_kmeans(data, k, engine="auto", init=None):
+    """
+    Clusters normalized pixel features.
+    engine: "kmeans" (full Lloyd, n_init=10), "minibatch" (MiniBatchKMeans fed in
+    CHUNK_SIZE chunks, so each step touches a bounded slice of the data) or "auto"
+    (minibatch above MINIBATCH_THRESHOLD pixels). The geometric "kdtree" mode is
+    handled by fit_zones (see kd_partition).
+    init: optional (k, n_features) starting centers; runs a single initialization.
+    Returns: (labels, centers, info) with info = {"engine", "n_iter", "inertia"}
+    """
+    if engine in (None, "auto"):
+        engine = "minibatch" if len(data) > MINIBATCH_THRESHOLD else "kmeans"
+
+    if engine == "minibatch":
+        rng = np.random.default_rng(42)
+        if init is None:
+            # Seed with a full multi-init KMeans on a bounded random subsample; partial_fit
+            # alone would initialize from the first chunk only and often lands in a poor optimum
+            seed_idx = rng.choice(len(data), size=min(len(data), CHUNK_SIZE * 4), replace=False)
+            init = KMeans(n_clusters=k, random_state=42, n_init=10).fit(data[seed_idx]).cluster_centers_
+        model = MiniBatchKMeans(n_clusters=k, init=init, n_init=1, random_state=42,
+                                batch_size=CHUNK_SIZE, reassignment_ratio=0)
+        starts = np.arange(0, len(data), CHUNK_SIZE)
+        for _ in range(MINIBATCH_EPOCHS):
+            # Pixels arrive in scan order (spatially sorted), so chunks are drawn from a
+            # shuffled index; contiguous slices would drag the centers strip by strip
+            order = rng.permutation(len(data))
+            for start in starts:
+                chunk = data[order[start:start + CHUNK_SIZE]]
+                if len(chunk) >= k:
+                    model.partial_fit(chunk)
+        labels = np.empty(len(data), dtype=np.int32)
+        inertia = 0.0
+        for start in starts:
+            chunk = data[start:start + CHUNK_SIZE]
+            labels[start:start + CHUNK_SIZE] = model.predict(chunk)
+            inertia += float(((chunk - model.cluster_centers_[labels[start:start + CHUNK_SIZE]]) ** 2).sum())
+        info = {"engine": engine, "n_iter": MINIBATCH_EPOCHS * len(starts), "inertia": inertia}
+        return labels, model.cluster_centers_, info
+
+    if engine != "kmeans":
+        raise ValueError(f"Engine de clusterização desconhecida: {engine}")
+    if init is None:
+        kmeans = KMeans(n_clusters=k, random_state=42, n_init=10)
+    else:
+        kmeans = KMeans(n_clusters=k, init=init, n_init=1, random_state=42)
+    labels = kmeans.fit_predict(data)
+    info = {"engine": engine, "n_iter": int(kmeans.n_iter_), "inertia": float(kmeans.inertia_)}
+    return labels, kmeans.cluster_centers_, info
+
+@metrics.timed("clustering")
+def fit_zones(data, k, engine="auto", previous=None):
+    """
+    KMeans with an optional warm start from a previous run of the same farm.
+    engine="kdtree" skips KMeans and partitions the extent directly (kd_partition).
+    previous: {"k", "centers", "inertia_per_pixel"} as returned in info["state"].
+    The warm run (n_init=1) is kept unless its inertia per pixel degrades past
+    WARM_START_TOLERANCE, in which case a full cold run is done instead. Cold results
+    are re-ordered to match the previous centers so zone IDs (and colors) stay stable.
+    Returns: (labels, centers, info) with mode, n_iter, elapsed_ms and the new state.
+    """
+    started = time.perf_counter()
+    if engine == "kdtree":
+        labels, centers = kd_partition(data, k)
+        inertia = float(((data - centers[labels]) ** 2).sum())
+        info = {
+            "engine": "kdtree", "n_iter": 1, "inertia": inertia, "mode": "geometric",
+            "elapsed_ms": round((time.perf_counter() - started) * 1000, 1),
+            "state": {"k": k, "centers": centers.tolist(), "inertia_per_pixel": inertia / len(data)}
+        }
+        return labels, centers, info
+
+    prev_centers = None
+    if previous and previous.get("k") == k and len(previous.get("centers") or []) == k:
+        prev_centers = np.array(previous["centers"], dtype=float)
+
+    mode = "cold"
+    labels = centers = info = None
+    if prev_centers is not None:
+        labels, centers, info = fit_kmeans(data, k, engine, init=prev_centers)
+        prev_inertia = previous.get("inertia_per_pixel") or 0.0
+        if prev_inertia <= 0 or info["inertia"] / len(data) <= prev_inertia * (1 + WARM_START_TOLERANCE):
+            mode = "warm"
+        else:
+            print(f"Warm start rejected (inertia/pixel {info['inertia'] / len(data):.5f} vs {prev_inertia:.5f}), running cold")
+            mode = "cold-fallback"
+
+    if mode != "warm":
+        labels, centers, info = fit_kmeans(data, k, engine)
+        if prev_centers is not None:
+            labels, centers = align_to_previous(labels, centers, prev_centers)
+
+    info = dict(info)
+    info["mode"] = mode
+    info["elapsed_ms"] = round((time.perf_counter() - started) * 1000, 1)
+    info["state"] = {
+        "k": k,
+        "centers": centers.tolist(),
+        "inertia_per_pixel": info["inertia"] / len(data)
+    }
+    return labels, centers, info
+
+def kd_partition(data, k):
+    """
+    Deterministic geometric zoning: recursive bisection of the farm extent, balanced
+    by pixel count. Each step cuts the longer axis at the pixel-count quantile that
+    gives both halves a share proportional to the zones they will hold, so zones
+    are contiguous rectangles of near-equal area. O(n log k) with argpartition.
+    Returns: (labels, centers) in the same normalized space as `data`.
+    """
+    labels = np.empty(len(data), dtype=np.int32)
+
+    def split(idx, k_part, first_label):
+        if k_part == 1 or len(idx) <= 1:
+            labels[idx] = first_label
+            return
+        pts = data[idx]
+        axis = int(np.argmax(np.ptp(pts, axis=0)))
+        k_left = k_part // 2
+        cut = min(max(len(idx) * k_left // k_part, 1), len(idx) - 1)
+        order = np.argpartition(pts[:, axis], cut)
+        split(idx[order[:cut]], k_left, first_label)
+        split(idx[order[cut:]], k_part - k_left, first_label + k_left)
+
+    split(np.arange(len(data)), k, 0)
+    counts = np.bincount(labels, minlength=k).astype(float)
+    sums = np.column_stack([np.bincount(labels, weights=data[:, d], minlength=k) for d in range(data.shape[1])])
+    centers = sums / np.maximum(counts, 1)[:, None]
+    return labels, centers
+
+def align_to_previous(labels, centers, prev_centers):
+    """Permutes cluster ids so each new center takes the id of the closest previous one."""
+    from scipy.optimize import linear_sum_assignment
+
+    cost = ((centers[:, None, :] - prev_centers[None, :, :]) ** 2).sum(axis=2)
+    new_idx, prev_idx = linear_sum_assignment(cost)
+    order = np.empty(len(centers), dtype=int)
+    order[prev_idx] = new_idx            # order[target_id] = current id
+    remap = np.empty(len(centers), dtype=int)
+    remap[order] = np.arange(len(centers))
+    return remap[labels], centers[order]
+
+def cluster_pixels(pixels, k=3, return_internals=False, engine="auto", previous=None, diagnostics=None):
+    """
+    Geographic management zones from Sentinel-2 pixels.
+    previous: state from this farm's last run (warm start, see fit_zones).
+    diagnostics: optional dict filled with engine, mode, n_iter, elapsed_ms and the
+    new state to persist for the next run.
+    """
+    clean_pixels, data = prepare_pixels(pixels)
+    
+    labels, centers, info = fit_zones(data, k, engine, previous) # centers are normalized
+    print(f"Clustered {len(data)} pixels with {info['engine']} engine (k={k}, {info['mode']}, {info['n_iter']} iterations, {info['elapsed_ms']}ms)")
+    if diagnostics is not None:
+        diagnostics.update(info)
+    
+    result_zones = build_zones(clean_pixels, labels, centers, k)
+        
+    # No sorting required as we don't depend on NDVI progression anymore, 
+    # but the API contract expects sorted_indices for raster generation mapping
+    # Just return sequential indices
+    sorted_indices = np.arange(k)
+    
+    if return_internals:
+        return result_zones, labels, sorted_indices, clean_pixels
+    return result_zones
 
-def cluster_pixels(pixels, k=3, return_internals=False):
+def prepare_pixels(pixels):
+    """Drops cloud/shadow pixels and returns (clean_pixels, normalized [lat, lon] array)."""
     # Filter out cloud/shadow pixels (NDVI < 0.05 is almost certainly cloud, water, or shadow)
     clean_pixels = [p for p in pixels if p.get("ndvi") is not None and p["ndvi"] >= 0.05]
     
@@ -81,11 +457,25 @@ def cluster_pixels(pixels, k=3, return_internals=False):
     
     # Use explicit geographical coordinates for contiguous physical zones
     data = np.column_stack((norm_lats, norm_lons))
-    
-    kmeans = KMeans(n_clusters=k, random_state=42, n_init=10)
-    labels = kmeans.fit_predict(data)
-    centers = kmeans.cluster_centers_ # These are normalized centers
-    
+    return clean_pixels, data
+
+# Productivity classes by zone NDVI average: (label, color), lowest first
+PRODUCTIVITY_CLASSES = [
+    ("Baixa", "#ef4444"),  # Red (Critical)
+    ("Média", "#eab308"),  # Yellow (Medium)
+    ("Alta", "#22c55e"),   # Green (High)
+]
+
+def productivity_class(ndvi_avg):
+    """Index into PRODUCTIVITY_CLASSES (NDVI < 0.45 low, < 0.60 medium, else high)."""
+    if ndvi_avg < 0.45:
+        return 0
+    if ndvi_avg < 0.60:
+        return 1
+    return 2
+
+def build_zones(clean_pixels, labels, centers, k):
+    """Zone dicts (API schema) from cluster labels and normalized centers."""
     # Farm overall center 
     farm_center_norm_lat = 0.5 
     farm_center_norm_lon = 0.5
@@ -120,11 +510,14 @@ def cluster_pixels(pixels, k=3, return_internals=False):
         
         return "Talhão"
         
+    # Count/mean/std/min/max/p10/p50/p90 per zone for every fetched band, in one pass
+    zone_stats = zonal_stats.zonal_statistics(labels, zonal_stats.pixel_bands(clean_pixels), k)
+    
     for i in range(k):
         c_lat, c_lon = centers[i]
         
         # Points belonging to this physical zone
-        cluster_indices = [j for j in range(len(clean_pixels)) if labels[j] == i]
+        cluster_indices = np.flatnonzero(labels == i)
         
         cluster_points = [
             {"lat": clean_pixels[j]["lat"], "lon": clean_pixels[j]["lon"]} 
@@ -132,19 +525,10 @@ def cluster_pixels(pixels, k=3, return_internals=False):
         ]
         
         # Calculate real-world NDVI average for this specific geographical group
-        ndvi_values = [clean_pixels[j]["ndvi"] for j in cluster_indices]
-        ndvi_avg = float(np.mean(ndvi_values)) if ndvi_values else 0.0
+        ndvi_avg = zone_stats[i].get("ndvi", {}).get("mean", 0.0)
         
         # Dynamic Risk/Color mapping based on the combined physical area average
-        if ndvi_avg < 0.45:
-            color = "#ef4444" # Red (Critical)
-            productivity = "Baixa"
-        elif ndvi_avg < 0.60:
-            color = "#eab308" # Yellow (Medium)
-            productivity = "Média"
-        else:
-            color = "#22c55e" # Green (High)
-            productivity = "Alta"
+        productivity, color = PRODUCTIVITY_CLASSES[productivity_class(ndvi_avg)]
             
         direction_name = get_directional_name(c_lat, c_lon)
         
@@ -154,30 +538,119 @@ def cluster_pixels(pixels, k=3, return_internals=False):
             "color": color,
             "coordinates": cluster_points,
             "ndvi_avg": ndvi_avg,
+            "stats": zone_stats[i],
             "area_percentage": len(cluster_points) / len(clean_pixels)
         })
-        
-    # No sorting required as we don't depend on NDVI progression anymore, 
-    # but the API contract expects sorted_indices for raster generation mapping
-    # Just return sequential indices
-    sorted_indices = np.arange(k)
-    
-    if return_internals:
-        return result_zones, labels, sorted_indices, clean_pixels
     return result_zones
 
-def generate_raster_image(pixels, labels, sorted_indices, k=3, polygon=None, zones=None):
+# Silhouette is O(n^2); score on a fixed-size random sample
+SILHOUETTE_SAMPLE = 2000
+
+def cluster_k_range(pixels, k_values, engine="auto", previous=None):
     """
-    Generates a smooth transparent PNG raster image from K-Means classified pixels.
-    Uses scipy spatial interpolation to fill the entire area with smooth zone colors.
-    If polygon is provided, clips the image to the farm boundary.
-    Returns: (base64_png_string, [[lat_min, lon_min], [lat_max, lon_max]])
+    Clusters one pixel set for several k at once (pixels are filtered and normalized
+    once, each k runs on a worker thread).
+    previous: {k: state} warm-start states per k.
+    Returns (solutions, clean_pixels); each solution has k, zones, labels,
+    sorted_indices, inertia, silhouette (sampled) and clustering diagnostics.
+    Use best_solution() to pick one.
     """
-    from PIL import Image, ImageFilter, ImageDraw
-    from scipy.interpolate import griddata
+    from concurrent.futures import ThreadPoolExecutor
+    from sklearn.metrics import silhouette_score
+
+    clean_pixels, data = prepare_pixels(pixels)
+    previous = previous or {}
+    k_values = [k for k in sorted(set(k_values)) if 2 <= k < len(data)]
+    if not k_values:
+        raise ValueError("Intervalo de k inválido para o número de pixels disponíveis")
+
+    def run(k):
+        labels, centers, info = fit_zones(data, k, engine, previous.get(k))
+        silhouette = float(silhouette_score(data, labels, sample_size=min(SILHOUETTE_SAMPLE, len(data)), random_state=42))
+        return {
+            "k": k,
+            "zones": build_zones(clean_pixels, labels, centers, k),
+            "labels": labels,
+            "sorted_indices": np.arange(k),
+            "inertia": info["inertia"],
+            "silhouette": silhouette,
+            "clustering": info
+        }
+
+    with ThreadPoolExecutor(max_workers=min(len(k_values), os.cpu_count() or 1)) as executor:
+        solutions = list(executor.map(run, k_values))
+
+    for sol in solutions:
+        print(f"k={sol['k']}: inertia={sol['inertia']:.2f} silhouette={sol['silhouette']:.3f} ({sol['clustering']['mode']}, {sol['clustering']['elapsed_ms']}ms)")
+    return solutions, clean_pixels
+
+def cluster_temporal(lats, lons, values, days, k=3, engine="auto", previous=None, diagnostics=None):
+    """
+    Zones from seasonal NDVI profiles (pixel cube) instead of a single composite.
+    Each pixel is described by its season mean, amplitude and trend (standardized);
+    pixels with fewer than MIN_VALID_DATES clear windows are left out.
+    Returns the same (zones, labels, sorted_indices, clean_pixels) as cluster_pixels.
+    """
+    import pixel_cube
+
+    feats = pixel_cube.temporal_features(values, days)
+    keep = feats["n_valid"] >= pixel_cube.MIN_VALID_DATES
+    if keep.sum() < max(10, k):
+        raise ValueError(f"Poucos pixels com série temporal válida ({int(keep.sum())}). Tente uma safra mais longa.")
+
+    X = np.column_stack([feats["mean"][keep], feats["amplitude"][keep], feats["trend"][keep]])
+    X = (X - X.mean(axis=0)) / np.maximum(X.std(axis=0), 1e-6)
+
+    labels, _, info = fit_zones(X, k, engine, previous)
+    print(f"Clustered {len(X)} temporal profiles with {info['engine']} engine (k={k}, {info['mode']}, {info['n_iter']} iterations, {info['elapsed_ms']}ms)")
+    if diagnostics is not None:
+        diagnostics.update(info)
+
+    clean_pixels = [
+        {"lat": float(a), "lon": float(b), "ndvi": float(m), "ndvi_amplitude": float(amp), "ndvi_trend": float(tr)}
+        for a, b, m, amp, tr in zip(np.asarray(lats)[keep], np.asarray(lons)[keep], feats["mean"][keep],
+                                    feats["amplitude"][keep], feats["trend"][keep])
+    ]
+
+    # Directional names come from each zone's normalized geographic centroid
+    kept_lats, kept_lons = np.asarray(lats)[keep], np.asarray(lons)[keep]
+    geo = np.column_stack(((kept_lats - kept_lats.min()) / max(np.ptp(kept_lats), 1e-6),
+                           (kept_lons - kept_lons.min()) / max(np.ptp(kept_lons), 1e-6)))
+    counts = np.maximum(np.bincount(labels, minlength=k), 1)
+    centers = np.column_stack([np.bincount(labels, weights=geo[:, d], minlength=k) / counts for d in range(2)])
+
+    zones = build_zones(clean_pixels, labels, centers, k)
+    return zones, labels, np.arange(k), clean_pixels
+
+def talhao_statistics(clean_pixels, talhoes):
+    """
+    Zonal statistics for user-supplied sub-polygons (talhões) over the fetched pixels.
+    talhoes: [{"name": str, "polygon": [[lon, lat], ...]}, ...]
+    """
+    lats = np.array([p["lat"] for p in clean_pixels])
+    lons = np.array([p["lon"] for p in clean_pixels])
+    labels = zonal_stats.labels_from_polygons(lats, lons, [t.get("polygon") or [] for t in talhoes])
+    stats = zonal_stats.zonal_statistics(labels, zonal_stats.pixel_bands(clean_pixels), len(talhoes))
+    counts = np.bincount(labels[labels >= 0], minlength=len(talhoes))
+    return [
+        {"name": t.get("name") or f"Talhão {i + 1}", "pixel_count": int(counts[i]), "stats": stats[i]}
+        for i, t in enumerate(talhoes)
+    ]
+
+def best_solution(solutions, selected_k=None):
+    """The solution for selected_k if given, else the one with the highest sampled silhouette."""
+    if selected_k is not None:
+        for sol in solutions:
+            if sol["k"] == selected_k:
+                return sol
+    return max(solutions, key=lambda sol: sol["silhouette"])
+
+# Value used in label grids for cells outside the farm polygon
+NO_ZONE = 255
 
-    # Zone colors (RGBA) matching the K-Means zone order
-    zone_colors_rgba = []
+def zone_colors_rgba(zones=None, k=3):
+    """Zone colors (RGBA) matching the K-Means zone order."""
+    colors = []
     if zones and len(zones) == k:
         for z in zones:
             hex_color = z.get('color', '#cccccc').lstrip('#')
@@ -185,38 +658,55 @@ def generate_raster_image(pixels, labels, sorted_indices, k=3, polygon=None, zon
                 r = int(hex_color[0:2], 16)
                 g = int(hex_color[2:4], 16)
                 b = int(hex_color[4:6], 16)
-                zone_colors_rgba.append((r, g, b, 140))
+                colors.append((r, g, b, 140))
             except:
-                zone_colors_rgba.append((128, 128, 128, 140))
+                colors.append((128, 128, 128, 140))
     else:
         # Fallback if zones were not provided
-        zone_colors_rgba = [
+        colors = [
             (239, 68, 68, 140),   # Red
             (234, 179, 8, 140),   # Yellow 
             (34, 197, 94, 140),   # Green
         ]
+    return colors
 
-    # Build mapping from original cluster index to sorted zone index
-    mapping = {int(sorted_indices[new_idx]): new_idx for new_idx in range(k)}
-
-    # Extract lat/lon and zone labels
+def grid_bounds(pixels):
+    """Default zone grid extent: the pixels' extent plus 2% padding, as [[lat_min, lon_min], [lat_max, lon_max]]."""
     lats = np.array([p["lat"] for p in pixels])
     lons = np.array([p["lon"] for p in pixels])
-    zone_labels = np.array([mapping.get(int(labels[i]), 0) for i in range(len(pixels))])
-
     lat_min, lat_max = float(lats.min()), float(lats.max())
     lon_min, lon_max = float(lons.min()), float(lons.max())
 
     # Add small padding to bounds (2% of range)
     lat_pad = (lat_max - lat_min) * 0.02
     lon_pad = (lon_max - lon_min) * 0.02
-    lat_min -= lat_pad
-    lat_max += lat_pad
-    lon_min -= lon_pad
-    lon_max += lon_pad
+    return [[lat_min - lat_pad, lon_min - lon_pad], [lat_max + lat_pad, lon_max + lon_pad]]
+
+def render_zone_grid(pixels, labels, sorted_indices, k=3, polygon=None, grid_res=200, bounds=None):
+    """
+    Interpolates the classified pixels onto a dense grid_res x grid_res label grid.
+    Returns: (grid uint8 [row, col] top to bottom, polygon mask uint8 or None, bounds)
+    Cells outside the farm polygon are kept in the grid; the mask (255 inside, 0 outside)
+    is returned separately so callers can either blur it (overlays) or mark NO_ZONE (label grids).
+    bounds: fixed grid extent (e.g. roi_bounds) so grids from different runs line up cell by cell;
+    defaults to the pixels' extent plus 2% padding.
+    """
+    from PIL import Image, ImageDraw
+    from scipy.interpolate import griddata
+
+    # Build mapping from original cluster index to sorted zone index
+    mapping = np.zeros(max(int(np.max(sorted_indices)) + 1, k), dtype=np.uint8)
+    for new_idx in range(k):
+        mapping[int(sorted_indices[new_idx])] = new_idx
+
+    # Extract lat/lon and zone labels
+    lats = np.array([p["lat"] for p in pixels])
+    lons = np.array([p["lon"] for p in pixels])
+    zone_labels = mapping[np.asarray(labels, dtype=np.int64)]
+
+    (lat_min, lon_min), (lat_max, lon_max) = bounds or grid_bounds(pixels)
 
     # Create a dense output grid (200x200 for smooth look)
-    grid_res = 200
     grid_lats = np.linspace(lat_max, lat_min, grid_res)  # top to bottom
     grid_lons = np.linspace(lon_min, lon_max, grid_res)
     grid_lon_mesh, grid_lat_mesh = np.meshgrid(grid_lons, grid_lats)
@@ -227,22 +717,9 @@ def generate_raster_image(pixels, labels, sorted_indices, k=3, polygon=None, zon
         values=zone_labels,
         xi=(grid_lon_mesh, grid_lat_mesh),
         method='nearest'
-    )
+    ).astype(np.uint8)
 
-    # Paint the image
-    img = Image.new("RGBA", (grid_res, grid_res), (0, 0, 0, 0))
-    img_pixels = img.load()
-
-    for row in range(grid_res):
-        for col in range(grid_res):
-            zone_idx = int(grid_zones[row, col])
-            color = zone_colors_rgba[zone_idx] if zone_idx < len(zone_colors_rgba) else (128, 128, 128, 140)
-            img_pixels[col, row] = color
-
-    # Apply a slight gaussian blur to smooth hard edges between zones
-    img = img.filter(ImageFilter.GaussianBlur(radius=2))
-
-    # Clip to farm polygon if available
+    mask = None
     if polygon and len(polygon) >= 3:
         # Convert polygon geo coords [lon, lat] to image pixel coords [col, row]
         poly_pixels = []
@@ -254,28 +731,58 @@ def generate_raster_image(pixels, labels, sorted_indices, k=3, polygon=None, zon
             col = max(0, min(grid_res - 1, col))
             row = max(0, min(grid_res - 1, row))
             poly_pixels.append((col, row))
-        
+
         # Create a mask: white inside polygon, black outside
-        mask = Image.new("L", (grid_res, grid_res), 0)
-        draw = ImageDraw.Draw(mask)
+        mask_img = Image.new("L", (grid_res, grid_res), 0)
+        draw = ImageDraw.Draw(mask_img)
         draw.polygon(poly_pixels, fill=255)
-        
+        mask = np.array(mask_img)
+
+    bounds = [[lat_min, lon_min], [lat_max, lon_max]]
+    return grid_zones, mask, bounds
+
+def paint_zone_grid(grid_zones, colors, mask=None):
+    """Paints a label grid into a smooth, transparent RGBA PIL image."""
+    from PIL import Image, ImageFilter
+
+    # Palette lookup (unknown zone indices fall back to gray)
+    lut = np.full((256, 4), (128, 128, 128, 140), dtype=np.uint8)
+    lut[:len(colors)] = np.array(colors, dtype=np.uint8)
+    img = Image.fromarray(lut[grid_zones], mode="RGBA")
+
+    # Apply a slight gaussian blur to smooth hard edges between zones
+    img = img.filter(ImageFilter.GaussianBlur(radius=2))
+
+    # Clip to farm polygon if available
+    if mask is not None:
         # Apply slight blur to mask edges for smoother clip
-        mask = mask.filter(ImageFilter.GaussianBlur(radius=1))
-        
+        mask_img = Image.fromarray(mask, mode="L").filter(ImageFilter.GaussianBlur(radius=1))
+
         # Apply mask to image alpha channel
         r, g, b, a = img.split()
         # Multiply existing alpha with mask
-        a = Image.fromarray(np.minimum(np.array(a), np.array(mask)).astype(np.uint8))
+        a = Image.fromarray(np.minimum(np.array(a), np.array(mask_img)).astype(np.uint8))
         img = Image.merge("RGBA", (r, g, b, a))
 
+    return img
+
+@metrics.timed("raster_render")
+def generate_raster_image(pixels, labels, sorted_indices, k=3, polygon=None, zones=None):
+    """
+    Generates a smooth transparent PNG raster image from K-Means classified pixels.
+    Uses scipy spatial interpolation to fill the entire area with smooth zone colors.
+    If polygon is provided, clips the image to the farm boundary.
+    Returns: (base64_png_string, [[lat_min, lon_min], [lat_max, lon_max]])
+    """
+    grid_zones, mask, bounds = render_zone_grid(pixels, labels, sorted_indices, k, polygon=polygon)
+    img = paint_zone_grid(grid_zones, zone_colors_rgba(zones, k), mask)
+
     # Export to base64
     buffer = io.BytesIO()
     img.save(buffer, format="PNG", optimize=True)
     buffer.seek(0)
     b64 = base64.b64encode(buffer.read()).decode("utf-8")
 
-    bounds = [[lat_min, lon_min], [lat_max, lon_max]]
     return f"data:image/png;base64,{b64}", bounds
 
 if __name__ == "__main__":
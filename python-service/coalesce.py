@@ -0,0 +1,186 @@
+"""
+Single-flight deduplication of identical in-flight requests.
+
+run(key, fn): while one caller is computing `key`, concurrent callers with the same key
+wait for it and get its result (or its exception) instead of running the Earth Engine
+pipeline again. Within a worker this uses a dict of in-flight calls; with
+COALESCE_ACROSS_WORKERS=1 the leader also holds an flock on state/inflight/<key>.lock and
+writes its result next to it, so callers in other uvicorn workers wait on the lock and
+reuse that result. A leader failing in another worker is not shared: the waiter computes.
+Leaders sweep inflight files older than WAIT_S (no waiter can still need them) at most once
+per SWEEP_INTERVAL_S. Waiters never outlive their own request deadline: they raise
+DeadlineExceeded when it runs out before the leader finishes.
+"""
+import base64
+import copy
+import fcntl
+import hashlib
+import json
+import os
+import threading
+import time
+
+import deadline
+import metrics
+import state_store
+import tracing
+
+ENABLED = os.environ.get("COALESCE", "1") == "1"
+ACROSS_WORKERS = os.environ.get("COALESCE_ACROSS_WORKERS", "0") == "1"
+# Longest a caller waits on another worker's flight before computing itself
+WAIT_S = float(os.environ.get("COALESCE_WAIT_S", "120"))
+POLL_S = 0.05
+SWEEP_INTERVAL_S = float(os.environ.get("COALESCE_SWEEP_INTERVAL_S", "60"))
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+_flights = {}
+_guard = threading.Lock()
+_last_sweep = 0.0
+
+
+def request_key(endpoint, *parts):
+    """Stable key for a canonical request: endpoint plus JSON-able parts (body fields, format, date...)."""
+    canonical = json.dumps([endpoint, *parts], sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha1(canonical.encode()).hexdigest()[:20]
+
+
+def run(key, fn, endpoint=""):
+    """fn() once per key among concurrent callers; followers get a copy of the leader's result."""
+    if not ENABLED:
+        return fn()
+    with _guard:
+        flight = _flights.get(key)
+        leader = flight is None
+        if leader:
+            flight = _flights[key] = _Flight()
+
+    if not leader:
+        if not flight.done.wait(deadline.remaining()):
+            raise deadline.DeadlineExceeded(f"{endpoint}: prazo esgotado aguardando requisição idêntica em andamento")
+        _shared(endpoint, "thread")
+        if flight.error is not None:
+            raise flight.error
+        return _copy(flight.result)
+
+    try:
+        flight.result = _run_across_workers(key, fn, endpoint) if ACROSS_WORKERS else fn()
+        return flight.result
+    except BaseException as e:
+        flight.error = e
+        raise
+    finally:
+        with _guard:
+            _flights.pop(key, None)
+        flight.done.set()
+
+
+def _shared(endpoint, scope):
+    print(f"🔗 {endpoint}: joined an identical in-flight request ({scope})")
+    metrics.count("yvy_coalesced_total", endpoint=endpoint, scope=scope)
+    tracing.annotate(coalesced=scope)
+
+
+def _run_across_workers(key, fn, endpoint):
+    path = state_store.state_path("inflight", key)
+    waited_since = time.time()
+    with open(path + ".lock", "a+") as lock:
+        give_up_at = time.monotonic() + WAIT_S
+        contended = False
+        while True:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                break
+            except BlockingIOError:
+                contended = True
+                left = deadline.remaining()
+                if left is not None and left <= 0:
+                    raise deadline.DeadlineExceeded(
+                        f"{endpoint}: prazo esgotado aguardando requisição idêntica em outro worker")
+                if time.monotonic() > give_up_at:
+                    print(f"⚠️ {endpoint}: waited {WAIT_S:.0f}s on another worker, computing anyway")
+                    return fn()
+                time.sleep(POLL_S)
+        try:
+            if contended:
+                entry = state_store.load_json("inflight", key)
+                if entry and entry["finished_at"] >= waited_since:
+                    _shared(endpoint, "worker")
+                    return _decode(entry)
+            result = fn()
+            _store(key, result, endpoint)
+            return result
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+            _sweep()
+
+
+def _sweep(now=None):
+    """
+    Removes inflight results and lock files untouched for WAIT_S: waiters read a result right
+    after the leader unlocks and give up after WAIT_S, so older files have no reader left.
+    A lock file is only removed while we hold its flock; a caller that opened it just before
+    ends up alone on the unlinked inode and computes (or reuses the result) by itself.
+    """
+    global _last_sweep
+    now = time.time() if now is None else now
+    with _guard:
+        if now - _last_sweep < SWEEP_INTERVAL_S:
+            return
+        _last_sweep = now
+    directory = os.path.dirname(state_store.state_path("inflight", "_"))
+    for name in os.listdir(directory):
+        path = os.path.join(directory, name)
+        try:
+            if now - os.path.getmtime(path) < WAIT_S:
+                continue
+            if name.endswith(".lock"):
+                with open(path, "a+") as lock:
+                    try:
+                        fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    except BlockingIOError:
+                        continue  # a leader is still computing under it
+                    os.remove(path)
+            else:
+                os.remove(path)
+        except OSError:
+            continue  # already swept by another worker
+
+
+def _store(key, result, endpoint):
+    from fastapi import Response
+
+    if isinstance(result, Response):
+        headers = {k: v for k, v in result.headers.items() if k not in ("content-length", "content-type")}
+        entry = {"kind": "response", "body": base64.b64encode(result.body).decode("ascii"),
+                 "media_type": result.media_type, "status_code": result.status_code, "headers": headers}
+    else:
+        entry = {"kind": "json", "value": result}
+    entry["finished_at"] = time.time()
+    try:
+        state_store.save_json("inflight", key, entry)
+    except (OSError, TypeError, ValueError) as e:
+        # Not shareable (non-JSON values) or disk issue: waiters compute for themselves
+        print(f"⚠️ {endpoint}: could not share result with other workers (non-fatal): {e}")
+
+
+def _decode(entry):
+    if entry["kind"] == "response":
+        from fastapi import Response
+
+        return Response(content=base64.b64decode(entry["body"]), media_type=entry["media_type"],
+                        status_code=entry["status_code"], headers=entry["headers"])
+    return entry["value"]
+
+
+def _copy(result):
+    """Handlers may mutate what they return; Responses carry immutable bytes and are shared as is."""
+    from fastapi import Response
+
+    return result if isinstance(result, Response) else copy.deepcopy(result)
@@ -0,0 +1,264 @@
+import datetime
+import math
+import os
+import shutil
+import tempfile
+import threading
+
+import numpy as np
+
+import metrics
+import state_store
+
+# Composite time step; steps are aligned to ANCHOR so every sync appends to the same calendar
+STEP_DAYS = int(os.environ.get("DATACUBE_STEP_DAYS", "15"))
+ANCHOR = datetime.date(2017, 1, 1)
+# Per-farm size cap; compaction evicts the oldest complete steps beyond it
+MAX_MB = float(os.environ.get("DATACUBE_MAX_MB", "256"))
+# Loose (one file per step) chunks tolerated before they are packed into one contiguous file
+COMPACT_AFTER = int(os.environ.get("DATACUBE_COMPACT_AFTER", "6"))
+# The open (current) step is re-downloaded at most this often
+REFRESH_HOURS = float(os.environ.get("DATACUBE_REFRESH_HOURS", "6"))
+# float16 keeps reflectances to ~4 significant digits; ST_B10 DN (~45000) to ±16 DN (~0.05 K)
+DTYPE = np.float16
+
+_locks = {}
+_locks_guard = threading.Lock()
+
+
+def step_dates(index):
+    """(start, end) dates of time step `index` (end exclusive)."""
+    start = ANCHOR + datetime.timedelta(days=index * STEP_DAYS)
+    return start, start + datetime.timedelta(days=STEP_DAYS)
+
+
+def step_at(date):
+    """Index of the time step containing `date`."""
+    date = date.date() if isinstance(date, datetime.datetime) else date
+    return (date - ANCHOR).days // STEP_DAYS
+
+
+def steps_for_days(end_date, days):
+    """Step indices overlapping the `days` ending at end_date, oldest first."""
+    last = step_at(end_date)
+    return list(range(last - max(1, math.ceil(days / STEP_DAYS)) + 1, last + 1))
+
+
+def cube_dir(key):
+    return os.path.dirname(state_store.state_path(_namespace(key), "index.json"))
+
+
+def load_index(key):
+    """
+    {"roi", "grid", "bands", "steps": {str(step): {"start", "end", "complete", "fetched_at", "chunk", "slot"}}}.
+    A step lives in a loose chunk (slot None, array (bands, h, w)) or in slot `slot`
+    of a packed chunk (array (n, bands, h, w)).
+    """
+    return state_store.load_json(_namespace(key), "index")
+
+
+def read_step(key, step, index=None):
+    """
+    {band: read-only float16 (h, w) view} of one stored step, or None if absent.
+    Hold _lock(key) while opening: compact() removes the chunks an older index points to.
+    """
+    index = index or load_index(key)
+    entry = index and index["steps"].get(str(step))
+    if not entry:
+        return None
+    grid, bands = index["grid"], index["bands"]
+    shape = (len(bands), grid["height"], grid["width"])
+    path = os.path.join(cube_dir(key), entry["chunk"])
+    if entry.get("slot") is None:
+        data = np.memmap(path, dtype=DTYPE, mode="r", shape=shape)
+    else:
+        n_slots = os.path.getsize(path) // (DTYPE().itemsize * int(np.prod(shape)))
+        data = np.memmap(path, dtype=DTYPE, mode="r", shape=(n_slots,) + shape)[entry["slot"]]
+    return {name: data[i] for i, name in enumerate(bands)}
+
+
+def sync(key, bounds, roi_hash, end_date=None, days=30, bands=None, fetch=None):
+    """
+    Makes sure every step overlapping the `days` before end_date is on disk and returns
+    (index, fetched_steps). Complete steps are never fetched again; the open (current) step
+    is refreshed once it is older than REFRESH_HOURS. A different ROI or band set starts a new cube.
+    fetch(grid, start_date, end_date, bands) as in local_raster.fetch_bands.
+    """
+    import local_raster
+
+    end_date = end_date or datetime.datetime.now()
+    bands = bands or local_raster.ALL_BANDS
+    with _lock(key):
+        index = load_index(key)
+        if index and (index.get("roi") != roi_hash or index.get("bands") != list(bands)):
+            print(f"Datacube {key}: ROI/bands changed, rebuilding")
+            shutil.rmtree(cube_dir(key), ignore_errors=True)
+            index = None
+        if not index:
+            index = {"roi": roi_hash, "grid": local_raster.raster_grid(bounds), "bands": list(bands), "steps": {}}
+
+        fetched = []
+        steps = steps_for_days(end_date, days)
+        for step in steps:
+            entry = index["steps"].get(str(step))
+            if entry and (entry["complete"] or _fresh(entry, end_date)):
+                continue
+            start, end = step_dates(step)
+            complete = datetime.datetime.combine(end, datetime.time()) <= end_date
+            raw, _ = local_raster.fetch_bands(None, datetime.datetime.combine(start, datetime.time()),
+                                              min(datetime.datetime.combine(end, datetime.time()), end_date),
+                                              bands=bands, fetch=fetch, grid=index["grid"])
+            _write_step(key, index, step, raw, complete)
+            fetched.append(step)
+
+        metrics.count("yvy_cache_total", len(steps) - len(fetched), cache="datacube", result="hit")
+        metrics.count("yvy_cache_total", len(fetched), cache="datacube", result="miss")
+        if fetched:
+            state_store.save_json(_namespace(key), "index", index)
+            print(f"Datacube {key}: fetched steps {fetched}, {len(index['steps'])} stored")
+        if sum(1 for e in index["steps"].values() if e.get("slot") is None and e["complete"]) >= COMPACT_AFTER:
+            compact(key, index)
+        return index, fetched
+
+
+def composite(key, steps, bands=None):
+    """
+    Per-band NaN-median over several stored steps (a step composite is itself a median),
+    {band: float32 (h, w)}; None if none of the steps is stored.
+    Reads under the cube lock with the index on disk, so a concurrent sync cannot compact
+    away the chunks being read.
+    """
+    with _lock(key):
+        index = load_index(key)
+        arrays = [read_step(key, s, index) for s in steps] if index else []
+        arrays = [a for a in arrays if a is not None]
+        if not arrays:
+            return None
+        result = {}
+        for name in bands or index["bands"]:
+            result[name] = nanmedian(np.stack([a[name] for a in arrays]).astype(np.float32))
+        return result
+
+
+def time_series(key, mask=None):
+    """Index means over the mask for every stored step, oldest first (read from disk only)."""
+    import local_raster
+
+    with _lock(key):
+        index = load_index(key)
+        if not index:
+            return []
+        series = []
+        for step in sorted(int(s) for s in index["steps"]):
+            start, end = step_dates(step)
+            bands = {name: np.asarray(values, dtype=np.float32) for name, values in read_step(key, step, index).items()}
+            means = local_raster.index_means(local_raster.compute_indices(bands), mask)
+            series.append({"start": start.isoformat(), "end": end.isoformat(),
+                           "complete": index["steps"][str(step)]["complete"], **means})
+        return series
+
+
+def compact(key, index=None):
+    """
+    Packs every complete step into one contiguous (n, bands, h, w) file, sorted by time,
+    so season reads are a single sequential scan; evicts the oldest steps beyond MAX_MB.
+    Open steps stay loose. Old chunk files are removed after the new index is saved.
+    """
+    index = index or load_index(key)
+    directory = cube_dir(key)
+    step_bytes = DTYPE().itemsize * len(index["bands"]) * index["grid"]["height"] * index["grid"]["width"]
+    complete = sorted(int(s) for s, e in index["steps"].items() if e["complete"])
+    max_steps = max(1, int(MAX_MB * 1024 * 1024 // step_bytes) - (len(index["steps"]) - len(complete)))
+    evicted = complete[:-max_steps] if len(complete) > max_steps else []
+    kept = complete[len(evicted):]
+
+    old_chunks = {index["steps"][str(s)]["chunk"] for s in complete}
+    generation = index.get("generation", 0) + 1
+    name = f"pack-{generation}.f16"
+    path = os.path.join(directory, name)
+    shape = (len(kept), len(index["bands"]), index["grid"]["height"], index["grid"]["width"])
+    if kept:
+        packed = np.memmap(path, dtype=DTYPE, mode="w+", shape=shape)
+        for slot, step in enumerate(kept):
+            arrays = read_step(key, step, index)
+            for b, band in enumerate(index["bands"]):
+                packed[slot, b] = arrays[band]
+        packed.flush()
+        del packed
+
+    for step in evicted:
+        del index["steps"][str(step)]
+    for slot, step in enumerate(kept):
+        index["steps"][str(step)].update({"chunk": name, "slot": slot})
+    index["generation"] = generation
+    state_store.save_json(_namespace(key), "index", index)
+    for chunk in old_chunks - {name}:
+        try:
+            os.remove(os.path.join(directory, chunk))
+        except OSError:
+            pass
+    print(f"Datacube {key}: compacted {len(kept)} steps into {name}"
+          + (f", evicted {len(evicted)} oldest (cap {MAX_MB:.0f}MB)" if evicted else ""))
+    return index
+
+
+def size_bytes(key):
+    directory = cube_dir(key)
+    return sum(os.path.getsize(os.path.join(directory, f)) for f in os.listdir(directory))
+
+
+def _write_step(key, index, step, bands, complete):
+    """Writes one step as a loose chunk (temp file + rename) and records it in `index`."""
+    directory = cube_dir(key)
+    name = f"s{step}.f16"
+    data = np.stack([np.asarray(bands[b], dtype=DTYPE) for b in index["bands"]])
+    fd, tmp = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data.tobytes())
+        os.replace(tmp, os.path.join(directory, name))
+    except Exception:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    start, end = step_dates(step)
+    index["steps"][str(step)] = {"start": start.isoformat(), "end": end.isoformat(), "complete": complete,
+                                 "fetched_at": datetime.datetime.now().isoformat(timespec="seconds"),
+                                 "chunk": name, "slot": None}
+
+
+def nanmedian(stack):
+    """
+    Median over axis 0 ignoring NaN (all-NaN cells stay NaN), in the stack's dtype. For the few
+    steps of a composite one sort plus two gathers is much faster than np.nanmedian's per-cell
+    fallback (fake_ee's scene composites use it too).
+    """
+    if len(stack) == 1:
+        return stack[0]
+    if len(stack) == 2:
+        a, b = stack
+        return np.where(np.isnan(a), b, np.where(np.isnan(b), a, (a + b) / 2)).astype(stack.dtype)
+    ordered = np.sort(stack, axis=0)  # NaN sorts last
+    n_valid = (~np.isnan(stack)).sum(axis=0)
+    lo = np.maximum((n_valid - 1) // 2, 0)[None]
+    hi = np.maximum(n_valid // 2, 0)[None]
+    hi = np.minimum(hi, len(stack) - 1)
+    median = (np.take_along_axis(ordered, lo, 0)[0] + np.take_along_axis(ordered, hi, 0)[0]) / 2
+    return np.where(n_valid > 0, median, np.nan).astype(stack.dtype)
+
+
+def _fresh(entry, end_date):
+    """Open step downloaded less than REFRESH_HOURS ago and still open at end_date."""
+    if not entry.get("fetched_at") or datetime.datetime.fromisoformat(entry["end"]) <= end_date:
+        return False
+    age = datetime.datetime.now() - datetime.datetime.fromisoformat(entry["fetched_at"])
+    return age < datetime.timedelta(hours=REFRESH_HOURS)
+
+
+def _lock(key):
+    with _locks_guard:
+        return _locks.setdefault(key, threading.Lock())
+
+
+def _namespace(key):
+    return os.path.join("datacube", key)
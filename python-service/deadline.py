@@ -0,0 +1,154 @@
+"""
+Per-request deadlines and graceful degradation.
+
+A request carries a time budget in `X-Deadline-Ms` (or `?deadline_ms=`), defaulting to
+REQUEST_DEADLINE_MS (0 = none). Inside the request:
+  - check() raises DeadlineExceeded once the budget is spent, or when a stage's usual
+    duration (moving average of its past runs, fed by metrics.record) no longer fits;
+  - allows(label, *stages) tells optional work (thumbnails, regional context...) whether it
+    fits, recording `label` as degraded when it does not;
+  - run(fn, stage) waits for fn at most until the deadline and abandons it after that
+    (the call finishes in the background and its result is dropped).
+The degraded labels are returned to the caller in the X-Degraded header.
+"""
+import contextlib
+import contextvars
+import os
+import threading
+import time
+
+import tracing
+
+DEFAULT_MS = int(os.environ.get("REQUEST_DEADLINE_MS", "0"))
+# Weight of the latest run in a stage's expected duration
+EWMA_ALPHA = 0.2
+
+# Deadline of the request being served (None when it has no budget)
+_current = contextvars.ContextVar("request_deadline", default=None)
+_expected = {}  # stage -> moving average of its duration (s)
+_expected_lock = threading.Lock()
+
+
+class DeadlineExceeded(Exception):
+    pass
+
+
+class Deadline:
+    def __init__(self, budget_ms):
+        self.budget_ms = budget_ms
+        self.expires = time.monotonic() + budget_ms / 1000
+        self.degraded = []
+        self._lock = threading.Lock()
+
+    def remaining(self):
+        return self.expires - time.monotonic()
+
+    def degrade(self, label):
+        with self._lock:
+            if label not in self.degraded:
+                self.degraded.append(label)
+        tracing.annotate(degraded=",".join(self.degraded))
+
+
+def budget_ms(headers, query_params):
+    """Budget asked for by the caller (header or query), else the default; None when there is none."""
+    raw = headers.get("x-deadline-ms") or query_params.get("deadline_ms")
+    try:
+        value = int(float(raw)) if raw else DEFAULT_MS
+    except ValueError:
+        value = DEFAULT_MS
+    return value if value > 0 else None
+
+
+@contextlib.contextmanager
+def request_scope(budget):
+    """Sets the deadline for the request served inside the block; yields it (None without a budget)."""
+    current = Deadline(budget) if budget else None
+    token = _current.set(current)
+    try:
+        yield current
+    finally:
+        _current.reset(token)
+
+
+def current_budget_ms():
+    current = _current.get()
+    return current.budget_ms if current is not None else None
+
+
+def remaining():
+    """Seconds left for the current request (None without a deadline)."""
+    current = _current.get()
+    return current.remaining() if current is not None else None
+
+
+def expected(*stages):
+    """Usual duration (s) of the given stages together; 0 for stages never seen."""
+    with _expected_lock:
+        return sum(_expected.get(stage, 0.0) for stage in stages)
+
+
+def observe(stage, ms):
+    with _expected_lock:
+        previous = _expected.get(stage)
+        seconds = ms / 1000
+        _expected[stage] = seconds if previous is None else previous + EWMA_ALPHA * (seconds - previous)
+
+
+def check(stage=None):
+    """Raises DeadlineExceeded when the budget is spent or `stage` can no longer finish in time."""
+    current = _current.get()
+    if current is None:
+        return
+    left = current.remaining()
+    if left <= 0:
+        raise DeadlineExceeded(f"Prazo de {current.budget_ms}ms esgotado antes de {stage or 'continuar'}")
+    if stage is not None and left < expected(stage):
+        raise DeadlineExceeded(f"{stage} leva ~{expected(stage) * 1000:.0f}ms, restam {left * 1000:.0f}ms")
+
+
+def allows(label, *stages):
+    """Whether optional work made of `stages` fits in the time left; if not, marks `label` degraded."""
+    current = _current.get()
+    if current is None or current.remaining() > expected(*stages):
+        return True
+    current.degrade(label)
+    return False
+
+
+def degrade(label):
+    current = _current.get()
+    if current is not None:
+        current.degrade(label)
+
+
+def degraded():
+    current = _current.get()
+    return list(current.degraded) if current is not None else []
+
+
+def run(fn, stage):
+    """fn() in the caller's context, abandoned (DeadlineExceeded) if it has not returned by the deadline."""
+    current = _current.get()
+    if current is None:
+        return fn()
+    check(stage)
+    outcome = {}
+    done = threading.Event()
+    context = contextvars.copy_context()
+
+    def target():
+        try:
+            outcome["result"] = context.run(fn)
+        except BaseException as e:
+            outcome["error"] = e
+        finally:
+            done.set()
+
+    threading.Thread(target=target, daemon=True, name=f"deadline-{stage}").start()
+    if not done.wait(max(current.remaining(), 0)):
+        current.degrade(f"{stage}_abandoned")
+        raise DeadlineExceeded(f"{stage} abandonado: prazo de {current.budget_ms}ms esgotado")
+    if "error" in outcome:
+        raise outcome["error"]
+    return outcome["result"]
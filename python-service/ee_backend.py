@@ -0,0 +1,296 @@
+"""
+Earth Engine backend selection (EE_BACKEND):
+  live    the real client (default)
+  fake    fake_ee: synthetic scenes evaluated locally, no credentials or network
+  record  builds with fake_ee, runs each round-trip on the real client and saves the response
+  replay  serves recorded responses from EE_FIXTURES_DIR, offline and deterministic
+Service code imports `ee` from here and sends every round-trip (getInfo, getThumbURL,
+computePixels) through get_info / thumb_url / compute_pixels, which also time it (metrics.py);
+`stage` names the round-trip in /metrics, Server-Timing and the trace log, where extra keyword
+tags (dataset, scale...) are attached to its span. Round-trips are rate limited, retried and
+circuit-broken by ee_gateway in every mode; under a request deadline (deadline.py) a round-trip
+is not started when it usually takes longer than the time left, and is abandoned at the deadline.
+In fake and replay modes
+EE_FAKE_LATENCY_MS ("300" or "100-800") and EE_FAKE_FAILURE_RATE (0..1) inject latency and errors.
+The fake's own evaluation CPU is counted in yvy_fake_ee_cpu_seconds_total and, with
+EE_FAKE_CPU_DIR set, written per process to <dir>/<pid>.json (load tests subtract it).
+"""
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+import urllib.request
+from collections import Counter
+
+import deadline
+import ee_gateway
+import metrics
+import tracing
+
+MODE = os.environ.get("EE_BACKEND", "live").strip().lower()
+if MODE not in ("live", "fake", "record", "replay"):
+    raise ValueError(f"EE_BACKEND must be live, fake, record or replay (got {MODE!r})")
+
+if MODE == "live":
+    import ee
+else:
+    import fake_ee as ee
+
+FIXTURES_DIR = os.environ.get("EE_FIXTURES_DIR",
+                              os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmarks", "fixtures", "ee"))
+# Replay sleeps for the latency measured while recording
+REPLAY_REALTIME = os.environ.get("EE_REPLAY_REALTIME", "0") == "1"
+
+# Errors the fake raises under failure injection (messages the real service returns under load)
+FAKE_ERRORS = ["Computation timed out.", "Too many concurrent aggregations.", "User memory limit exceeded."]
+
+# Round-trips per operation since startup
+STATS = Counter()
+FAKE_CPU_DIR = os.environ.get("EE_FAKE_CPU_DIR")
+_fake_cpu_s = 0.0
+_stats_lock = threading.Lock()
+_config = {}
+_rng = random.Random(int(os.environ.get("EE_FAKE_SEED", "0")))
+_real = None
+_real_lock = threading.Lock()
+
+
+def configure(latency_ms=None, failure_rate=None):
+    """Overrides the injected latency ("300", "100-800" or a number) and failure rate at runtime."""
+    if latency_ms is not None:
+        _config["latency_ms"] = str(latency_ms)
+    if failure_rate is not None:
+        _config["failure_rate"] = float(failure_rate)
+
+
+def get_info(obj, stage=None, **tags):
+    """obj.getInfo() through the configured backend."""
+    return _timed("getInfo", stage, tags, obj.serialize, lambda: obj.getInfo(), lambda real: real(obj).getInfo())
+
+
+def thumb_url(image, params, stage=None, **tags):
+    """image.getThumbURL(params); fake and replay return data: URLs (urlopen reads them like http ones)."""
+    return _timed("getThumbURL", stage, tags, lambda: _describe(image, params),
+                  lambda: image.getThumbURL(params),
+                  lambda real: real(image).getThumbURL(real(params)))
+
+
+def compute_pixels(request, stage=None, **tags):
+    """ee.data.computePixels(request) (NUMPY_NDARRAY requests return a structured array)."""
+    return _timed("computePixels", stage, tags, lambda: _describe(request),
+                  lambda: ee.data.computePixels(request),
+                  lambda real: _real_ee().data.computePixels(real(request)))
+
+
+def snapshot():
+    with _stats_lock:
+        return {"mode": MODE, "round_trips": dict(STATS), "gateway": ee_gateway.snapshot()}
+
+
+def _timed(op, stage, tags, *args):
+    name = f"ee_{stage or op}"
+    deadline.check(name)
+    started = time.perf_counter()
+    outcome = "error"
+    try:
+        with tracing.span(f"ee.{op}", stage=stage, backend=MODE, **tags) as span:
+            result, retries = deadline.run(
+                lambda: ee_gateway.call(op, lambda: _round_trip(op, *args), (ee.EEException, OSError)), name)
+            if span is not None:
+                span.tag(**_payload_size(result), **({"retries": retries} if retries else {}))
+        outcome = "ok"
+        return result
+    except deadline.DeadlineExceeded:
+        outcome = "abandoned"
+        raise
+    finally:
+        ms = (time.perf_counter() - started) * 1000
+        metrics.count("yvy_ee_calls_total", op=op, outcome=outcome)
+        # An abandoned call's duration is unknown; it must not lower the stage's expected duration
+        if outcome != "abandoned":
+            metrics.observe("yvy_ee_call_duration_ms", ms, op=op)
+            metrics.record(name, ms)
+
+
+def _payload_size(result):
+    """Size tags for a round-trip's result, without re-serializing large samples."""
+    if hasattr(result, "nbytes"):
+        return {"bytes": int(result.nbytes)}
+    if isinstance(result, str):
+        return {"bytes": len(result)}
+    if isinstance(result, dict) and "features" in result:
+        return {"features": len(result["features"])}
+    return {"bytes": len(json.dumps(result, default=str))}
+
+
+def _round_trip(op, describe, run, run_real):
+    with _stats_lock:
+        STATS[op] += 1
+    if MODE == "live":
+        return run()
+    if MODE == "fake":
+        _inject()
+        started = time.thread_time()
+        try:
+            return run()
+        finally:
+            _count_fake_cpu(time.thread_time() - started)
+
+    key = hashlib.sha1(f"{op}:{describe()}".encode()).hexdigest()
+    if MODE == "replay":
+        _inject()
+        return _load_fixture(op, key)
+    started = time.perf_counter()
+    result = run_real(_translator())
+    _save_fixture(op, key, result, (time.perf_counter() - started) * 1000)
+    return result
+
+
+def _count_fake_cpu(seconds):
+    """Adds CPU spent evaluating fake_ee graphs (the service's own work excluded) to the process total."""
+    global _fake_cpu_s
+    metrics.count("yvy_fake_ee_cpu_seconds_total", seconds)
+    with _stats_lock:
+        _fake_cpu_s += seconds
+        if not FAKE_CPU_DIR:
+            return
+        # Under the lock: threads of this process share the temp file
+        path = os.path.join(FAKE_CPU_DIR, f"{os.getpid()}.json")
+        try:
+            os.makedirs(FAKE_CPU_DIR, exist_ok=True)
+            with open(path + ".tmp", "w") as f:
+                json.dump({"cpu_s": _fake_cpu_s}, f)
+            os.replace(path + ".tmp", path)
+        except OSError:
+            pass
+
+
+def _inject():
+    latency = _config.get("latency_ms", os.environ.get("EE_FAKE_LATENCY_MS", "0"))
+    low, _, high = str(latency).partition("-")
+    delay = _rng.uniform(float(low), float(high or low)) if float(high or low) > 0 else 0
+    if delay:
+        time.sleep(delay / 1000)
+    if _rng.random() < _config.get("failure_rate", float(os.environ.get("EE_FAKE_FAILURE_RATE", "0"))):
+        raise ee.EEException(_rng.choice(FAKE_ERRORS))
+
+
+def _describe(*values):
+    import fake_ee
+
+    return json.dumps(fake_ee._encode(list(values), 0), sort_keys=True, separators=(",", ":"))
+
+
+# --- record / replay ------------------------------------------------------------------------
+
+def _fixture_path(op, key, ext):
+    return os.path.join(FIXTURES_DIR, f"{op}-{key}{ext}")
+
+
+def _save_fixture(op, key, result, elapsed_ms):
+    import numpy as np
+
+    os.makedirs(FIXTURES_DIR, exist_ok=True)
+    entry = {"op": op, "elapsed_ms": round(elapsed_ms, 1)}
+    if op == "computePixels":
+        np.save(_fixture_path(op, key, ".npy"), result)
+    elif op == "getThumbURL":
+        # Thumbnail URLs expire; keep the image itself
+        with urllib.request.urlopen(result, timeout=60) as response:
+            media_type = response.headers.get_content_type()
+            body = response.read()
+        with open(_fixture_path(op, key, ".bin"), "wb") as f:
+            f.write(body)
+        entry["media_type"] = media_type
+    else:
+        entry["result"] = result
+    with open(_fixture_path(op, key, ".json"), "w") as f:
+        json.dump(entry, f)
+    print(f"📼 Recorded {op} {key[:12]} ({elapsed_ms:.0f}ms)")
+
+
+def _load_fixture(op, key):
+    import base64
+    import numpy as np
+
+    try:
+        with open(_fixture_path(op, key, ".json")) as f:
+            entry = json.load(f)
+    except OSError:
+        raise ee.EEException(f"Replay: no recorded {op} for this request ({key[:12]}); record it with EE_BACKEND=record")
+    if REPLAY_REALTIME:
+        time.sleep(entry.get("elapsed_ms", 0) / 1000)
+    if op == "computePixels":
+        return np.load(_fixture_path(op, key, ".npy"))
+    if op == "getThumbURL":
+        with open(_fixture_path(op, key, ".bin"), "rb") as f:
+            body = f.read()
+        return f"data:{entry['media_type']};base64," + base64.b64encode(body).decode("ascii")
+    return entry["result"]
+
+
+def _real_ee():
+    """The real client, initialized with the arguments the service passed to fake_ee.Initialize."""
+    global _real
+    with _real_lock:
+        if _real is None:
+            import ee as real_ee
+
+            kwargs = {k: v for k, v in ee._init_kwargs.items() if v is not None and v is not True}
+            real_ee.Initialize(**kwargs)
+            _real = real_ee
+    return _real
+
+
+def _translator():
+    """Function rebuilding a fake_ee graph (or a value containing graphs) with the real client."""
+    import fake_ee
+
+    real_ee = _real_ee()
+    memo = {}
+
+    def real(value, env=None):
+        env = env or {}
+        if isinstance(value, dict):
+            return {k: real(v, env) for k, v in value.items()}
+        if isinstance(value, (list, tuple)):
+            return [real(v, env) for v in value]
+        if not isinstance(value, fake_ee.ComputedObject):
+            return value
+        if value._fn == "var":
+            return env[value._args[0]]
+        key = (id(value), tuple(sorted((k, id(v)) for k, v in env.items())))
+        if key not in memo:
+            memo[key] = (value, _build(value, env))
+        return memo[key][1]
+
+    def _build(node, env):
+        fn, args, kwargs = node._fn, node._args, node._kwargs
+        if fn == "map":
+            lam = args[0]
+            var_id = lam.var._args[0]
+            return real(node._recv, env).map(lambda image: real(lam.body, {**env, var_id: image}))
+        if fn == "constant":
+            return real(args[0], env)
+        if fn == "ImageCollection.load" or fn == "ImageCollection.fromImages":
+            return real_ee.ImageCollection(real(args[0], env))
+        if fn == "Dictionary":
+            return real_ee.Dictionary(real(args[0], env))
+        real_args = [real(a, env) for a in args]
+        real_kwargs = {k: real(v, env) for k, v in kwargs.items()}
+        if node._recv is not None:
+            receiver = real(node._recv, env)
+            if fn in ("reduceRegion", "sample"):
+                # fake_ee keeps geometry/scale positional; the real signatures take them as keywords too
+                names = ("reducer", "geometry", "scale") if fn == "reduceRegion" else ("region", "scale")
+                real_kwargs.update(zip(names, real_args))
+                real_args = []
+            return getattr(receiver, fn)(*real_args, **real_kwargs)
+        target = real_ee
+        for part in fn.split("."):
+            target = getattr(target, part)
+        return target(*real_args, **real_kwargs)
+
+    return real
@@ -0,0 +1,207 @@
+"""
+Gateway every Earth Engine round-trip goes through (see ee_backend):
+  - token bucket: at most EE_RATE_PER_S calls per second (bursts of EE_BURST; 0 disables it)
+  - AIMD concurrency limit: +1/limit per success, halved on throttling errors
+    (429, "Too many concurrent aggregations", quota), between EE_MIN_CONCURRENCY and EE_MAX_CONCURRENCY
+  - retries with full-jitter exponential backoff for throttling and transient errors
+    (not past the request's deadline, see deadline.py)
+  - circuit breaker: after EE_BREAKER_THRESHOLD consecutive failed attempts, calls fail fast for
+    EE_BREAKER_COOLDOWN_S, then a single probe call decides whether to close it again
+Limits are per process (each uvicorn worker has its own gateway). State is exported to /metrics.
+"""
+import os
+import random
+import re
+import threading
+import time
+
+import deadline
+import metrics
+
+RATE_PER_S = float(os.environ.get("EE_RATE_PER_S", "20"))
+BURST = float(os.environ.get("EE_BURST", "20"))
+MIN_CONCURRENCY = int(os.environ.get("EE_MIN_CONCURRENCY", "1"))
+MAX_CONCURRENCY = int(os.environ.get("EE_MAX_CONCURRENCY", "10"))
+RETRIES = int(os.environ.get("EE_RETRIES", "3"))
+BACKOFF_BASE_S = float(os.environ.get("EE_BACKOFF_BASE_S", "0.5"))
+BACKOFF_CAP_S = float(os.environ.get("EE_BACKOFF_CAP_S", "8"))
+BREAKER_THRESHOLD = int(os.environ.get("EE_BREAKER_THRESHOLD", "5"))
+BREAKER_COOLDOWN_S = float(os.environ.get("EE_BREAKER_COOLDOWN_S", "30"))
+
+# Error messages (lower-cased) the client raises for throttling and for transient failures
+THROTTLE_PATTERN = re.compile(r"too many concurrent aggregations|too many requests|quota|rate limit|httperror 429")
+TRANSIENT_PATTERN = re.compile(r"httperror 5\d\d|service (is currently )?unavailable|internal error|backend error"
+                               r"|connection (reset|aborted|refused)|temporarily|deadline exceeded")
+
+
+class CircuitOpen(Exception):
+    pass
+
+
+def classify(error):
+    """'throttle', 'transient' or 'fatal' (bad request, memory limit, computation timeout...)."""
+    if isinstance(error, (ConnectionError, TimeoutError)):
+        return "transient"
+    message = str(error).lower()
+    if THROTTLE_PATTERN.search(message):
+        return "throttle"
+    if TRANSIENT_PATTERN.search(message):
+        return "transient"
+    return "fatal"
+
+
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate, self.burst = rate, burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Blocks until a token is available; returns the seconds waited."""
+        if self.rate <= 0:
+            return 0.0
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return waited
+                delay = (1 - self.tokens) / self.rate
+            time.sleep(delay)
+            waited += delay
+
+
+class AIMDLimiter:
+    def __init__(self, minimum, maximum):
+        self.minimum, self.maximum = minimum, maximum
+        self.limit = float(maximum)
+        self.in_flight = 0
+        self._cond = threading.Condition()
+
+    def acquire(self):
+        with self._cond:
+            while self.in_flight >= max(self.minimum, int(self.limit)):
+                self._cond.wait()
+            self.in_flight += 1
+
+    def release(self, outcome):
+        with self._cond:
+            self.in_flight -= 1
+            if outcome == "ok":
+                self.limit = min(self.maximum, self.limit + 1 / max(self.limit, 1))
+            elif outcome == "throttle":
+                self.limit = max(self.minimum, self.limit / 2)
+            self._cond.notify_all()
+
+
+class CircuitBreaker:
+    def __init__(self, threshold, cooldown_s):
+        self.threshold, self.cooldown_s = threshold, cooldown_s
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        return "half_open" if time.monotonic() - self.opened_at >= self.cooldown_s else "open"
+
+    def before_call(self):
+        """Raises CircuitOpen when failing fast; returns True when this call is the half-open probe."""
+        with self._lock:
+            state = self.state
+            if state == "open" or (state == "half_open" and self.probing):
+                remaining = self.cooldown_s - (time.monotonic() - self.opened_at)
+                raise CircuitOpen(f"Earth Engine indisponível (circuit breaker aberto, nova tentativa em {max(remaining, 0):.0f}s)")
+            if state == "half_open":
+                self.probing = True
+                return True
+            return False
+
+    def record(self, outcome, probe=False):
+        """
+        Outcome of one attempt: 'ok', 'throttle', 'transient', 'fatal' or 'error' (exception the
+        caller does not classify). Fatal errors are the request's fault, not a sign that EE is down,
+        so they only count as an answer from EE when they end a probe.
+        """
+        with self._lock:
+            if probe:
+                self.probing = False
+            if outcome == "ok" or (probe and outcome == "fatal"):
+                if self.opened_at is not None:
+                    print("🟢 EE circuit breaker closed")
+                self.failures, self.opened_at = 0, None
+            elif outcome in ("throttle", "transient"):
+                self.failures += 1
+                if self.failures >= self.threshold or self.opened_at is not None:
+                    if self.opened_at is None or self.state == "half_open":
+                        print(f"🔴 EE circuit breaker open after {self.failures} consecutive failures")
+                    self.opened_at = time.monotonic()
+            elif probe:
+                # The probe died without an answer from EE: wait another cooldown before the next one
+                print("🔴 EE circuit breaker probe inconclusive, staying open")
+                self.opened_at = time.monotonic()
+
+
+bucket = TokenBucket(RATE_PER_S, BURST)
+limiter = AIMDLimiter(MIN_CONCURRENCY, MAX_CONCURRENCY)
+breaker = CircuitBreaker(BREAKER_THRESHOLD, BREAKER_COOLDOWN_S)
+_rng = random.Random()
+
+
+def call(op, fn, error_types=(Exception,)):
+    """
+    fn() under the rate limit, concurrency limit and circuit breaker, retrying throttling and
+    transient errors. Returns (result, retries). Raises CircuitOpen when failing fast.
+    """
+    retries = 0
+    while True:
+        try:
+            probe = breaker.before_call()
+        except CircuitOpen:
+            metrics.count("yvy_ee_rejected_total", op=op)
+            raise
+        waited = bucket.acquire()
+        if waited:
+            metrics.observe("yvy_ee_rate_wait_ms", waited * 1000, op=op)
+        limiter.acquire()
+        outcome = "error"
+        try:
+            result = fn()
+            outcome = "ok"
+            return result, retries
+        except error_types as e:
+            outcome = classify(e)
+            if outcome == "fatal" or retries >= RETRIES:
+                raise
+            metrics.count("yvy_ee_retries_total", op=op, reason=outcome)
+            retries += 1
+        finally:
+            limiter.release(outcome)
+            # Every outcome is recorded so a probe never leaves the breaker stuck half-open
+            breaker.record(outcome, probe)
+            _export()
+        delay = _rng.uniform(0, min(BACKOFF_CAP_S, BACKOFF_BASE_S * 2 ** retries))
+        left = deadline.remaining()
+        if left is not None and left < delay:
+            raise deadline.DeadlineExceeded(f"EE {op}: sem tempo para nova tentativa ({outcome})")
+        print(f"⏳ EE {op} {outcome} error, retry {retries}/{RETRIES} in {delay:.1f}s")
+        time.sleep(delay)
+
+
+def snapshot():
+    return {"concurrency_limit": round(limiter.limit, 2), "in_flight": limiter.in_flight,
+            "circuit": breaker.state, "consecutive_failures": breaker.failures,
+            "rate_per_s": RATE_PER_S, "tokens": round(bucket.tokens, 2)}
+
+
+def _export():
+    metrics.set_gauge("yvy_ee_concurrency_limit", limiter.limit)
+    metrics.set_gauge("yvy_ee_in_flight", limiter.in_flight)
+    metrics.set_gauge("yvy_ee_circuit_open", {"closed": 0, "half_open": 0.5, "open": 1}[breaker.state])
@@ -0,0 +1,102 @@
+import contextlib
+import contextvars
+import datetime
+import functools
+import threading
+from collections import Counter
+
+import metrics
+
+# Registry of the request being served (None outside a request scope)
+_current = contextvars.ContextVar("ee_registry", default=None)
+
+# Cumulative per-endpoint counters: requests, lookups (builds without the registry), builds, hits
+STATS = {}
+_stats_lock = threading.Lock()
+
+
+class Registry:
+    """Memoized Earth Engine objects for one request, keyed by (kind, dataset, roi, window)."""
+
+    def __init__(self, endpoint):
+        self.endpoint = endpoint
+        self.objects = {}
+        self.builds = Counter()
+        self.hits = Counter()
+        self._lock = threading.Lock()
+
+    def get(self, key, build):
+        with self._lock:
+            if key in self.objects:
+                self.hits[key[0]] += 1
+                return self.objects[key]
+        value = build()
+        with self._lock:
+            # Two threads may race on the same key; keep the first object so consumers share it
+            if key in self.objects:
+                self.hits[key[0]] += 1
+                return self.objects[key]
+            self.objects[key] = value
+            self.builds[key[0]] += 1
+        return value
+
+    def summary(self):
+        builds, hits = sum(self.builds.values()), sum(self.hits.values())
+        return {"lookups": builds + hits, "builds": builds, "hits": hits, "by_kind": dict(self.builds)}
+
+
+def memoize(kind, dataset, roi, start_date, end_date, build, *extra):
+    """
+    Returns the request's shared object for (kind, dataset, roi, window, *extra), building it once.
+    ee objects hash and compare structurally, so the same ROI geometry built twice still matches.
+    Outside a request scope this just builds.
+    """
+    registry = _current.get()
+    if registry is None:
+        return build()
+    key = (kind, dataset, roi, _day(start_date), _day(end_date)) + tuple(extra)
+    return registry.get(key, build)
+
+
+@contextlib.contextmanager
+def request_scope(endpoint):
+    registry = Registry(endpoint)
+    token = _current.set(registry)
+    try:
+        yield registry
+    finally:
+        _current.reset(token)
+        summary = registry.summary()
+        if summary["lookups"]:
+            print(f"🧩 {endpoint}: {summary['lookups']} EE collection lookups -> "
+                  f"{summary['builds']} builds ({summary['hits']} shared) {summary['by_kind']}")
+        with _stats_lock:
+            stats = STATS.setdefault(endpoint, Counter())
+            stats["requests"] += 1
+            stats["lookups"] += summary["lookups"]
+            stats["builds"] += summary["builds"]
+            stats["hits"] += summary["hits"]
+        metrics.count("yvy_cache_total", summary["hits"], cache="ee_registry", result="hit")
+        metrics.count("yvy_cache_total", summary["builds"], cache="ee_registry", result="miss")
+
+
+def scoped(endpoint):
+    """Decorator: runs a (sync) endpoint inside its own request scope."""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with request_scope(endpoint):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def snapshot():
+    with _stats_lock:
+        return {endpoint: dict(stats) for endpoint, stats in STATS.items()}
+
+
+def _day(value):
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.strftime('%Y-%m-%d')
+    return str(value)[:10]
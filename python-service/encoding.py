@@ -0,0 +1,171 @@
+import io
+import json
+import struct
+import time
+
+import numpy as np
+
+# Media types negotiated through the Accept header
+JSON = "application/json"
+MSGPACK = "application/msgpack"
+ARROW = "application/vnd.apache.arrow.stream"
+LABEL_GRID = "application/vnd.yvy.label-grid"
+PNG = "image/png"
+WEBP = "image/webp"
+
+# Aliases accepted from clients that use older/unofficial names
+ALIASES = {
+    "application/x-msgpack": MSGPACK,
+    "application/vnd.msgpack": MSGPACK,
+}
+
+# Label grid header: magic, version, k, width, height, lat_min, lon_min, lat_max, lon_max
+LABEL_GRID_MAGIC = b"YVYL"
+LABEL_GRID_VERSION = 1
+LABEL_GRID_HEADER = struct.Struct("<4sBBHHdddd")
+
+
+def is_available(fmt):
+    """Whether the optional dependency needed for a format is installed."""
+    module = {MSGPACK: "msgpack", ARROW: "pyarrow"}.get(fmt)
+    if module is None:
+        return True
+    try:
+        __import__(module)
+        return True
+    except ImportError:
+        return False
+
+
+def negotiate(accept, offered):
+    """
+    Picks the best media type from `offered` (in server preference order) for an Accept header.
+    Returns the first offered type when the header is missing or is */*, and None when
+    nothing offered is acceptable (caller should answer 406).
+    """
+    if not accept:
+        return offered[0]
+
+    ranges = []
+    for order, part in enumerate(accept.split(",")):
+        fields = [f.strip() for f in part.split(";")]
+        media = ALIASES.get(fields[0].lower(), fields[0].lower())
+        q = 1.0
+        for param in fields[1:]:
+            if param.startswith("q="):
+                try:
+                    q = float(param[2:])
+                except ValueError:
+                    q = 0.0
+        if media:
+            ranges.append((media, q, order))
+
+    best, best_rank = None, None
+    for pref, media in enumerate(offered):
+        for candidate, q, order in ranges:
+            if q <= 0:
+                continue
+            if candidate == media:
+                specificity = 2
+            elif candidate == media.split("/")[0] + "/*":
+                specificity = 1
+            elif candidate == "*/*":
+                specificity = 0
+            else:
+                continue
+            # Higher q wins, then more specific ranges, then server preference
+            rank = (q, specificity, -pref)
+            if best_rank is None or rank > best_rank:
+                best, best_rank = media, rank
+    return best
+
+
+def encode_overlay(img, fmt=PNG):
+    """
+    Encodes an RGBA overlay compactly.
+    PNG: palette mode (8-bit indexed, alpha kept in the tRNS chunk).
+    WEBP: lossless WebP, which keeps the soft alpha edges.
+    """
+    from PIL import Image
+
+    buffer = io.BytesIO()
+    if fmt == WEBP:
+        img.save(buffer, format="WEBP", lossless=True, method=4)
+    else:
+        paletted = img.quantize(colors=256, method=Image.Quantize.FASTOCTREE)
+        paletted.save(buffer, format="PNG", optimize=True)
+    return buffer.getvalue()
+
+
+def encode_label_grid(grid, k, bounds):
+    """
+    Raw uint8 label grid (row-major, top row first) prefixed by a small fixed header.
+    Cells outside the farm polygon hold 255.
+    """
+    grid = np.ascontiguousarray(grid, dtype=np.uint8)
+    height, width = grid.shape
+    (lat_min, lon_min), (lat_max, lon_max) = bounds
+    header = LABEL_GRID_HEADER.pack(
+        LABEL_GRID_MAGIC, LABEL_GRID_VERSION, k, width, height,
+        lat_min, lon_min, lat_max, lon_max
+    )
+    return header + grid.tobytes()
+
+
+def decode_label_grid(data):
+    """Inverse of encode_label_grid. Returns (grid, k, bounds)."""
+    magic, version, k, width, height, lat_min, lon_min, lat_max, lon_max = \
+        LABEL_GRID_HEADER.unpack_from(data)
+    if magic != LABEL_GRID_MAGIC or version != LABEL_GRID_VERSION:
+        raise ValueError("Label grid inválido (cabeçalho desconhecido)")
+    body = np.frombuffer(data, dtype=np.uint8, offset=LABEL_GRID_HEADER.size)
+    grid = body[:width * height].reshape(height, width)
+    return grid, k, [[lat_min, lon_min], [lat_max, lon_max]]
+
+
+def encode_msgpack(payload):
+    """MessagePack encoding; bytes values (e.g. overlay PNGs) are kept binary instead of base64."""
+    import msgpack
+    return msgpack.packb(payload, use_bin_type=True, default=_to_builtin)
+
+
+def encode_zone_table(zones, pixels, labels, sorted_indices, bounds=None):
+    """
+    Arrow IPC stream with one row per clustered pixel (lat, lon, ndvi, zone).
+    Zone metadata (without the per-pixel coordinate lists) travels in the schema metadata.
+    """
+    import pyarrow as pa
+
+    mapping = {int(sorted_indices[new_idx]): new_idx for new_idx in range(len(sorted_indices))}
+    zone_ids = np.array([mapping.get(int(l), 0) for l in labels], dtype=np.uint8)
+    table = pa.table({
+        "lat": pa.array([p["lat"] for p in pixels], type=pa.float64()),
+        "lon": pa.array([p["lon"] for p in pixels], type=pa.float64()),
+        "ndvi": pa.array([p.get("ndvi") for p in pixels], type=pa.float32()),
+        "zone": pa.array(zone_ids, type=pa.uint8()),
+    })
+    summary = [{key: value for key, value in z.items() if key != "coordinates"} for z in zones]
+    table = table.replace_schema_metadata({
+        "zones": json.dumps(summary, default=_to_builtin),
+        "bounds": json.dumps(bounds),
+    })
+
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+
+def timed_encode(fn, *args, **kwargs):
+    """Runs an encoder and returns (bytes, elapsed_ms)."""
+    started = time.perf_counter()
+    data = fn(*args, **kwargs)
+    return data, (time.perf_counter() - started) * 1000
+
+
+def _to_builtin(value):
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    raise TypeError(f"Tipo não serializável: {type(value).__name__}")
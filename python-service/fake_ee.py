@@ -0,0 +1,996 @@
+"""
+Offline stand-in for the subset of the `ee` API this service uses (see ee_backend.py).
+Expressions are built as a graph exactly like with the real client, and evaluated locally
+against a synthetic world: deterministic Sentinel-1/2, Landsat and Sentinel-3 scenes whose
+pixels come from a smooth vigor field plus location-hashed noise and per-scene clouds.
+Not a physical model — it exists so the service can run, be profiled and be regression-tested
+without Earth Engine credentials.
+"""
+import base64
+import datetime
+import io
+import itertools
+import json
+import math
+import os
+import warnings
+from collections.abc import Mapping
+from functools import lru_cache
+
+import numpy as np
+
+# Scenes are generated from this date up to today
+ANCHOR = datetime.date(2017, 1, 1)
+# Evaluation grids are coarsened above this many cells (reduceRegion/sample at 10m over huge ROIs)
+MAX_PIXELS = int(os.environ.get("FAKE_EE_MAX_PIXELS", "250000"))
+# Thumbnails are rendered on at most this many cells per side, then upscaled to `dimensions`
+THUMB_MAX_SIDE = int(os.environ.get("FAKE_EE_THUMB_SIDE", "128"))
+SEED = int(os.environ.get("FAKE_EE_SEED", "0"))
+
+# dataset -> (revisit days, day offset, sensor)
+DATASETS = {
+    "COPERNICUS/S2_SR_HARMONIZED": (5, 0, "s2"),
+    "COPERNICUS/S2_SR": (5, 0, "s2"),
+    "COPERNICUS/S2_HARMONIZED": (5, 0, "s2"),
+    "COPERNICUS/S1_GRD": (6, 2, "s1"),
+    "LANDSAT/LC09/C02/T1_L2": (16, 0, "landsat"),
+    "LANDSAT/LC08/C02/T1_L2": (16, 8, "landsat"),
+    "COPERNICUS/S3/OLCI": (1, 0, "s3"),
+}
+
+
+class EEException(Exception):
+    pass
+
+
+class _Data:
+    """Stand-in for ee.data: credentials flag and computePixels."""
+    _credentials = None
+
+    @staticmethod
+    def computePixels(request):
+        return compute_pixels(request)
+
+
+data = _Data()
+_init_kwargs = {}
+
+
+def Initialize(credentials=None, project=None, **kwargs):
+    """Records the arguments (used by the record backend to initialize the real client) and marks EE ready."""
+    _init_kwargs.clear()
+    _init_kwargs.update(kwargs, credentials=credentials, project=project)
+    data._credentials = credentials or True
+
+
+def Authenticate(*args, **kwargs):
+    pass
+
+
+# --- Expression graph -----------------------------------------------------------------------
+
+_var_ids = itertools.count()
+
+
+class ComputedObject:
+    """A node: `fn` applied to `args`/`kwargs`, with `recv` as receiver for method calls."""
+
+    def __init__(self, value=None):
+        if isinstance(value, ComputedObject):
+            self._fn, self._recv, self._args, self._kwargs = value._fn, value._recv, value._args, value._kwargs
+        else:
+            self._fn, self._recv, self._args, self._kwargs = "constant", None, (value,), {}
+
+    @classmethod
+    def _node(cls, fn, args=(), kwargs=None, recv=None):
+        node = cls.__new__(cls)
+        node._fn, node._recv, node._args, node._kwargs = fn, recv, tuple(args), dict(kwargs or {})
+        return node
+
+    def _method(self, cls, name, *args, **kwargs):
+        return cls._node(name, args, kwargs, recv=self)
+
+    def serialize(self):
+        return json.dumps(_encode(self, 0), sort_keys=True, separators=(",", ":"))
+
+    def __hash__(self):
+        return hash(self.serialize())
+
+    def __eq__(self, other):
+        return isinstance(other, ComputedObject) and self.serialize() == other.serialize()
+
+    def __repr__(self):
+        return f"fake_ee.{type(self).__name__}({self._fn})"
+
+    def getInfo(self):
+        return evaluate(self)
+
+    # Server-side number/dictionary helpers
+    def get(self, key):
+        return self._method(ComputedObject, "get", key)
+
+    def gt(self, other):
+        return self._method(ComputedObject, "gt", other)
+
+    def lt(self, other):
+        return self._method(ComputedObject, "lt", other)
+
+    def add(self, other):
+        return self._method(ComputedObject, "add", other)
+
+    def subtract(self, other):
+        return self._method(ComputedObject, "subtract", other)
+
+    def multiply(self, other):
+        return self._method(ComputedObject, "multiply", other)
+
+    def divide(self, other):
+        return self._method(ComputedObject, "divide", other)
+
+
+class Number(ComputedObject):
+    pass
+
+
+class List(ComputedObject):
+    pass
+
+
+class Dictionary(ComputedObject):
+    def __init__(self, value=None):
+        super().__init__()
+        if isinstance(value, ComputedObject):
+            self._fn, self._recv, self._args, self._kwargs = value._fn, value._recv, value._args, value._kwargs
+        else:
+            self._fn, self._recv, self._args, self._kwargs = "Dictionary", None, (dict(value or {}),), {}
+
+
+class Algorithms:
+    @staticmethod
+    def If(condition, true_case, false_case):
+        return ComputedObject._node("Algorithms.If", (condition, true_case, false_case))
+
+
+class Reducer(ComputedObject):
+    @staticmethod
+    def mean():
+        return Reducer._node("Reducer.mean")
+
+    @staticmethod
+    def median():
+        return Reducer._node("Reducer.median")
+
+    @staticmethod
+    def count():
+        return Reducer._node("Reducer.count")
+
+    @staticmethod
+    def allNonZero():
+        return Reducer._node("Reducer.allNonZero")
+
+
+class Filter(ComputedObject):
+    @staticmethod
+    def lt(name, value):
+        return Filter._node("Filter.lt", (name, value))
+
+    @staticmethod
+    def gt(name, value):
+        return Filter._node("Filter.gt", (name, value))
+
+    @staticmethod
+    def eq(name, value):
+        return Filter._node("Filter.eq", (name, value))
+
+    @staticmethod
+    def listContains(name, value):
+        return Filter._node("Filter.listContains", (name, value))
+
+
+class Geometry(ComputedObject):
+    @staticmethod
+    def Point(coords, *args, **kwargs):
+        return Geometry._node("Geometry.Point", (list(coords),))
+
+    @staticmethod
+    def Polygon(coords, *args, **kwargs):
+        return Geometry._node("Geometry.Polygon", (coords,))
+
+    @staticmethod
+    def Rectangle(coords, *args, **kwargs):
+        return Geometry._node("Geometry.Rectangle", (list(coords),))
+
+    def buffer(self, distance, *args):
+        return self._method(Geometry, "buffer", distance)
+
+    def bounds(self, *args):
+        return self._method(Geometry, "bounds")
+
+    def area(self, *args):
+        return self._method(Number, "area")
+
+    def centroid(self, *args):
+        return self._method(Geometry, "centroid")
+
+
+class Image(ComputedObject):
+    def __init__(self, value=None):
+        super().__init__()
+        if isinstance(value, Image):
+            self._fn, self._recv, self._args, self._kwargs = value._fn, value._recv, value._args, value._kwargs
+        elif isinstance(value, (list, tuple)):
+            self._fn, self._recv, self._args, self._kwargs = "Image.cat", None, (list(value),), {}
+        else:
+            self._fn, self._recv, self._args, self._kwargs = "Image.constant", None, (value,), {}
+
+    @staticmethod
+    def constant(value):
+        return Image._node("Image.constant", (value,))
+
+    @staticmethod
+    def cat(*images):
+        if len(images) == 1 and isinstance(images[0], (list, tuple)):
+            images = images[0]
+        return Image._node("Image.cat", (list(images),))
+
+    @staticmethod
+    def pixelLonLat():
+        return Image._node("Image.pixelLonLat")
+
+    def select(self, selectors, *more):
+        names = list(selectors) if isinstance(selectors, (list, tuple)) else [selectors, *more]
+        return self._method(Image, "select", names)
+
+    def rename(self, names, *more):
+        names = list(names) if isinstance(names, (list, tuple)) else [names, *more]
+        return self._method(Image, "rename", names)
+
+    def normalizedDifference(self, bands):
+        return self._method(Image, "normalizedDifference", list(bands))
+
+    def addBands(self, other, *args):
+        return self._method(Image, "addBands", other)
+
+    def updateMask(self, mask):
+        return self._method(Image, "updateMask", mask)
+
+    def unmask(self, value=0, *args):
+        return self._method(Image, "unmask", value)
+
+    def clip(self, geometry):
+        return self._method(Image, "clip", geometry)
+
+    def where(self, test, value):
+        return self._method(Image, "where", test, value)
+
+    def reduce(self, reducer):
+        return self._method(Image, "reduce", reducer)
+
+    def toFloat(self):
+        return self._method(Image, "toFloat")
+
+    def toDouble(self):
+        return self._method(Image, "toDouble")
+
+    def copyProperties(self, source, *args):
+        return self._method(Image, "copyProperties", source)
+
+    def visualize(self, **params):
+        return self._method(Image, "visualize", **params)
+
+    def reduceRegion(self, reducer, geometry=None, scale=None, **kwargs):
+        return self._method(Dictionary, "reduceRegion", reducer, geometry, scale, **kwargs)
+
+    def sample(self, region=None, scale=None, **kwargs):
+        return self._method(ComputedObject, "sample", region, scale, **kwargs)
+
+    def getThumbURL(self, params):
+        return thumbnail(self, params)
+
+    # Band math (images or numbers)
+    def add(self, other):
+        return self._method(Image, "add", other)
+
+    def subtract(self, other):
+        return self._method(Image, "subtract", other)
+
+    def multiply(self, other):
+        return self._method(Image, "multiply", other)
+
+    def divide(self, other):
+        return self._method(Image, "divide", other)
+
+    def pow(self, other):
+        return self._method(Image, "pow", other)
+
+    def gt(self, other):
+        return self._method(Image, "gt", other)
+
+    def lt(self, other):
+        return self._method(Image, "lt", other)
+
+    def eq(self, other):
+        return self._method(Image, "eq", other)
+
+    def And(self, other):
+        return self._method(Image, "And", other)
+
+    def bitwiseAnd(self, other):
+        return self._method(Image, "bitwiseAnd", other)
+
+
+class ImageCollection(ComputedObject):
+    def __init__(self, value=None):
+        super().__init__()
+        if isinstance(value, ImageCollection):
+            self._fn, self._recv, self._args, self._kwargs = value._fn, value._recv, value._args, value._kwargs
+        elif isinstance(value, (list, tuple)):
+            self._fn, self._recv, self._args, self._kwargs = "ImageCollection.fromImages", None, (list(value),), {}
+        else:
+            self._fn, self._recv, self._args, self._kwargs = "ImageCollection.load", None, (value,), {}
+
+    def filterDate(self, start, end=None):
+        return self._method(ImageCollection, "filterDate", start, end)
+
+    def filterBounds(self, geometry):
+        return self._method(ImageCollection, "filterBounds", geometry)
+
+    def filter(self, filter_):
+        return self._method(ImageCollection, "filter", filter_)
+
+    def map(self, fn):
+        var = Image._node("var", (next(_var_ids),))
+        return self._method(ImageCollection, "map", _Lambda(var, fn(var)))
+
+    def select(self, selectors, *more):
+        names = list(selectors) if isinstance(selectors, (list, tuple)) else [selectors, *more]
+        return self._method(ImageCollection, "select", names)
+
+    def merge(self, other):
+        return self._method(ImageCollection, "merge", other)
+
+    def median(self):
+        return self._method(Image, "median")
+
+    def mean(self):
+        return self._method(Image, "mean")
+
+    def size(self):
+        return self._method(Number, "size")
+
+    def aggregate_mean(self, prop):
+        return self._method(Number, "aggregate_mean", prop)
+
+    def aggregate_array(self, prop):
+        return self._method(List, "aggregate_array", prop)
+
+
+class _Lambda:
+    """Mapped function: the body graph built from a placeholder `var` image."""
+
+    def __init__(self, var, body):
+        self.var, self.body = var, body
+
+
+def _encode(value, depth, names=None):
+    """JSON-able canonical form of a graph; placeholders are named by lambda depth, so equal graphs encode equally."""
+    names = names or {}
+    if isinstance(value, _Lambda):
+        inner = dict(names, **{value.var._args[0]: f"_v{depth}"})
+        return {"lambda": f"_v{depth}", "body": _encode(value.body, depth + 1, inner)}
+    if isinstance(value, ComputedObject):
+        if value._fn == "var":
+            return {"var": names.get(value._args[0], "?")}
+        node = {"fn": value._fn, "args": [_encode(a, depth, names) for a in value._args]}
+        if value._recv is not None:
+            node["recv"] = _encode(value._recv, depth, names)
+        if value._kwargs:
+            node["kwargs"] = {k: _encode(v, depth, names) for k, v in value._kwargs.items()}
+        return node
+    if isinstance(value, dict):
+        return {str(k): _encode(v, depth, names) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_encode(v, depth, names) for v in value]
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+# --- Evaluation -----------------------------------------------------------------------------
+
+class _Scene:
+    """One collection element: properties plus a renderer of {band: float64 (h, w)} for a grid."""
+
+    def __init__(self, props, render):
+        self.props, self.render = props, render
+
+
+class _Bands(Mapping):
+    """
+    {band: float64 (h, w)} computed band by band on first access: an expression that reads
+    three bands of an 11-band composite renders (and takes the median of) only those three.
+    """
+
+    def __init__(self, names, compute):
+        self._names, self._compute, self._done = list(dict.fromkeys(names)), compute, {}
+
+    def __getitem__(self, name):
+        if name not in self._done:
+            if name not in self._names:
+                raise KeyError(name)
+            self._done[name] = self._compute(name)
+        return self._done[name]
+
+    def __contains__(self, name):
+        return name in self._names
+
+    def __iter__(self):
+        return iter(self._names)
+
+    def __len__(self):
+        return len(self._names)
+
+
+def _once(compute):
+    """compute() on the first call, the same value afterwards (shared inputs of lazy bands)."""
+    value = []
+
+    def get():
+        if not value:
+            value.append(compute())
+        return value[0]
+    return get
+
+
+class _Shape:
+    """Evaluated geometry: bbox (lon_min, lat_min, lon_max, lat_max) plus circle or polygon details."""
+
+    def __init__(self, kind, bbox, center=None, radius_m=None, ring=None):
+        self.kind, self.bbox, self.center, self.radius_m, self.ring = kind, bbox, center, radius_m, ring
+
+    def bounds(self):
+        lon_min, lat_min, lon_max, lat_max = self.bbox
+        return [[lat_min, lon_min], [lat_max, lon_max]]
+
+    def mask(self, grid):
+        import local_raster
+
+        if self.kind == "circle":
+            lon, lat = self.center
+            return local_raster.roi_mask(grid, lat, lon, math.pi * self.radius_m ** 2 / 10000)
+        if self.kind == "polygon":
+            return local_raster.roi_mask(grid, None, None, None, self.ring)
+        lats, lons = local_raster.cell_centers(grid)
+        lon_min, lat_min, lon_max, lat_max = self.bbox
+        return ((lats >= lat_min) & (lats <= lat_max))[:, None] & ((lons >= lon_min) & (lons <= lon_max))[None, :]
+
+    def area_m2(self):
+        import local_raster
+
+        if self.kind == "circle":
+            return math.pi * self.radius_m ** 2
+        lat = (self.bbox[1] + self.bbox[3]) / 2
+        kx = local_raster.METERS_PER_DEGREE * math.cos(math.radians(lat))
+        ky = local_raster.METERS_PER_DEGREE
+        if self.kind == "polygon":
+            xs, ys = [p[0] * kx for p in self.ring], [p[1] * ky for p in self.ring]
+            return abs(sum(xs[i] * ys[i - 1] - xs[i - 1] * ys[i] for i in range(len(xs)))) / 2
+        return (self.bbox[2] - self.bbox[0]) * kx * (self.bbox[3] - self.bbox[1]) * ky
+
+    def geojson(self):
+        if self.kind == "polygon":
+            return {"type": "Polygon", "coordinates": [[list(p) for p in self.ring]]}
+        lon_min, lat_min, lon_max, lat_max = self.bbox
+        return {"type": "Polygon", "coordinates": [[[lon_min, lat_min], [lon_max, lat_min], [lon_max, lat_max],
+                                                    [lon_min, lat_max], [lon_min, lat_min]]]}
+
+
+class _Context:
+    """Per-evaluation memo, so shared subgraphs (one composite, several indices) render once per grid."""
+
+    def __init__(self):
+        self.memo = {}
+        self.keep = []
+
+    def cached(self, key, compute):
+        if key not in self.memo:
+            self.memo[key] = compute()
+        return self.memo[key]
+
+
+def evaluate(obj, ctx=None, env=None):
+    """Client-side value of any node (the fake getInfo)."""
+    ctx, env = ctx or _Context(), env or {}
+    if isinstance(obj, Geometry):
+        return _shape(obj, env).geojson()
+    return _value(obj, ctx, env)
+
+
+def thumbnail(image, params):
+    """Renders a (visualized) image over params['region'] as a data: URL (urllib can open it like a real thumb URL)."""
+    from PIL import Image as PILImage
+
+    ctx = _Context()
+    shape = _shape(params["region"], {})
+    dims = params.get("dimensions", 512)
+    side = int(dims if not isinstance(dims, str) else dims.split("x")[0])
+    grid = _grid(shape.bounds(), max_side=min(side, THUMB_MAX_SIDE))
+    bands = _image(image, grid, ctx, {})
+    arrays = list(bands.values())
+    if len(arrays) == 1:
+        arrays = arrays * 3
+    rgb = np.stack([np.nan_to_num(a, nan=0) for a in arrays[:3]], axis=-1).clip(0, 255).astype(np.uint8)
+    valid = ~np.isnan(arrays[0])
+    fmt = str(params.get("format", "png")).lower()
+    # Upscaled to the requested size (longest side), as the real thumbnail would be
+    scale = side / max(rgb.shape[:2])
+    size = (max(1, round(rgb.shape[1] * scale)), max(1, round(rgb.shape[0] * scale)))
+    buffer = io.BytesIO()
+    if fmt in ("jpg", "jpeg"):
+        PILImage.fromarray(rgb, "RGB").resize(size, PILImage.NEAREST).save(buffer, format="JPEG", quality=85)
+        media = "image/jpeg"
+    else:
+        alpha = (valid * 255).astype(np.uint8)[..., None]
+        rgba = PILImage.fromarray(np.concatenate([rgb, alpha], axis=-1), "RGBA").resize(size, PILImage.NEAREST)
+        rgba.save(buffer, format="PNG")
+        media = "image/png"
+    return f"data:{media};base64," + base64.b64encode(buffer.getvalue()).decode("ascii")
+
+
+def compute_pixels(request):
+    """ee.data.computePixels for NUMPY_NDARRAY: structured (height, width) array with one field per band."""
+    g = request["grid"]
+    t = g["affineTransform"]
+    grid = {"width": g["dimensions"]["width"], "height": g["dimensions"]["height"],
+            "lon0": t["translateX"], "lat0": t["translateY"], "dlon": t["scaleX"], "dlat": -t["scaleY"]}
+    bands = _image(request["expression"], grid, _Context(), {})
+    out = np.zeros((grid["height"], grid["width"]), dtype=[(name, np.float32) for name in bands])
+    for name, values in bands.items():
+        out[name] = values
+    return out
+
+
+def _grid(bounds, scale_m=None, max_side=None):
+    import local_raster
+
+    if max_side:
+        (lat_min, lon_min), (lat_max, lon_max) = bounds
+        cos_lat = max(math.cos(math.radians((lat_min + lat_max) / 2)), 1e-6)
+        side_m = max((lat_max - lat_min), (lon_max - lon_min) * cos_lat) * local_raster.METERS_PER_DEGREE
+        scale_m = side_m / max_side
+    return local_raster.raster_grid(bounds, scale_m=scale_m or local_raster.NATIVE_SCALE_M, max_pixels=MAX_PIXELS)
+
+
+def _grid_key(grid):
+    return (grid["width"], grid["height"], grid["lon0"], grid["lat0"], grid["dlon"], grid["dlat"])
+
+
+def _value(obj, ctx, env):
+    if isinstance(obj, dict):
+        return {k: _value(v, ctx, env) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [_value(v, ctx, env) for v in obj]
+    if not isinstance(obj, ComputedObject):
+        return obj
+    if isinstance(obj, Geometry):
+        return _shape(obj, env)
+    if isinstance(obj, ImageCollection):
+        raise EEException("Fake backend: cannot getInfo() a whole collection")
+    fn, recv = obj._fn, obj._recv
+    if fn == "constant":
+        return _value(obj._args[0], ctx, env)
+    if fn == "Dictionary":
+        return _value(obj._args[0], ctx, env)
+    if fn == "Algorithms.If":
+        condition, true_case, false_case = obj._args
+        return _value(true_case if _value(condition, ctx, env) else false_case, ctx, env)
+    if fn in _NUMBER_OPS:
+        left, right = _value(recv, ctx, env), _value(obj._args[0], ctx, env)
+        if left is None or right is None:
+            return None
+        return _NUMBER_OPS[fn](left, right)
+    if fn == "get":
+        container = _value(recv, ctx, env)
+        return container.get(obj._args[0]) if isinstance(container, dict) else None
+    if fn == "area":
+        return _shape(recv, env).area_m2()
+    if fn == "size":
+        return len(_collection(recv, ctx, env))
+    if fn == "aggregate_mean":
+        values = [s.props[obj._args[0]] for s in _collection(recv, ctx, env) if s.props.get(obj._args[0]) is not None]
+        return float(np.mean(values)) if values else None
+    if fn == "aggregate_array":
+        return [s.props.get(obj._args[0]) for s in _collection(recv, ctx, env)]
+    if fn == "reduceRegion":
+        return _reduce_region(obj, ctx, env)
+    if fn == "sample":
+        return _sample(obj, ctx, env)
+    raise EEException(f"Fake backend: unsupported operation '{fn}'")
+
+
+_NUMBER_OPS = {
+    "gt": lambda a, b: int(a > b), "lt": lambda a, b: int(a < b),
+    "add": lambda a, b: a + b, "subtract": lambda a, b: a - b,
+    "multiply": lambda a, b: a * b, "divide": lambda a, b: a / b if b else None,
+}
+
+
+def _reduce_region(node, ctx, env):
+    reducer, geometry, scale = node._args
+    shape = _shape(geometry, env)
+    grid = _grid(shape.bounds(), scale_m=scale)
+    inside = shape.mask(grid)
+    kind = reducer._fn
+    result = {}
+    for name, values in _image(node._recv, grid, ctx, env).items():
+        selected = values[inside]
+        valid = selected[~np.isnan(selected)]
+        if kind == "Reducer.count":
+            result[name] = int(valid.size)
+        elif kind == "Reducer.median":
+            result[name] = float(np.median(valid)) if valid.size else None
+        else:
+            result[name] = float(valid.mean()) if valid.size else None
+    return result
+
+
+def _sample(node, ctx, env):
+    import local_raster
+
+    region, scale = node._args
+    kw = node._kwargs
+    shape = _shape(region, env)
+    grid = _grid(shape.bounds(), scale_m=scale)
+    bands = _image(node._recv, grid, ctx, env)
+    inside = shape.mask(grid)
+    names = list(bands)
+    columns = np.stack([bands[n][inside] for n in names]) if names else np.zeros((0, int(inside.sum())))
+    lats, lons = local_raster.cell_centers(grid)
+    lat_grid, lon_grid = np.meshgrid(lats, lons, indexing="ij")
+    cell_lats, cell_lons = lat_grid[inside], lon_grid[inside]
+    keep = np.arange(columns.shape[1])
+    if kw.get("dropNulls", True):
+        keep = keep[~np.isnan(columns).any(axis=0)]
+    if kw.get("numPixels") and len(keep) > kw["numPixels"]:
+        rng = np.random.default_rng(kw.get("seed", 0))
+        keep = np.sort(rng.choice(keep, int(kw["numPixels"]), replace=False))
+    features = []
+    for i in keep:
+        feature = {"type": "Feature", "geometry": None,
+                   "properties": {n: (None if np.isnan(columns[j, i]) else float(columns[j, i]))
+                                  for j, n in enumerate(names)}}
+        if kw.get("geometries"):
+            feature["geometry"] = {"type": "Point", "coordinates": [float(cell_lons[i]), float(cell_lats[i])]}
+        features.append(feature)
+    return {"type": "FeatureCollection", "features": features}
+
+
+def _shape(node, env):
+    import local_raster
+
+    fn, args = node._fn, node._args
+    if fn == "Geometry.Point":
+        lon, lat = args[0][:2]
+        return _Shape("point", (lon, lat, lon, lat), center=(lon, lat), radius_m=0.0)
+    if fn == "Geometry.Polygon":
+        ring = args[0][0] if np.ndim(args[0]) == 3 else args[0]
+        ring = [tuple(p[:2]) for p in ring]
+        lons, lats = [p[0] for p in ring], [p[1] for p in ring]
+        return _Shape("polygon", (min(lons), min(lats), max(lons), max(lats)), ring=ring)
+    if fn == "Geometry.Rectangle":
+        return _Shape("rect", tuple(args[0][:4]))
+    base = _shape(node._recv, env)
+    if fn == "bounds":
+        return _Shape("rect", base.bbox)
+    if fn == "centroid":
+        lon, lat = (base.bbox[0] + base.bbox[2]) / 2, (base.bbox[1] + base.bbox[3]) / 2
+        return _Shape("point", (lon, lat, lon, lat), center=(lon, lat), radius_m=0.0)
+    if fn == "buffer":
+        distance = float(args[0])
+        lat = (base.bbox[1] + base.bbox[3]) / 2
+        dlat = distance / local_raster.METERS_PER_DEGREE
+        dlon = dlat / max(math.cos(math.radians(lat)), 1e-6)
+        bbox = (base.bbox[0] - dlon, base.bbox[1] - dlat, base.bbox[2] + dlon, base.bbox[3] + dlat)
+        if base.kind in ("point", "circle"):
+            return _Shape("circle", bbox, center=base.center, radius_m=base.radius_m + distance)
+        # Buffered polygons/rectangles are approximated by their expanded bbox
+        return _Shape("rect", bbox)
+    raise EEException(f"Fake backend: unsupported geometry operation '{fn}'")
+
+
+def _image(node, grid, ctx, env):
+    """{band: float64 (h, w)} of an image node on `grid`; NaN marks masked cells."""
+    if not isinstance(node, ComputedObject):
+        return {"constant": np.full((grid["height"], grid["width"]), float(node))}
+    key = (id(node), _grid_key(grid), tuple(sorted((k, id(v)) for k, v in env.items())))
+    ctx.keep.append(node)
+    return ctx.cached(key, lambda: _render(node, grid, ctx, env))
+
+
+def _render(node, grid, ctx, env):
+    fn, args, kw = node._fn, node._args, node._kwargs
+    shape = (grid["height"], grid["width"])
+    if fn == "var":
+        return env[args[0]].render(grid)
+    if fn == "Image.constant":
+        values = args[0] if isinstance(args[0], (list, tuple)) else [args[0]]
+        if len(values) == 1:
+            return {"constant": np.full(shape, float(values[0]))}
+        return {f"constant_{i}": np.full(shape, float(v)) for i, v in enumerate(values)}
+    if fn == "Image.cat":
+        sources = [_image(image, grid, ctx, env) for image in args[0]]
+        owner = {name: source for source in sources for name in source}  # later images win, like dict.update
+        return _Bands(owner, lambda name: owner[name][name])
+    if fn == "Image.pixelLonLat":
+        import local_raster
+
+        lats, lons = local_raster.cell_centers(grid)
+        return {"longitude": np.broadcast_to(lons[None, :], shape).astype(np.float64),
+                "latitude": np.broadcast_to(lats[:, None], shape).astype(np.float64)}
+    if fn in ("median", "mean"):
+        return _composite(_collection(node._recv, ctx, env), grid, fn)
+
+    src = _image(node._recv, grid, ctx, env)
+    if fn == "select":
+        missing = [b for b in args[0] if b not in src]
+        if missing:
+            raise EEException(f"Image.select: Pattern '{missing[0]}' did not match any bands.")
+        return _Bands(args[0], lambda name: src[name])
+    if fn == "rename":
+        if len(args[0]) != len(src):
+            raise EEException(f"Image.rename: Can't rename {len(src)} bands to {len(args[0])} names.")
+        old = dict(zip(args[0], src))
+        return _Bands(args[0], lambda name: src[old[name]])
+    if fn == "normalizedDifference":
+        a, b = src[args[0][0]], src[args[0][1]]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return {"nd": np.where(a + b != 0, (a - b) / (a + b), np.nan)}
+    names = list(src)
+    if fn == "addBands":
+        other = _image(args[0], grid, ctx, env)
+        return _Bands(names + list(other), lambda name: other[name] if name in other else src[name])
+    if fn == "updateMask":
+        mask = _image(args[0], grid, ctx, env)
+        masks = list(mask)
+        return _Bands(names, lambda name: np.where(
+            np.nan_to_num(mask[masks[names.index(name) if len(masks) == len(names) else 0]]) != 0, src[name], np.nan))
+    if fn == "unmask":
+        return _Bands(names, lambda name: np.where(np.isnan(src[name]), float(args[0]), src[name]))
+    if fn == "clip":
+        inside = _once(lambda: _shape(args[0], env).mask(grid))
+        return _Bands(names, lambda name: np.where(inside(), src[name], np.nan))
+    if fn == "where":
+        test, value = _image(args[0], grid, ctx, env), _image(args[1], grid, ctx, env)
+        tests, values_ = list(test), list(value)
+
+        def replaced(name):
+            i = names.index(name)
+            return np.where(np.nan_to_num(test[tests[min(i, len(tests) - 1)]]) != 0,
+                            value[values_[min(i, len(values_) - 1)]], src[name])
+        return _Bands(names, replaced)
+    if fn == "reduce":
+        stack = np.stack(list(src.values()))
+        if args[0]._fn == "Reducer.allNonZero":
+            result = np.where(np.isnan(stack).any(axis=0), np.nan, (stack != 0).all(axis=0).astype(np.float64))
+            return {"all": result}
+        return {args[0]._fn.split(".")[1]: np.nanmean(stack, axis=0)}
+    if fn in ("toFloat", "toDouble", "copyProperties"):
+        return src
+    if fn == "visualize":
+        return _visualize(src, kw)
+    if fn in _BAND_MATH:
+        return _binary(src, _image(args[0], grid, ctx, env), _BAND_MATH[fn])
+    raise EEException(f"Fake backend: unsupported image operation '{fn}'")
+
+
+def _bitwise_and(a, b):
+    valid = ~(np.isnan(a) | np.isnan(b))
+    out = np.bitwise_and(np.where(valid, a, 0).astype(np.int64), np.where(valid, b, 0).astype(np.int64))
+    return np.where(valid, out, np.nan)
+
+
+def _cmp(op):
+    return lambda a, b: np.where(np.isnan(a) | np.isnan(b), np.nan, op(a, b).astype(np.float64))
+
+
+_BAND_MATH = {
+    "add": np.add, "subtract": np.subtract, "multiply": np.multiply,
+    "divide": lambda a, b: np.where(b != 0, a / np.where(b != 0, b, 1), np.nan),
+    "pow": np.power,
+    "gt": _cmp(np.greater), "lt": _cmp(np.less), "eq": _cmp(np.equal),
+    "And": _cmp(lambda a, b: (a != 0) & (b != 0)),
+    "bitwiseAnd": _bitwise_and,
+}
+
+
+def _binary(left, right, op):
+    """Band-wise math; a single-band operand is applied to every band of the other (names from the multi-band side)."""
+    ln, rn = list(left), list(right)
+    names = rn if len(ln) == 1 and len(rn) > 1 else ln
+
+    def band(name):
+        i = names.index(name)
+        with np.errstate(divide="ignore", invalid="ignore", over="ignore"):
+            return op(left[ln[min(i, len(ln) - 1)]], right[rn[min(i, len(rn) - 1)]])
+    return _Bands(names[:max(len(ln), len(rn))], band)
+
+
+def _visualize(src, params):
+    bands = [src[b] for b in params["bands"]] if params.get("bands") else list(src.values())
+    lo, hi = float(params.get("min", 0)), float(params.get("max", 1))
+    palette = params.get("palette")
+    if palette:
+        colors = np.array([[int(c[i:i + 2], 16) for i in (0, 2, 4)] for c in (p.lstrip("#") for p in palette)], float)
+        t = np.clip((bands[0] - lo) / ((hi - lo) or 1), 0, 1) * (len(colors) - 1)
+        i = np.clip(np.floor(np.nan_to_num(t)).astype(int), 0, len(colors) - 2) if len(colors) > 1 else np.zeros(t.shape, int)
+        f = (np.nan_to_num(t) - i)[..., None]
+        rgb = colors[i] * (1 - f) + colors[np.minimum(i + 1, len(colors) - 1)] * f
+        masked = np.isnan(bands[0])
+        return {name: np.where(masked, np.nan, rgb[..., k]) for k, name in enumerate(("vis-red", "vis-green", "vis-blue"))}
+    bands = (bands * 3)[:3] if len(bands) == 1 else bands[:3]
+    return {name: np.clip((b - lo) / ((hi - lo) or 1), 0, 1) * 255
+            for name, b in zip(("vis-red", "vis-green", "vis-blue"), bands)}
+
+
+def _composite(scenes, grid, reducer):
+    import datacube
+
+    rendered = [s.render(grid) for s in scenes]
+    shape = (grid["height"], grid["width"])
+
+    def band(name):
+        stack = np.stack([bands[name] if name in bands else np.full(shape, np.nan) for bands in rendered])
+        if reducer == "median":
+            return datacube.nanmedian(stack)
+        with warnings.catch_warnings():  # all-NaN cells (clouds in every scene) stay NaN
+            warnings.simplefilter("ignore", RuntimeWarning)
+            return np.nanmean(stack, axis=0)
+    return _Bands([name for bands in rendered for name in bands], band)
+
+
+def _collection(node, ctx, env):
+    """List of _Scene for a collection node."""
+    key = (id(node), "collection", tuple(sorted((k, id(v)) for k, v in env.items())))
+    ctx.keep.append(node)
+    return ctx.cached(key, lambda: _build_collection(node, ctx, env))
+
+
+def _build_collection(node, ctx, env):
+    fn, args = node._fn, node._args
+    if fn == "ImageCollection.load":
+        return list(_dataset_scenes(args[0], datetime.date.today()))
+    if fn == "ImageCollection.fromImages":
+        return [_Scene({}, (lambda image: lambda grid: _image(image, grid, ctx, env))(image)) for image in args[0]]
+    scenes = _collection(node._recv, ctx, env)
+    if fn == "filterDate":
+        start = _millis(args[0])
+        end = _millis(args[1]) if args[1] is not None else float("inf")
+        return [s for s in scenes if start <= s.props["system:time_start"] < end]
+    if fn == "filterBounds":
+        return scenes  # the synthetic sensors cover the whole globe
+    if fn == "filter":
+        name, value = _value(args[0]._args[0], ctx, env), _value(args[0]._args[1], ctx, env)
+        test = {
+            "Filter.lt": lambda p: p is not None and p < value,
+            "Filter.gt": lambda p: p is not None and p > value,
+            "Filter.eq": lambda p: p == value,
+            "Filter.listContains": lambda p: p is not None and value in p,
+        }[args[0]._fn]
+        return [s for s in scenes if test(s.props.get(name))]
+    if fn == "merge":
+        return scenes + _collection(args[0], ctx, env)
+    if fn == "select":
+        def selected(scene):
+            def render(grid):
+                bands = scene.render(grid)
+                missing = [b for b in args[0] if b not in bands]
+                if missing:
+                    raise EEException(f"Image.select: Pattern '{missing[0]}' did not match any bands.")
+                return _Bands(args[0], lambda name: bands[name])
+            return _Scene(scene.props, render)
+        return [selected(s) for s in scenes]
+    if fn == "map":
+        fn_ = args[0]
+        var_id = fn_.var._args[0]
+
+        def mapped(scene):
+            inner = {**env, var_id: scene}
+            return _Scene(scene.props, lambda grid: _image(fn_.body, grid, ctx, inner))
+        return [mapped(s) for s in scenes]
+    raise EEException(f"Fake backend: unsupported collection operation '{fn}'")
+
+
+def _millis(value):
+    if isinstance(value, ComputedObject):
+        value = evaluate(value)
+    if isinstance(value, datetime.datetime):
+        day = value
+    elif isinstance(value, datetime.date):
+        day = datetime.datetime.combine(value, datetime.time())
+    else:
+        day = datetime.datetime.fromisoformat(str(value)[:19])
+    return day.replace(tzinfo=datetime.timezone.utc).timestamp() * 1000
+
+
+@lru_cache(maxsize=32)
+def _dataset_scenes(dataset, today):
+    if dataset not in DATASETS:
+        raise EEException(f"ImageCollection.load: ImageCollection asset '{dataset}' not found (fake backend).")
+    revisit, offset, sensor = DATASETS[dataset]
+    scenes = []
+    day = ANCHOR + datetime.timedelta(days=offset)
+    while day <= today:
+        time_start = datetime.datetime.combine(day, datetime.time(13, 30), datetime.timezone.utc).timestamp() * 1000
+        seed = _hash(day.toordinal() * 7.13 + SEED, len(dataset) * 1.7)
+        cloud = float(100 * seed ** 2)  # mostly clear, some overcast scenes
+        stamp = day.strftime("%Y%m%d")
+        props = {"system:time_start": int(time_start), "system:index": f"{stamp}_{sensor.upper()}_FAKE"}
+        if sensor == "s2":
+            props.update({"CLOUDY_PIXEL_PERCENTAGE": cloud, "system:index": f"{stamp}T133239_{stamp}T133237_T22LHH"})
+        elif sensor == "s1":
+            props.update({"instrumentMode": "IW", "transmitterReceiverPolarisation": ["VV", "VH"],
+                          "system:index": f"S1A_IW_GRDH_1SDV_{stamp}T083000_FAKE"})
+        elif sensor == "landsat":
+            props.update({"CLOUD_COVER": cloud, "system:index": f"{dataset.split('/')[1]}_221071_{stamp}"})
+        scenes.append(_Scene(props, _renderer(sensor, day, cloud)))
+        day += datetime.timedelta(days=revisit)
+    return tuple(scenes)
+
+
+# sensor -> {band: formula of the 0..1 vigor field}; S2 values are reflectance (x10000 when rendered)
+_SENSOR_BANDS = {
+    "s2": {"B2": lambda v: (0.12 - 0.08 * v) * 0.6, "B3": lambda v: (0.12 - 0.08 * v) * 0.9,
+           "B4": lambda v: 0.12 - 0.08 * v, "B5": lambda v: 0.12 - 0.08 * v + 0.2 * (0.03 + 0.43 * v),
+           "B6": lambda v: 0.12 - 0.08 * v + 0.7 * (0.03 + 0.43 * v), "B7": lambda v: (0.15 + 0.35 * v) * 0.95,
+           "B8": lambda v: 0.15 + 0.35 * v, "B8A": lambda v: (0.15 + 0.35 * v) * 0.97,
+           "B11": lambda v: 0.25 - 0.1 * v, "B12": lambda v: 0.2 - 0.1 * v},
+    "s1": {"VV": lambda v: 10 * np.log10(0.05 + 0.02 * v), "VH": lambda v: 10 * np.log10(0.01 + 0.01 * v),
+           "angle": lambda v: np.full(v.shape, 38.0)},
+    "landsat": {"ST_B10": lambda v: (303.15 + 6 * (0.5 - v) - 149.0) / 0.00341802,
+                "SR_B4": lambda v: (0.12 - 0.08 * v + 0.2) / 2.75e-05,
+                "SR_B5": lambda v: (0.15 + 0.35 * v + 0.2) / 2.75e-05},
+    "s3": {"Oa08_radiance": lambda v: 40 - 10 * v, "Oa11_radiance": lambda v: 45 + 5 * v,
+           "Oa12_radiance": lambda v: 60 + 40 * v, "quality_flags": lambda v: np.zeros(v.shape)},
+}
+
+
+def _renderer(sensor, day, cloud):
+    formulas = _SENSOR_BANDS[sensor]
+
+    def render(grid):
+        import local_raster
+
+        def coords():
+            lats, lons = local_raster.cell_centers(grid)
+            return np.meshgrid(lats, lons, indexing="ij")
+        coords = _once(coords)
+        vigor = _once(lambda: _vigor(*coords(), day))
+        if sensor != "s2":
+            return _Bands(formulas, lambda name: formulas[name](vigor()))
+
+        def cloudy():
+            lat, lon = coords()
+            return _hash(np.floor(lon * 500) + day.toordinal(), np.floor(lat * 500)) < cloud / 100
+        cloudy = _once(cloudy)
+
+        def band(name):
+            if name == "QA60":
+                return np.where(cloudy(), 1 << 10, 0).astype(np.float64)
+            return np.where(cloudy(), 0.3, formulas[name](vigor())) * 10000
+        return _Bands([*formulas, "QA60"], band)
+    return render
+
+
+def _vigor(lat, lon, day):
+    """Smooth 0..1 field (zones of ~1km) with a seasonal cycle and location-hashed noise."""
+    season = 0.15 * math.sin(2 * math.pi * (day.timetuple().tm_yday - 30) / 365)
+    field = 0.5 + 0.25 * np.sin(lon * 300 + SEED) * np.cos(lat * 300) + season
+    return np.clip(field + 0.1 * (_hash(lon * 1e4, lat * 1e4) - 0.5), 0, 1)
+
+
+def _hash(x, y):
+    """Deterministic pseudo-random 0..1 from coordinates (the usual sin-fract shader hash)."""
+    v = np.sin(np.asarray(x) * 12.9898 + np.asarray(y) * 78.233) * 43758.5453
+    return v - np.floor(v)
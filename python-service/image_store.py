@@ -0,0 +1,97 @@
+import hashlib
+import json
+import os
+import re
+import tempfile
+import urllib.request
+
+import metrics
+import state_store
+
+# Absolute base for stored image URLs (e.g. https://yvy-python.onrender.com); relative "/images/<hash>" if unset
+PUBLIC_BASE_URL = os.environ.get("PUBLIC_BASE_URL", "").rstrip("/")
+DOWNLOAD_TIMEOUT_S = float(os.environ.get("IMAGE_DOWNLOAD_TIMEOUT_S", "30"))
+# Stored images never change (the URL is the content hash), so clients may cache them forever
+CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+_HASH_RE = re.compile(r"^[0-9a-f]{64}$")
+
+
+def image_key(roi_hash, window, params):
+    """Request key of a rendered image: ROI, date window and visualization parameters."""
+    canonical = json.dumps({"roi": roi_hash, "window": [str(w)[:10] for w in window], "params": params},
+                           sort_keys=True, default=str)
+    return hashlib.sha1(canonical.encode()).hexdigest()
+
+
+def put(data):
+    """Stores bytes under their SHA-256 and returns the hash (idempotent)."""
+    digest = hashlib.sha256(data).hexdigest()
+    path = blob_path(digest)
+    if not os.path.exists(path):
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp, path)
+        except Exception:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+    return digest
+
+
+def get(digest):
+    """(bytes, media type) of a stored image, or None."""
+    if not _HASH_RE.match(digest or ""):
+        return None
+    try:
+        with open(blob_path(digest), "rb") as f:
+            data = f.read()
+    except OSError:
+        return None
+    return data, media_type(data)
+
+
+def thumbnail(roi_hash, window, params, make_url):
+    """
+    Public URL of the image for (roi_hash, window, params), downloaded at most once.
+    make_url() produces the (expiring) Earth Engine thumbnail URL and is only called on a miss.
+    Falls back to that EE URL if the store or the download fails.
+    """
+    key = image_key(roi_hash, window, params)
+    entry = state_store.load_json("images/keys", key)
+    if entry and os.path.exists(blob_path(entry["hash"])):
+        metrics.count("yvy_cache_total", cache="image_store", result="hit")
+        return public_url(entry["hash"])
+    metrics.count("yvy_cache_total", cache="image_store", result="miss")
+
+    url = make_url()
+    try:
+        with urllib.request.urlopen(url, timeout=DOWNLOAD_TIMEOUT_S) as response:
+            data = response.read()
+        digest = put(data)
+        state_store.save_json("images/keys", key, {"hash": digest, "bytes": len(data)})
+    except Exception as e:
+        print(f"⚠️ Image store unavailable, returning EE URL (non-fatal): {e}")
+        return url
+    print(f"🖼️ Stored thumbnail {digest[:12]} ({len(data)} bytes)")
+    return public_url(digest)
+
+
+def public_url(digest):
+    return f"{PUBLIC_BASE_URL}/images/{digest}"
+
+
+def blob_path(digest):
+    return state_store.state_path(os.path.join("images", "blobs", digest[:2]), digest)
+
+
+def media_type(data):
+    if data.startswith(b"\x89PNG"):
+        return "image/png"
+    if data.startswith(b"\xff\xd8"):
+        return "image/jpeg"
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "image/webp"
+    return "application/octet-stream"
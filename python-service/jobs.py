@@ -0,0 +1,154 @@
+"""
+Asynchronous jobs for long-running work (/satellite, /cluster, backfills).
+
+submit() records the job in a SQLite table under the state dir and runs it on a bounded
+thread pool (JOB_WORKERS per uvicorn worker); the caller gets the id right away and polls
+get() or streams progress. Results are kept for JOB_TTL_HOURS. Submitting the same
+payload again while its job is queued, running or still stored returns that job.
+Jobs interrupted by a restart are marked failed when the store is opened.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+import traceback
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import state_store
+
+WORKERS = int(os.environ.get("JOB_WORKERS", "2"))
+TTL_HOURS = float(os.environ.get("JOB_TTL_HOURS", "24"))
+DB_PATH = os.environ.get("JOB_DB", os.path.join(state_store.STATE_DIR, "jobs.sqlite"))
+
+QUEUED, RUNNING, DONE, FAILED = "queued", "running", "done", "failed"
+FINISHED = (DONE, FAILED)
+
+_executor = None
+_init_lock = threading.Lock()
+_initialized = False
+
+
+def _connect():
+    db = sqlite3.connect(DB_PATH, timeout=30, isolation_level=None)
+    db.row_factory = sqlite3.Row
+    return db
+
+
+def _init():
+    global _initialized, _executor
+    with _init_lock:
+        if _initialized:
+            return
+        os.makedirs(os.path.dirname(DB_PATH), exist_ok=True)
+        db = _connect()
+        try:
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY, key TEXT NOT NULL, kind TEXT NOT NULL, payload TEXT NOT NULL,
+                    status TEXT NOT NULL, progress REAL NOT NULL DEFAULT 0, message TEXT,
+                    result TEXT, error TEXT, pid INTEGER,
+                    created_at REAL NOT NULL, started_at REAL, finished_at REAL, expires_at REAL NOT NULL
+                )""")
+            db.execute("CREATE INDEX IF NOT EXISTS jobs_key ON jobs (key)")
+            # Unfinished jobs whose worker process is gone (restart, crash) will never finish
+            rows = db.execute("SELECT id, pid FROM jobs WHERE status IN (?, ?)", (QUEUED, RUNNING)).fetchall()
+            for row in rows:
+                if not _alive(row["pid"]):
+                    db.execute("UPDATE jobs SET status = ?, error = ?, finished_at = ? WHERE id = ?",
+                               (FAILED, "Interrompido (reinício do serviço)", time.time(), row["id"]))
+        finally:
+            db.close()
+        _executor = ThreadPoolExecutor(max_workers=WORKERS, thread_name_prefix="job")
+        _initialized = True
+
+
+def _alive(pid):
+    """Whether the worker that accepted a job still runs (other uvicorn workers' jobs are left alone)."""
+    if not pid or pid == os.getpid():
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def submit(kind, payload, key, runner):
+    """
+    Queues runner(payload, progress) unless a live job has the same key.
+    progress(fraction, message) updates the stored progress. Returns (job, existing).
+    """
+    _init()
+    now = time.time()
+    db = _connect()
+    try:
+        db.execute("BEGIN IMMEDIATE")
+        db.execute("DELETE FROM jobs WHERE expires_at < ? AND status IN (?, ?)", (now, DONE, FAILED))
+        row = db.execute("SELECT * FROM jobs WHERE key = ? AND status != ? ORDER BY created_at DESC LIMIT 1",
+                         (key, FAILED)).fetchone()
+        if row is not None:
+            db.execute("COMMIT")
+            return _as_dict(row), True
+        job_id = uuid.uuid4().hex[:16]
+        db.execute("""INSERT INTO jobs (id, key, kind, payload, status, pid, created_at, expires_at)
+                      VALUES (?, ?, ?, ?, ?, ?, ?, ?)""",
+                   (job_id, key, kind, json.dumps(payload), QUEUED, os.getpid(), now, now + TTL_HOURS * 3600))
+        db.execute("COMMIT")
+    except Exception:
+        db.execute("ROLLBACK")
+        raise
+    finally:
+        db.close()
+    _executor.submit(_execute, job_id, runner, payload)
+    return get(job_id), False
+
+
+def get(job_id):
+    _init()
+    db = _connect()
+    try:
+        row = db.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+    finally:
+        db.close()
+    return _as_dict(row) if row is not None else None
+
+
+def _execute(job_id, runner, payload):
+    _update(job_id, status=RUNNING, started_at=time.time(), message="Iniciado")
+
+    def progress(fraction, message=None):
+        _update(job_id, progress=round(max(0.0, min(1.0, fraction)), 3), message=message)
+
+    try:
+        result = runner(payload, progress)
+        _update(job_id, status=DONE, progress=1.0, message="Concluído", result=json.dumps(result, default=str),
+                finished_at=time.time(), expires_at=time.time() + TTL_HOURS * 3600)
+        print(f"✅ Job {job_id} done")
+    except Exception as e:
+        detail = getattr(e, "detail", None) or str(e)
+        print(f"❌ Job {job_id} failed: {detail}")
+        traceback.print_exc()
+        _update(job_id, status=FAILED, error=str(detail), finished_at=time.time(),
+                expires_at=time.time() + TTL_HOURS * 3600)
+
+
+def _update(job_id, **fields):
+    fields = {k: v for k, v in fields.items() if v is not None}
+    db = _connect()
+    try:
+        db.execute(f"UPDATE jobs SET {', '.join(f'{k} = ?' for k in fields)} WHERE id = ?",
+                   (*fields.values(), job_id))
+    finally:
+        db.close()
+
+
+def _as_dict(row):
+    job = {key: row[key] for key in ("id", "kind", "status", "progress", "message", "error",
+                                     "created_at", "started_at", "finished_at", "expires_at")}
+    job["result"] = json.loads(row["result"]) if row["result"] else None
+    return job
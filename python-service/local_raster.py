@@ -0,0 +1,342 @@
+import base64
+import datetime
+import io
+import math
+import os
+import time
+
+import numpy as np
+
+import cluster
+import datacube
+import image_store
+import state_store
+
+# Native resolution of the downloaded grid; coarsened when the bbox would exceed LOCAL_RASTER_MAX_PIXELS
+NATIVE_SCALE_M = 10
+MAX_PIXELS = int(os.environ.get("LOCAL_RASTER_MAX_PIXELS", "250000"))
+METERS_PER_DEGREE = 111320.0
+NODATA = -9999  # Same fill value as satellite_analysis.NODATA
+
+# Landsat C2 L2 surface temperature scaling (DN -> Kelvin)
+LST_SCALE = 0.00341802
+LST_OFFSET = 149.0
+
+# The RGB context window (analyze_farm's rgb_roi) spans the farm radius plus a 2x radius margin
+CONTEXT_FACTOR = 3.0
+THERMAL_PALETTE = ['0000ff', '00ffff', '00ff00', 'ffff00', 'ff0000']
+
+ALL_BANDS = ['B2', 'B3', 'B4', 'B5', 'B6', 'B7', 'B8', 'B11', 'VV', 'VH', 'ST_B10']
+CLUSTER_BANDS = ['B4', 'B5', 'B8', 'B11', 'VV', 'VH']
+RGB_BANDS = ['B4', 'B3', 'B2']
+
+
+def raster_grid(bounds, scale_m=NATIVE_SCALE_M, max_pixels=None):
+    """
+    EPSG:4326 grid covering bounds ([[lat_min, lon_min], [lat_max, lon_max]]) at about scale_m,
+    coarsened so that width * height <= max_pixels.
+    Returns {"width", "height", "lon0", "lat0" (top edge), "dlon", "dlat", "scale"}.
+    """
+    max_pixels = max_pixels or MAX_PIXELS
+    (lat_min, lon_min), (lat_max, lon_max) = bounds
+    cos_lat = max(math.cos(math.radians((lat_min + lat_max) / 2)), 1e-6)
+    height_m = (lat_max - lat_min) * METERS_PER_DEGREE
+    width_m = (lon_max - lon_min) * METERS_PER_DEGREE * cos_lat
+    scale_m = max(scale_m, math.sqrt(max(width_m * height_m, 1.0) / max_pixels))
+
+    dlat = scale_m / METERS_PER_DEGREE
+    dlon = dlat / cos_lat
+    return {
+        "width": max(1, int(math.ceil((lon_max - lon_min) / dlon))),
+        "height": max(1, int(math.ceil((lat_max - lat_min) / dlat))),
+        "lon0": lon_min, "lat0": lat_max, "dlon": dlon, "dlat": dlat,
+        "scale": round(scale_m, 2),
+    }
+
+
+def grid_bounds(grid):
+    """[[lat_min, lon_min], [lat_max, lon_max]] actually covered by the grid."""
+    return [[grid["lat0"] - grid["height"] * grid["dlat"], grid["lon0"]],
+            [grid["lat0"], grid["lon0"] + grid["width"] * grid["dlon"]]]
+
+
+def cell_centers(grid):
+    """(lats (height,), lons (width,)) of the cell centers, top row first."""
+    lats = grid["lat0"] - (np.arange(grid["height"]) + 0.5) * grid["dlat"]
+    lons = grid["lon0"] + (np.arange(grid["width"]) + 0.5) * grid["dlon"]
+    return lats, lons
+
+
+def expand_bounds(bounds, factor):
+    """Scales a bbox about its center (factor 3 = analyze_farm's 2x-radius context margin)."""
+    (lat_min, lon_min), (lat_max, lon_max) = bounds
+    c_lat, c_lon = (lat_min + lat_max) / 2, (lon_min + lon_max) / 2
+    h_lat, h_lon = (lat_max - lat_min) / 2 * factor, (lon_max - lon_min) / 2 * factor
+    return [[c_lat - h_lat, c_lon - h_lon], [c_lat + h_lat, c_lon + h_lon]]
+
+
+def roi_mask(grid, lat, lon, size_ha, polygon=None):
+    """Boolean (height, width) mask of the cells whose center lies inside the farm ROI."""
+    lats, lons = cell_centers(grid)
+    if polygon and len(polygon) >= 3:
+        from PIL import Image, ImageDraw
+
+        # Rasterize in fractional cell coordinates; PIL fills pixels whose center is inside
+        ring = [((c[0] - grid["lon0"]) / grid["dlon"] - 0.5, (grid["lat0"] - c[1]) / grid["dlat"] - 0.5)
+                for c in polygon]
+        img = Image.new("L", (grid["width"], grid["height"]), 0)
+        ImageDraw.Draw(img).polygon(ring, fill=1)
+        return np.array(img, dtype=bool)
+
+    radius_m = math.sqrt(float(size_ha or 0) * 10000 / math.pi)
+    dy = (lats[:, None] - lat) * METERS_PER_DEGREE
+    dx = (lons[None, :] - lon) * METERS_PER_DEGREE * math.cos(math.radians(lat))
+    return dx ** 2 + dy ** 2 <= radius_m ** 2
+
+
+def clean_bands(raw):
+    """{band: float32 array} with NODATA (masked by EE) replaced by NaN."""
+    bands = {}
+    for name, values in raw.items():
+        values = np.asarray(values, dtype=np.float32)
+        bands[name] = np.where(values <= NODATA + 1, np.nan, values)
+    return bands
+
+
+def compute_indices(bands):
+    """
+    Vectorized spectral indices from composite bands (NaN propagates, zero denominators -> NaN).
+    Same formulas as the Earth Engine pipeline:
+    NDVI (B8, B4), NDWI Gao (B8, B11), NDRE (B8, B5), OTCI S2 proxy (B6-B5)/(B5-B4),
+    RVI 4*VH/(VV+VH) in linear power, LST (Landsat ST_B10 -> °C).
+    Indices whose bands are missing are left out.
+    """
+    indices = {}
+    if {'B8', 'B4'} <= bands.keys():
+        indices['ndvi'] = _normalized_difference(bands['B8'], bands['B4'])
+    if {'B8', 'B11'} <= bands.keys():
+        indices['ndwi'] = _normalized_difference(bands['B8'], bands['B11'])
+    if {'B8', 'B5'} <= bands.keys():
+        indices['ndre'] = _normalized_difference(bands['B8'], bands['B5'])
+    if {'B6', 'B5', 'B4'} <= bands.keys():
+        indices['otci'] = _ratio(bands['B6'] - bands['B5'], bands['B5'] - bands['B4'])
+    if {'VV', 'VH'} <= bands.keys():
+        indices['rvi'] = _ratio(4 * bands['VH'], bands['VV'] + bands['VH'])
+    if 'ST_B10' in bands:
+        indices['lst'] = bands['ST_B10'] * LST_SCALE + LST_OFFSET - 273.15
+    return indices
+
+
+def index_means(indices, mask=None):
+    """Mean of every index over the mask (NaN ignored); None when no cell is valid."""
+    means = {}
+    for name, values in indices.items():
+        selected = values[mask] if mask is not None else values.ravel()
+        valid = selected[~np.isnan(selected)]
+        means[name] = float(valid.mean()) if valid.size else None
+    return means
+
+
+def sample_pixels(indices, grid, mask, pixel_budget=None, seed=42):
+    """
+    ROI cells as the pixel dicts used by /cluster ({lat, lon, ndvi, ndwi, ndre, rvi}),
+    randomly subsampled (fixed seed) to pixel_budget. Cells without NDVI are dropped.
+    """
+    lats, lons = cell_centers(grid)
+    rows, cols = np.nonzero(mask & ~np.isnan(indices['ndvi']))
+    if pixel_budget and rows.size > pixel_budget:
+        keep = np.sort(np.random.default_rng(seed).choice(rows.size, int(pixel_budget), replace=False))
+        rows, cols = rows[keep], cols[keep]
+
+    names = [n for n in ('ndvi', 'ndwi', 'ndre', 'rvi') if n in indices]
+    columns = {n: indices[n][rows, cols] for n in names}
+    pixels = []
+    for i in range(rows.size):
+        pixel = {"lat": float(lats[rows[i]]), "lon": float(lons[cols[i]])}
+        for n in names:
+            v = columns[n][i]
+            pixel[n] = None if np.isnan(v) else float(v)
+        pixels.append(pixel)
+    return pixels
+
+
+def rgb_image(bands, vmax=0.3):
+    """True-color RGBA image (B4, B3, B2 stretched to [0, vmax]); masked cells are transparent."""
+    from PIL import Image
+
+    rgb = np.stack([bands[b] for b in RGB_BANDS], axis=-1)
+    valid = ~np.isnan(rgb).any(axis=-1)
+    scaled = np.clip(np.nan_to_num(rgb) / vmax * 255, 0, 255).astype(np.uint8)
+    alpha = np.where(valid, 255, 0).astype(np.uint8)
+    return Image.fromarray(np.dstack([scaled, alpha]), mode="RGBA")
+
+
+def thermal_image(lst, center, spread=3.0):
+    """LST palette image (blue -> red) over center ± spread °C, like the EE thermal thumbnail."""
+    from PIL import Image
+
+    palette = np.array([[int(c[i:i + 2], 16) for i in (0, 2, 4)] for c in THERMAL_PALETTE], dtype=np.float64)
+    t = np.clip((np.nan_to_num(lst, nan=center) - (center - spread)) / (2 * spread), 0, 1) * (len(palette) - 1)
+    low = np.floor(t).astype(np.int64)
+    high = np.minimum(low + 1, len(palette) - 1)
+    frac = (t - low)[..., None]
+    rgb = palette[low] * (1 - frac) + palette[high] * frac
+    alpha = np.where(np.isnan(lst), 0, 255).astype(np.uint8)
+    return Image.fromarray(np.dstack([rgb.astype(np.uint8), alpha]), mode="RGBA")
+
+
+def image_url(img):
+    """PNG stored in the image store (/images/<hash>); inline data URI if the store is unavailable."""
+    buffer = io.BytesIO()
+    img.save(buffer, format="PNG", optimize=True)
+    data = buffer.getvalue()
+    try:
+        return image_store.public_url(image_store.put(data))
+    except OSError as e:
+        print(f"⚠️ Image store unavailable, inlining image (non-fatal): {e}")
+        return "data:image/png;base64," + base64.b64encode(data).decode("utf-8")
+
+
+def fetch_bands(bounds, start_date, end_date, bands=None, scale_m=NATIVE_SCALE_M, fetch=None, grid=None):
+    """
+    Downloads the composite bands over bounds (or an explicit grid) in a single request
+    and returns (bands, grid).
+    fetch(grid, start_date, end_date, bands) -> {band: array} replaces Earth Engine (tests, offline).
+    """
+    grid = grid or raster_grid(bounds, scale_m)
+    if fetch is None:
+        fetch = _fetch_from_earth_engine
+    started = time.perf_counter()
+    raw = fetch(grid, start_date, end_date, bands)
+    print(f"🛰️ Local raster: {len(raw)} bands, {grid['width']}x{grid['height']} @ {grid['scale']}m "
+          f"in {(time.perf_counter() - started) * 1000:.0f}ms")
+    return clean_bands(raw), grid
+
+
+def analyze_farm_local(lat, lon, size_ha, polygon=None, end_date=None, days=30, fetch=None, cube_key=None):
+    """
+    /satellite result computed from downloaded band arrays (same keys as analyze_farm).
+    One download covers the farm plus its RGB context window; regional NDVI, RGB and thermal
+    overlays are computed over that same window, and cloud_cover is the share of ROI cells
+    without a clear S2 observation.
+    With cube_key, both periods are read from the farm's datacube and only the steps not yet
+    on disk are downloaded; otherwise prev_satellite_image costs a second, RGB-only download.
+    """
+    end_date = end_date or datetime.datetime.now()
+    start_date = end_date - datetime.timedelta(days=days)
+    context = expand_bounds(cluster.roi_bounds(lat, lon, size_ha, polygon), CONTEXT_FACTOR)
+
+    cube_info = None
+    if cube_key:
+        index, fetched = datacube.sync(cube_key, context, state_store.roi_key(lat, lon, size_ha, polygon),
+                                       end_date, days=2 * days, fetch=fetch)
+        grid = index["grid"]
+        bands = datacube.composite(cube_key, datacube.steps_for_days(end_date, days))
+        prev_bands = datacube.composite(cube_key, datacube.steps_for_days(start_date - datetime.timedelta(days=1), days),
+                                        bands=RGB_BANDS)
+        cube_info = {"steps": len(index["steps"]), "fetched_steps": len(fetched), "step_days": datacube.STEP_DAYS}
+    else:
+        bands, grid = fetch_bands(context, start_date, end_date, fetch=fetch)
+        prev_bands = None
+        try:
+            prev_bands, _ = fetch_bands(context, start_date - datetime.timedelta(days=days), start_date,
+                                        bands=RGB_BANDS, fetch=fetch, grid=grid)
+        except Exception as e:
+            print(f"⚠️ Local raster: previous RGB failed (non-fatal): {e}")
+
+    mask = roi_mask(grid, lat, lon, size_ha, polygon)
+    indices = compute_indices(bands)
+    means = index_means(indices, mask)
+    regional = index_means({"ndvi": indices["ndvi"]})["ndvi"]
+
+    clear = ~np.isnan(indices["ndvi"][mask])
+    cloud_cover = 1.0 - float(clear.mean()) if clear.size else 0.0
+
+    thermal_url = None
+    if means.get("lst") is not None:
+        thermal_url = image_url(thermal_image(indices["lst"], means["lst"]))
+
+    prev_url = image_url(rgb_image(prev_bands)) if prev_bands is not None else None
+
+    mean_ndvi = means.get("ndvi") or 0
+    area_ha = cluster.roi_area_m2(size_ha, polygon) / 10000
+    biomass_t_ha = max(0, 180 * mean_ndvi - 40)
+    carbon_stock = biomass_t_ha * area_ha * 0.47
+
+    result = {
+        "date": end_date.strftime('%Y-%m-%d'),
+        "ndvi": mean_ndvi,
+        "ndwi": means.get("ndwi") or 0,
+        "ndre": means.get("ndre") or 0,
+        "rvi": means.get("rvi") or 0,
+        "temperature": means.get("lst") or 0,
+        "otci": max(means.get("otci") or 0, 0),
+        "cloud_cover": cloud_cover,
+        "satellite_image": image_url(rgb_image(bands)),
+        "thermal_image": thermal_url,
+        "prev_satellite_image": prev_url,
+        "bounds": grid_bounds(grid),
+        "regional_ndvi": regional or 0,
+        "carbon_stock": carbon_stock,
+        "co2_equivalent": carbon_stock * 3.67,
+        "pipeline": "local",
+    }
+    if cube_info is not None:
+        result["datacube"] = cube_info
+    return result
+
+
+def farm_pixels(lat, lon, size_ha, polygon=None, pixel_budget=None, end_date=None, attempts=None, fetch=None,
+                cube_key=None):
+    """
+    /cluster pixels from downloaded band arrays: one download per date window
+    (cluster.DATE_WINDOWS, first with enough clear pixels wins), sampled locally to the budget.
+    With cube_key the windows are composited from the farm's datacube (its context grid),
+    downloading only the steps not yet on disk.
+    """
+    end_date = end_date or datetime.datetime.now()
+    budget = pixel_budget or cluster.PIXEL_BUDGET
+    bounds = cluster.roi_bounds(lat, lon, size_ha, polygon)
+    if attempts is None:
+        attempts = []
+
+    last_count = 0
+    for days in cluster.DATE_WINDOWS:
+        started = time.perf_counter()
+        if cube_key:
+            index, _ = datacube.sync(cube_key, expand_bounds(bounds, CONTEXT_FACTOR),
+                                     state_store.roi_key(lat, lon, size_ha, polygon), end_date, days=days, fetch=fetch)
+            grid = index["grid"]
+            bands = datacube.composite(cube_key, datacube.steps_for_days(end_date, days), bands=CLUSTER_BANDS)
+        else:
+            bands, grid = fetch_bands(bounds, end_date - datetime.timedelta(days=days), end_date,
+                                      bands=CLUSTER_BANDS, fetch=fetch)
+        pixels = sample_pixels(compute_indices(bands), grid, roi_mask(grid, lat, lon, size_ha, polygon), budget)
+        last_count = len(pixels)
+        attempts.append(cluster._attempt_entry("local", days, grid["scale"], last_count, started,
+                                               status="used" if last_count >= cluster.MIN_PIXELS else "inadequate"))
+        if last_count >= cluster.MIN_PIXELS:
+            print(f"Using {last_count} local-raster pixels (range={days}d, scale={grid['scale']}m)")
+            return pixels
+
+    raise ValueError(f"Dados insuficientes do Sentinel-2 ({last_count} pixels válidos em até {cluster.DATE_WINDOWS[-1]} dias). Verifique se a área delimitada está correta.")
+
+
+def _fetch_from_earth_engine(grid, start_date, end_date, bands=None):
+    from ee_backend import ee
+    import satellite_analysis
+
+    (lat_min, lon_min), (lat_max, lon_max) = grid_bounds(grid)
+    region = ee.Geometry.Rectangle([lon_min, lat_min, lon_max, lat_max])
+    image = satellite_analysis.get_composite_band_stack(
+        region, start_date.strftime('%Y-%m-%d'), end_date.strftime('%Y-%m-%d'), bands)
+    return satellite_analysis.download_band_arrays(image, grid)
+
+
+def _normalized_difference(a, b):
+    return _ratio(a - b, a + b)
+
+
+def _ratio(num, den):
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(den != 0, num / den, np.nan).astype(np.float32)
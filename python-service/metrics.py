@@ -0,0 +1,187 @@
+"""
+Stage timers and counters for the service.
+
+Every timed stage (an EE round-trip, feature build, model fit, clustering, raster render...)
+feeds a cumulative histogram exposed in Prometheus text format at /metrics, and is added
+to the current request's breakdown, which app.py returns in the Server-Timing header.
+"""
+import contextlib
+import contextvars
+import functools
+import re
+import threading
+import time
+from collections import Counter
+
+import deadline
+import tracing
+
+# Histogram bucket upper bounds (ms): EE round-trips range from ~100ms to a minute
+BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000, 60000)
+
+# Timings of the request being served (None outside a request scope)
+_current = contextvars.ContextVar("metrics_request", default=None)
+
+_lock = threading.Lock()
+_histograms = {}  # (metric, labels) -> [bucket counts..., +Inf count, sum]
+_counters = Counter()  # (metric, labels) -> value
+_gauges = {}  # (metric, labels) -> last value
+_HELP = {
+    "yvy_request_duration_ms": ("histogram", "HTTP request duration by route"),
+    "yvy_stage_duration_ms": ("histogram", "Duration of a named processing stage"),
+    "yvy_ee_call_duration_ms": ("histogram", "Earth Engine round-trip duration by operation"),
+    "yvy_ee_calls_total": ("counter", "Earth Engine round-trips by operation and outcome"),
+    "yvy_cache_total": ("counter", "Cache lookups by cache and result (hit/miss)"),
+    "yvy_ee_retries_total": ("counter", "Earth Engine attempts retried by operation and reason (throttle/transient)"),
+    "yvy_ee_rejected_total": ("counter", "Earth Engine calls failed fast by the open circuit breaker"),
+    "yvy_ee_rate_wait_ms": ("histogram", "Time spent waiting for an Earth Engine rate limit token"),
+    "yvy_ee_concurrency_limit": ("gauge", "Current adaptive (AIMD) Earth Engine concurrency limit"),
+    "yvy_ee_in_flight": ("gauge", "Earth Engine calls in flight"),
+    "yvy_ee_circuit_open": ("gauge", "Earth Engine circuit breaker: 0 closed, 0.5 half-open, 1 open"),
+    "yvy_degraded_total": ("counter", "Responses degraded to meet their deadline, by route and what was dropped"),
+    "yvy_fake_ee_cpu_seconds_total": ("counter", "CPU seconds spent evaluating the fake Earth Engine backend"),
+}
+
+
+class RequestTimings:
+    """Per-request list of (stage, ms); threads serving the same request append to it."""
+
+    def __init__(self):
+        self.entries = []
+        self._lock = threading.Lock()
+
+    def add(self, name, ms):
+        with self._lock:
+            self.entries.append((name, ms))
+
+    def server_timing(self):
+        """Server-Timing header value: one metric per stage, repeated stages summed."""
+        totals, counts = {}, Counter()
+        with self._lock:
+            for name, ms in self.entries:
+                totals[name] = totals.get(name, 0.0) + ms
+                counts[name] += 1
+        return ", ".join(
+            f'{_token(name)};dur={ms:.1f}' + (f';desc="{counts[name]}x"' if counts[name] > 1 else "")
+            for name, ms in totals.items()
+        )
+
+
+def observe(metric, ms, **labels):
+    key = (metric, tuple(sorted(labels.items())))
+    with _lock:
+        hist = _histograms.get(key)
+        if hist is None:
+            hist = _histograms[key] = [0] * (len(BUCKETS_MS) + 2)
+        for i, bound in enumerate(BUCKETS_MS):
+            if ms <= bound:
+                hist[i] += 1
+        hist[-2] += 1
+        hist[-1] += ms
+
+
+def count(metric, n=1, **labels):
+    with _lock:
+        _counters[(metric, tuple(sorted(labels.items())))] += n
+
+
+def set_gauge(metric, value, **labels):
+    with _lock:
+        _gauges[(metric, tuple(sorted(labels.items())))] = value
+
+
+@contextlib.contextmanager
+def stage(name):
+    """
+    Times the block as stage `name` (histogram + current request's Server-Timing + a trace span).
+    Raises deadline.DeadlineExceeded instead of starting it when the request's budget is spent.
+    """
+    deadline.check()
+    started = time.perf_counter()
+    finished = True
+    try:
+        with tracing.span(name):
+            yield
+    except deadline.DeadlineExceeded:
+        # Cut short: its duration says nothing about how long the stage takes
+        finished = False
+        raise
+    finally:
+        if finished:
+            record(name, (time.perf_counter() - started) * 1000)
+
+
+def record(name, ms):
+    observe("yvy_stage_duration_ms", ms, stage=name)
+    deadline.observe(name, ms)
+    timings = _current.get()
+    if timings is not None:
+        timings.add(name, ms)
+
+
+def timed(name):
+    """Decorator form of stage()."""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+@contextlib.contextmanager
+def request_scope():
+    timings = RequestTimings()
+    token = _current.set(timings)
+    try:
+        yield timings
+    finally:
+        _current.reset(token)
+
+
+def render():
+    """All metrics in Prometheus text exposition format."""
+    with _lock:
+        histograms = {key: list(values) for key, values in _histograms.items()}
+        counters = dict(_counters)
+        gauges = dict(_gauges)
+    lines = []
+    for metric in sorted({m for m, _ in histograms} | {m for m, _ in counters} | {m for m, _ in gauges}):
+        kind, text = _HELP.get(metric) or (_kind(metric, counters, gauges), metric)
+        lines.append(f"# HELP {metric} {text}")
+        lines.append(f"# TYPE {metric} {kind}")
+        for (m, labels), values in sorted(histograms.items()):
+            if m != metric:
+                continue
+            for bound, n in zip(BUCKETS_MS, values):
+                lines.append(f"{metric}_bucket{_labels(labels, le=str(bound))} {n}")
+            lines.append(f"{metric}_bucket{_labels(labels, le='+Inf')} {values[-2]}")
+            lines.append(f"{metric}_sum{_labels(labels)} {values[-1]:.3f}")
+            lines.append(f"{metric}_count{_labels(labels)} {values[-2]}")
+        for (m, labels), value in sorted(counters.items()):
+            if m == metric:
+                lines.append(f"{metric}{_labels(labels)} {value}")
+        for (m, labels), value in sorted(gauges.items()):
+            if m == metric:
+                lines.append(f"{metric}{_labels(labels)} {value:g}")
+    return "\n".join(lines) + "\n"
+
+
+def _kind(metric, counters, gauges):
+    if any(m == metric for m, _ in counters):
+        return "counter"
+    return "gauge" if any(m == metric for m, _ in gauges) else "histogram"
+
+
+def _labels(labels, **extra):
+    items = list(labels) + list(extra.items())
+    if not items:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in items)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(items, escaped)) + "}"
+
+
+def _token(name):
+    """Server-Timing metric names are HTTP tokens."""
+    return re.sub(r"[^A-Za-z0-9!#$%&'*+.^_`|~-]", "_", name)
@@ -0,0 +1,160 @@
+import datetime
+import os
+import shutil
+import threading
+
+import numpy as np
+
+import state_store
+
+# Compositing step of the cube; windows are aligned to ANCHOR so every run appends the same grid
+STEP_DAYS = int(os.environ.get("PIXEL_CUBE_STEP_DAYS", "15"))
+ANCHOR = datetime.date(2017, 1, 1)
+SEASON_DAYS = 180
+DTYPE = np.float16
+# Pixels with fewer clear windows than this are left out of temporal clustering
+MIN_VALID_DATES = 3
+
+_locks = {}
+_locks_guard = threading.Lock()
+
+
+def cube_dir(key):
+    return os.path.dirname(state_store.state_path(os.path.join("cubes", key), "meta.json"))
+
+
+def window_dates(index):
+    """(start, end) dates of cube window `index` (end exclusive)."""
+    start = ANCHOR + datetime.timedelta(days=index * STEP_DAYS)
+    return start, start + datetime.timedelta(days=STEP_DAYS)
+
+
+def season_windows(end_date, season_days=SEASON_DAYS):
+    """Indices of the complete windows covering the last `season_days` before end_date."""
+    end_date = end_date.date() if isinstance(end_date, datetime.datetime) else end_date
+    last = (end_date - ANCHOR).days // STEP_DAYS - 1  # last window that already ended
+    count = max(1, season_days // STEP_DAYS)
+    return list(range(max(0, last - count + 1), last + 1))
+
+
+def load_cube(key):
+    """
+    The farm's cube: {"meta", "lats", "lons", "values"} where values is a read-only
+    (n_windows, n_pixels) float16 memmap with NaN for cloudy windows. None if absent.
+    """
+    meta = state_store.load_json(os.path.join("cubes", key), "meta")
+    if not meta or not meta.get("windows"):
+        return None
+    directory = cube_dir(key)
+    coords = np.load(os.path.join(directory, "coords.npy"))
+    values = np.memmap(os.path.join(directory, "ndvi.f16"), dtype=DTYPE, mode="r",
+                       shape=(len(meta["windows"]), meta["n_pixels"]))
+    return {"meta": meta, "lats": coords[0], "lons": coords[1], "values": values}
+
+
+def append_windows(key, window_indices, lats, lons, series, roi_hash=None, scale=None):
+    """
+    Appends one row per window. The pixel set is fixed when the cube is created; later
+    fetches are aligned to it by coordinate (missing pixels become NaN, new ones are dropped).
+    Rows are located by their position in meta["windows"], so callers hold _lock(key).
+    """
+    directory = cube_dir(key)
+    meta = state_store.load_json(os.path.join("cubes", key), "meta")
+    rows = np.array([[np.nan if v is None else v for v in row] for row in series], dtype=np.float64)
+
+    if not meta:
+        meta = {"roi": roi_hash, "scale": scale, "step_days": STEP_DAYS, "windows": [],
+                "n_pixels": len(lats)}
+        np.save(os.path.join(directory, "coords.npy"), np.array([lats, lons], dtype=np.float64))
+    else:
+        coords = np.load(os.path.join(directory, "coords.npy"))
+        column = {_coord_key(a, b): j for j, (a, b) in enumerate(zip(lats, lons))}
+        order = np.array([column.get(_coord_key(a, b), -1) for a, b in zip(coords[0], coords[1])])
+        aligned = np.full((len(rows), meta["n_pixels"]), np.nan)
+        found = order >= 0
+        aligned[:, found] = rows[:, order[found]]
+        rows = aligned
+
+    with open(os.path.join(directory, "ndvi.f16"), "ab") as f:
+        f.write(rows.astype(DTYPE).tobytes())
+    meta["windows"].extend(int(i) for i in window_indices)
+    state_store.save_json(os.path.join("cubes", key), "meta", meta)
+
+
+def update_cube(key, roi, roi_hash, scale, end_date=None, season_days=SEASON_DAYS, fetch=None):
+    """
+    Brings the farm's cube up to date and returns (cube, n_windows_fetched).
+    The first run fetches the whole season in one request; later runs fetch only the
+    windows that ended after the newest stored one. A changed ROI or scale rebuilds it.
+    """
+    if fetch is None:
+        import satellite_analysis
+        fetch = satellite_analysis.get_ndvi_time_series_pixels
+    end_date = end_date or datetime.datetime.now()
+
+    with _lock(key):
+        cube = load_cube(key)
+        if cube and (cube["meta"].get("roi") != roi_hash or cube["meta"].get("scale") != scale):
+            print(f"Pixel cube {key}: ROI/scale changed, rebuilding")
+            shutil.rmtree(cube_dir(key), ignore_errors=True)
+            cube = None
+
+        wanted = season_windows(end_date, season_days)
+        newest = max(cube["meta"]["windows"]) if cube else -1
+        missing = [i for i in wanted if i > newest]
+        if missing:
+            dates = [window_dates(i) for i in missing]
+            windows = [(s.strftime('%Y-%m-%d'), e.strftime('%Y-%m-%d')) for s, e in dates]
+            lats, lons, series = fetch(roi, windows, scale)
+            if not lats:
+                raise ValueError("Nenhum pixel retornado para a série temporal")
+            append_windows(key, missing, lats, lons, series, roi_hash, scale)
+            print(f"Pixel cube {key}: appended {len(missing)} windows ({windows[0][0]} → {windows[-1][1]})")
+            cube = load_cube(key)
+        return cube, len(missing)
+
+
+def season_slice(cube, end_date=None, season_days=SEASON_DAYS):
+    """(lats, lons, values float32 (n_windows, n_pixels), day offsets) for the season."""
+    wanted = set(season_windows(end_date or datetime.datetime.now(), season_days))
+    rows = [r for r, i in enumerate(cube["meta"]["windows"]) if i in wanted]
+    if not rows:
+        raise ValueError("Série temporal vazia para a safra solicitada")
+    values = np.asarray(cube["values"][rows], dtype=np.float32)
+    days = np.array([cube["meta"]["windows"][r] * STEP_DAYS for r in rows], dtype=np.float64)
+    return cube["lats"], cube["lons"], values, days - days[0]
+
+
+def temporal_features(values, days):
+    """
+    Vectorized per-pixel profile features over a (n_dates, n_pixels) NDVI array (NaN = cloudy):
+    mean, amplitude (max - min), trend (least-squares slope, NDVI per 30 days) and n_valid.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    valid = ~np.isnan(values)
+    n_valid = valid.sum(axis=0)
+    safe_n = np.maximum(n_valid, 1)
+    filled = np.where(valid, values, 0.0)
+
+    mean = filled.sum(axis=0) / safe_n
+    amplitude = np.where(valid, values, -np.inf).max(axis=0) - np.where(valid, values, np.inf).min(axis=0)
+
+    t = np.asarray(days, dtype=np.float64)[:, None] * valid
+    t_mean = t.sum(axis=0) / safe_n
+    dt = np.where(valid, t - t_mean, 0.0)
+    var = (dt ** 2).sum(axis=0)
+    slope = np.where(var > 0, (dt * (filled - mean)).sum(axis=0) / np.where(var > 0, var, 1), 0.0)
+
+    empty = n_valid == 0
+    mean[empty] = np.nan
+    amplitude = np.where(empty, np.nan, amplitude)
+    return {"mean": mean, "amplitude": amplitude, "trend": slope * 30, "n_valid": n_valid}
+
+
+def _lock(key):
+    with _locks_guard:
+        return _locks.setdefault(key, threading.Lock())
+
+
+def _coord_key(lat, lon):
+    return (round(float(lat), 6), round(float(lon), 6))
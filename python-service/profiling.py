@@ -0,0 +1,163 @@
+"""
+On-demand request profiling.
+
+A request is profiled when it carries `X-Profile: <PROFILE_TOKEN>` (or `?profile=<token>`),
+or at random with probability PROFILE_SAMPLE_RATE. The handler then runs under a sampling
+profiler (its thread's stack every PROFILE_INTERVAL_MS) and tracemalloc; PROFILE_DIR gets
+<id>.folded (collapsed stacks for flamegraph.pl / speedscope), <id>.alloc.txt (top allocations)
+and <id>.json, and the response carries the id in X-Profile-Id. Only endpoints decorated with
+@profiled are profiled; other requests that asked for it get no header.
+When profiling is not requested the only cost is a contextvar lookup per request.
+"""
+import contextlib
+import contextvars
+import functools
+import hmac
+import inspect
+import json
+import os
+import random
+import sys
+import threading
+import time
+import tracemalloc
+import uuid
+from collections import Counter
+
+import state_store
+
+PROFILE_TOKEN = os.environ.get("PROFILE_TOKEN", "")
+SAMPLE_RATE = float(os.environ.get("PROFILE_SAMPLE_RATE", "0"))
+INTERVAL_MS = float(os.environ.get("PROFILE_INTERVAL_MS", "5"))
+PROFILE_DIR = os.environ.get("PROFILE_DIR", os.path.join(state_store.STATE_DIR, "profiles"))
+TOP_ALLOCATIONS = 25
+ENABLED = bool(PROFILE_TOKEN) or SAMPLE_RATE > 0
+
+# Profile requested for the request being served (None when not profiling)
+_current = contextvars.ContextVar("profile_request", default=None)
+_tracemalloc_lock = threading.Lock()
+_tracemalloc_users = 0
+_tracemalloc_owned = False
+
+
+def wanted(headers, query_params):
+    """Whether to profile this request: valid token in header/query, or sampled."""
+    if not ENABLED:
+        return False
+    token = headers.get("x-profile") or query_params.get("profile")
+    if token and PROFILE_TOKEN and hmac.compare_digest(token, PROFILE_TOKEN):
+        return True
+    return SAMPLE_RATE > 0 and random.random() < SAMPLE_RATE
+
+
+@contextlib.contextmanager
+def request_scope(path):
+    """
+    Marks the request served inside the block for profiling; yields the profile
+    ({"id", "path", "saved"}), where "saved" becomes True once a @profiled handler wrote it.
+    """
+    profile = {"id": f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}", "path": path, "saved": False}
+    token = _current.set(profile)
+    try:
+        yield profile
+    finally:
+        _current.reset(token)
+
+
+def profiled(fn):
+    """Decorator: runs the endpoint under the profiler when its request asked for it."""
+    if inspect.iscoroutinefunction(fn):
+        @functools.wraps(fn)
+        async def async_wrapper(*args, **kwargs):
+            profile = _current.get()
+            if profile is None:
+                return await fn(*args, **kwargs)
+            with _Session(profile):
+                return await fn(*args, **kwargs)
+        return async_wrapper
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        profile = _current.get()
+        if profile is None:
+            return fn(*args, **kwargs)
+        with _Session(profile):
+            return fn(*args, **kwargs)
+    return wrapper
+
+
+class _Sampler(threading.Thread):
+    """Collects the target thread's stack every interval as collapsed 'a;b;c' strings."""
+
+    def __init__(self, thread_id, interval_s):
+        super().__init__(daemon=True, name="profile-sampler")
+        self.thread_id, self.interval_s = thread_id, interval_s
+        self.stacks = Counter()
+        self._done = threading.Event()
+
+    def run(self):
+        while not self._done.wait(self.interval_s):
+            frame = sys._current_frames().get(self.thread_id)
+            names = []
+            while frame is not None:
+                code = frame.f_code
+                names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                frame = frame.f_back
+            if names:
+                self.stacks[";".join(reversed(names))] += 1
+
+    def stop(self):
+        self._done.set()
+        self.join()
+
+
+class _Session:
+    def __init__(self, profile):
+        self.profile = profile
+
+    def __enter__(self):
+        global _tracemalloc_users, _tracemalloc_owned
+        with _tracemalloc_lock:
+            # Concurrent profiles share one tracemalloc session; never stop one started elsewhere
+            if _tracemalloc_users == 0 and not tracemalloc.is_tracing():
+                tracemalloc.start()
+                _tracemalloc_owned = True
+            _tracemalloc_users += 1
+        self.sampler = _Sampler(threading.get_ident(), INTERVAL_MS / 1000)
+        self.started = time.perf_counter()
+        self.sampler.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        global _tracemalloc_users, _tracemalloc_owned
+        elapsed_ms = (time.perf_counter() - self.started) * 1000
+        self.sampler.stop()
+        snapshot = tracemalloc.take_snapshot()
+        _, peak = tracemalloc.get_traced_memory()
+        with _tracemalloc_lock:
+            _tracemalloc_users -= 1
+            if _tracemalloc_users == 0 and _tracemalloc_owned:
+                tracemalloc.stop()
+                _tracemalloc_owned = False
+        try:
+            self._write(snapshot, peak, elapsed_ms, exc)
+            self.profile["saved"] = True
+        except OSError as e:
+            print(f"⚠️ Could not write profile {self.profile['id']} (non-fatal): {e}")
+        return False
+
+    def _write(self, snapshot, peak, elapsed_ms, exc):
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        base = os.path.join(PROFILE_DIR, self.profile["id"])
+        with open(base + ".folded", "w") as f:
+            for stack, n in self.sampler.stacks.most_common():
+                f.write(f"{stack} {n}\n")
+        stats = snapshot.filter_traces([tracemalloc.Filter(False, tracemalloc.__file__)]).statistics("lineno")
+        with open(base + ".alloc.txt", "w") as f:
+            f.write(f"Peak traced memory: {peak / 1e6:.1f} MB\n")
+            for stat in stats[:TOP_ALLOCATIONS]:
+                f.write(f"{stat}\n")
+        with open(base + ".json", "w") as f:
+            json.dump({"id": self.profile["id"], "path": self.profile["path"], "elapsed_ms": round(elapsed_ms, 1),
+                       "samples": sum(self.sampler.stacks.values()), "interval_ms": INTERVAL_MS,
+                       "peak_traced_mb": round(peak / 1e6, 2), "error": repr(exc) if exc else None}, f)
+        print(f"🔬 Profile {self.profile['id']} ({self.profile['path']}, {elapsed_ms:.0f}ms) written to {base}.*")
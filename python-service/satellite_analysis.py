@@ -1,10 +1,16 @@
-import ee
 import sys
 import json
 import datetime
 import math
 import argparse
 
+import cluster
+import deadline
+import ee_backend
+import ee_gateway
+import ee_registry
+from ee_backend import ee
+
 # Inicializa o Earth Engine (Lazy Loading)
 def init_earth_engine(project_id=None, credentials=None):
     try:
@@ -40,17 +46,43 @@ def mask_s2_clouds(image):
         qa.bitwiseAnd(cirrus_bit_mask).eq(0))
     return image.updateMask(mask).divide(10000)
 
-def get_sentinel2_indices(roi, start_date, end_date):
-    """Calcula índices espectrais baseados no Sentinel-2 (NDVI, NDWI, NDRE)."""
-    s2 = ee.ImageCollection('COPERNICUS/S2_SR_HARMONIZED') \
-        .filterDate(start_date, end_date) \
-        .filterBounds(roi) \
-        .filter(ee.Filter.lt('CLOUDY_PIXEL_PERCENTAGE', 80)) \
+S2_DATASET = 'COPERNICUS/S2_SR_HARMONIZED'
+S1_DATASET = 'COPERNICUS/S1_GRD'
+LANDSAT_DATASETS = "LANDSAT/LC09+LC08/C02/T1_L2"
+# Escala das médias principais (S2/S1) quando o prazo da requisição não comporta os 10m nativos
+COARSE_SCALE_M = 30
+
+def get_sentinel2_scenes(roi, start_date, end_date):
+    """Cenas Sentinel-2 da ROI na janela, sem filtro de nuvens nem máscara (compartilhadas por requisição)."""
+    return ee_registry.memoize("s2_scenes", S2_DATASET, roi, start_date, end_date, lambda: (
+        ee.ImageCollection(S2_DATASET)
+        .filterDate(start_date, end_date)
+        .filterBounds(roi)
+    ))
+
+def get_sentinel2_collection(roi, start_date, end_date):
+    """Coleção Sentinel-2 filtrada (data, ROI, nuvens < 80%) e com máscara QA60 aplicada."""
+    return ee_registry.memoize("s2_masked", S2_DATASET, roi, start_date, end_date, lambda: (
+        get_sentinel2_scenes(roi, start_date, end_date)
+        .filter(ee.Filter.lt('CLOUDY_PIXEL_PERCENTAGE', 80))
         .map(mask_s2_clouds)
+    ))
+
+def get_sentinel2_indices(roi, start_date, end_date, region=None):
+    """
+    Calcula índices espectrais baseados no Sentinel-2 (NDVI, NDWI, NDRE).
+    As cenas são filtradas pela ROI e o mosaico recortado em `region` (padrão: a própria ROI),
+    assim um recorte maior para miniaturas reaproveita a coleção da ROI da fazenda.
+    """
+    return ee_registry.memoize("s2_composite", S2_DATASET, roi, start_date, end_date,
+                               lambda: _build_sentinel2_indices(roi, start_date, end_date, region), region)
+
+def _build_sentinel2_indices(roi, start_date, end_date, region=None):
+    s2 = get_sentinel2_collection(roi, start_date, end_date)
 
     # Cria um mosaico usando a mediana (bom para remover nuvens residuais)
     # ou o pixel mais verde (greenest pixel)
-    composite = s2.median().clip(roi)
+    composite = s2.median().clip(region or roi)
     
     # Se a composição estiver vazia (muitas nuvens/sem imagem), retorna None
     # Verificação simples: contar bandas
@@ -70,14 +102,20 @@ def get_sentinel2_indices(roi, start_date, end_date):
     
     return ndvi, ndwi, ndre, composite
 
-def get_sentinel1_indices(roi, start_date, end_date):
-    """Calcula índices de radar baseados no Sentinel-1 (RVI)."""
-    s1 = ee.ImageCollection('COPERNICUS/S1_GRD') \
-        .filter(ee.Filter.listContains('transmitterReceiverPolarisation', 'VV')) \
-        .filter(ee.Filter.listContains('transmitterReceiverPolarisation', 'VH')) \
-        .filter(ee.Filter.eq('instrumentMode', 'IW')) \
-        .filterDate(start_date, end_date) \
+def get_sentinel1_collection(roi, start_date, end_date):
+    """Coleção Sentinel-1 GRD (IW, VV+VH) filtrada por data e ROI."""
+    return ee_registry.memoize("s1", S1_DATASET, roi, start_date, end_date, lambda: (
+        ee.ImageCollection(S1_DATASET)
+        .filter(ee.Filter.listContains('transmitterReceiverPolarisation', 'VV'))
+        .filter(ee.Filter.listContains('transmitterReceiverPolarisation', 'VH'))
+        .filter(ee.Filter.eq('instrumentMode', 'IW'))
+        .filterDate(start_date, end_date)
         .filterBounds(roi)
+    ))
+
+def get_sentinel1_indices(roi, start_date, end_date, region=None):
+    """Calcula índices de radar baseados no Sentinel-1 (RVI), recortados em `region` (padrão: a ROI)."""
+    s1 = get_sentinel1_collection(roi, start_date, end_date)
     
     # Mosaico temporal (média)
     # As bandas vêm em DB, converter para linear para cálculos
@@ -86,7 +124,7 @@ def get_sentinel1_indices(roi, start_date, end_date):
     def to_linear(image):
         return ee.Image(10).pow(image.select(['VV', 'VH']).divide(10))
 
-    s1_linear = s1.map(to_linear).mean().clip(roi)
+    s1_linear = s1.map(to_linear).mean().clip(region or roi)
     
     vv = s1_linear.select('VV')
     vh = s1_linear.select('VH')
@@ -145,7 +183,7 @@ def get_sentinel3_indices(roi, start_date, end_date):
         scale=300,
         maxPixels=1e9
     )
-    print(f"DEBUG S3 (Internal): {json.dumps(stats.getInfo())}", file=sys.stderr)
+    print(f"DEBUG S3 (Internal): {json.dumps(ee_backend.get_info(stats))}", file=sys.stderr)
 
     # Avoid division by zero
     denominator = oa11.subtract(oa08)
@@ -157,9 +195,31 @@ def get_sentinel3_indices(roi, start_date, end_date):
     
     return otci
 
-def analyze_farm(roi, start_date, end_date, size_ha):
+def stored_thumbnail(image_key, window, params, make_url):
+    """Thumbnail URL via the local image store (downloaded once, served by /images) when image_key is set."""
+    if image_key is None:
+        return make_url()
+    import image_store
+    return image_store.thumbnail(image_key, window, params, make_url)
+
+def context_bounds(roi_box, margin_m):
+    """[[lat_min, lon_min], [lat_max, lon_max]] da caixa da ROI (cluster.roi_bounds) com margem em metros."""
+    (lat_min, lon_min), (lat_max, lon_max) = roi_box
+    dlat = math.degrees(margin_m / cluster.EARTH_RADIUS_M)
+    dlon = dlat / max(math.cos(math.radians((lat_min + lat_max) / 2)), 1e-6)
+    return [[lat_min - dlat, lon_min - dlon], [lat_max + dlat, lon_max + dlon]]
+
+def analyze_farm(roi, start_date, end_date, size_ha, image_key=None, roi_box=None):
     """
     Executa a análise completa para a fazenda.
+    image_key: hash da ROI; quando informado, as miniaturas são salvas no image_store
+    e a resposta traz URLs estáveis (/images/<hash>) em vez dos links temporários do EE.
+    roi_box: caixa da ROI (cluster.roi_bounds); "bounds" das miniaturas é calculado dela,
+    sem chamada ao EE, e vem mesmo quando o prazo corta as miniaturas.
+    Com prazo (deadline.py) curto, os índices principais vêm primeiro (em escala mais grossa
+    se preciso) e o que não couber no tempo restante (nuvens, NDVI regional, LST, miniaturas,
+    área) é omitido. DeadlineExceeded e CircuitOpen são propagados para o chamador.
+    Retorna o dicionário do resultado ({"error": ...} em caso de falha).
     """
     # Datas
     end_date_str = end_date.strftime('%Y-%m-%d')
@@ -187,13 +247,13 @@ def analyze_farm(roi, start_date, end_date, size_ha):
     thermal_roi = roi.buffer(thermal_radius).bounds() # Quadrado gigante
 
     try:
-        # 1. Buscar imagens sobre a maior área necessária (Thermal ROI)
-        # Assim garantimos dados para ambos.
-        # Sentinel-2: Podemos buscar só na rgb_roi se quisermos economizar, mas thermal usamos thermal_roi
-        # Para simplificar e evitar erros de "out of bounds", vamos buscar S2 na rgb_roi e MODIS na thermal_roi.
+        # 1. Coleções filtradas sempre pela ROI da fazenda (a mesma chave do ee_registry para
+        # nuvens, índices e a listagem de aquisições); só os mosaicos são recortados no contexto
+        # visual: rgb_roi para S2/S1 e thermal_roi para o Landsat.
+        # As cenas (tiles de ~110km) que cobrem a fazenda cobrem também a margem das miniaturas.
         
-        ndvi_img, ndwi_img, ndre_img, composite = get_sentinel2_indices(rgb_roi, start_date_str, end_date_str)
-        rvi_img = get_sentinel1_indices(rgb_roi, start_date_str, end_date_str)
+        ndvi_img, ndwi_img, ndre_img, composite = get_sentinel2_indices(roi, start_date_str, end_date_str, region=rgb_roi)
+        rvi_img = get_sentinel1_indices(roi, start_date_str, end_date_str, region=rgb_roi)
         
         # Sentinel-2 OTCI Proxy
         # OTCI = (B6 - B5) / (B5 - B4)
@@ -207,28 +267,37 @@ def analyze_farm(roi, start_date, end_date, size_ha):
         otci_img = s2_b6.subtract(s2_b5).divide(otci_denom).rename('otci')
 
         # 2. Calcular estatísticas apenas sobre a área da FAZENDA (ROI exata, o circulo pequeno)
+        # Sem tempo para a escala nativa de 10m: média em escala mais grossa
+        core_scale = 10
+        if not deadline.allows('coarse_scale', 'ee_s2_composite', 'ee_s1_rvi'):
+            core_scale = COARSE_SCALE_M
+
         # Include OTCI in stats
         stats_s2 = ee.Image([ndvi_img, ndwi_img, ndre_img, otci_img]).reduceRegion(
             reducer=ee.Reducer.mean(),
             geometry=roi, 
-            scale=10, 
+            scale=core_scale, 
             maxPixels=1e9
         )
         
         stats_s1 = rvi_img.reduceRegion(
             reducer=ee.Reducer.mean(),
             geometry=roi,
-            scale=10, 
+            scale=core_scale, 
             maxPixels=1e9
         )
 
+        # Índices principais primeiro: o restante é opcional quando o prazo aperta
+        val_s2 = ee_backend.get_info(stats_s2, stage='s2_composite', dataset=S2_DATASET, scale=core_scale)
+        val_s1 = ee_backend.get_info(stats_s1, stage='s1_rvi', dataset=S1_DATASET, scale=core_scale)
+
         # Cloud Cover: média do CLOUDY_PIXEL_PERCENTAGE da coleção S2
-        s2_cloud = ee.ImageCollection('COPERNICUS/S2_SR_HARMONIZED') \
-            .filterDate(start_date_str, end_date_str) \
-            .filterBounds(roi)
+        s2_cloud = get_sentinel2_scenes(roi, start_date_str, end_date_str)
         cloud_cover = 0.0
         try:
-            cloud_stats = s2_cloud.aggregate_mean('CLOUDY_PIXEL_PERCENTAGE').getInfo()
+            if not deadline.allows('cloud_cover', 'ee_cloud_cover'):
+                raise deadline.DeadlineExceeded("sem tempo para cobertura de nuvens")
+            cloud_stats = ee_backend.get_info(s2_cloud.aggregate_mean('CLOUDY_PIXEL_PERCENTAGE'), stage='cloud_cover', dataset=S2_DATASET)
             cloud_cover = (cloud_stats or 0) / 100.0  # Normalizar para 0-1
         except Exception:
             cloud_cover = 0.0
@@ -236,13 +305,15 @@ def analyze_farm(roi, start_date, end_date, size_ha):
         # Regional NDVI (5km context)
         regional_ndvi = 0.0
         try:
+            if not deadline.allows('regional_ndvi', 'ee_regional_ndvi'):
+                raise deadline.DeadlineExceeded("sem tempo para o NDVI regional")
             stats_regional = ndvi_img.reduceRegion(
                 reducer=ee.Reducer.mean(),
                 geometry=thermal_roi,
                 scale=50,
                 maxPixels=1e9
             )
-            val_regional = stats_regional.getInfo()
+            val_regional = ee_backend.get_info(stats_regional, stage='regional_ndvi', dataset=S2_DATASET, scale=50)
             regional_ndvi = val_regional.get('ndvi', 0) or 0
         except Exception as e:
             sys.stderr.write(f"Warning: Regional NDVI calc failed: {e}\n")
@@ -251,8 +322,10 @@ def analyze_farm(roi, start_date, end_date, size_ha):
         val_s3 = {'lst': None}
         lst_img = None
         try:
+            if not deadline.allows('temperature', 'ee_landsat_lst'):
+                raise deadline.DeadlineExceeded("sem tempo para o LST")
             # Buscar Landsat LST (Alta Resolução)
-            lst_img, l8_coll = get_landsat_lst(thermal_roi, start_date_str, end_date_str)
+            lst_img, l8_coll = get_landsat_lst(roi, start_date_str, end_date_str, region=thermal_roi)
             
             stats_s3 = lst_img.reduceRegion(
                 reducer=ee.Reducer.mean(),
@@ -260,13 +333,10 @@ def analyze_farm(roi, start_date, end_date, size_ha):
                 scale=100, # Landsat Thermal is 100m (resampled to 30m but physics is 100m)
                 maxPixels=1e9
             )
-            val_s3 = stats_s3.getInfo()
+            val_s3 = ee_backend.get_info(stats_s3, stage='landsat_lst', dataset=LANDSAT_DATASETS, scale=100)
         except Exception as e:
             sys.stderr.write(f"Warning: Landsat LST access failed (skipping thermal): {e}\n")
 
-        # Combinar resultados (getInfo traz para o cliente Python)
-        val_s2 = stats_s2.getInfo()
-        val_s1 = stats_s1.getInfo()
         # val_otci now from S2
         val_otci = {'otci': val_s2.get('otci', 0)}
         # val_s3 já está definido acima
@@ -286,16 +356,11 @@ def analyze_farm(roi, start_date, end_date, size_ha):
         
         visual_rgb = composite.select(['B4', 'B3', 'B2']).visualize(min=0, max=0.3)
         
-        # Obter Bounds da Imagem para Overlay no Frontend
-        # O bounds() do ee.Geometry retorna um Polygon.
-        # Precisamos das coords min/max dele.
-        rgb_bounds_info = rgb_roi.getInfo()['coordinates'][0]
-        # rgb_bounds_info é [[lon, lat], ...]
-        lons = [p[0] for p in rgb_bounds_info]
-        lats = [p[1] for p in rgb_bounds_info]
-        # Leaflet espera [[lat1, lon1], [lat2, lon2]] (SouthWest, NorthEast)
-        # Vamos retornar: [[min_lat, min_lon], [max_lat, max_lon]]
-        bounds_overlay = [[min(lats), min(lons)], [max(lats), max(lons)]]
+        # Bounds da Imagem para Overlay no Frontend: a caixa de rgb_roi (ROI + rgb_radius),
+        # calculada localmente. Leaflet espera [[min_lat, min_lon], [max_lat, max_lon]].
+        # Sempre presente (mesmo sem miniaturas): o backend usa a última leitura com bounds
+        # como marca d'água da sincronização incremental.
+        bounds_overlay = context_bounds(roi_box, rgb_radius) if roi_box else None
         
         # Preencher fundo transparente (buracos) com cinza muito claro (nuvem/sem dados)
         # background = ee.Image.constant(0.9).visualize(min=0, max=1) # Branco quase
@@ -306,14 +371,18 @@ def analyze_farm(roi, start_date, end_date, size_ha):
         # Vamos apenas garantir que não fique "quebrado" (preto/transparente).
         
         try:
+            if not deadline.allows('thumbnails', 'ee_thumbnail_rgb', 'ee_thumbnail_prev_rgb', 'ee_thumbnail_thermal'):
+                raise deadline.DeadlineExceeded("sem tempo para as miniaturas")
             # Usar rgb_roi (Contexto Local) para RGB - o "Perfeito"
             
             # Forçar a região exata (ROI expandida) evita distorções
-            thumb_url = visual_rgb.getThumbURL({
+            thumb_url = stored_thumbnail(image_key, (start_date_str, end_date_str),
+                                         {'kind': 'rgb', 'min': 0, 'max': 0.3, 'dimensions': 600, 'format': 'png'},
+                                         lambda: ee_backend.thumb_url(visual_rgb, {
                 'dimensions': 600, 
                 'format': 'png',   # Mudar aqui também para consistência visual sem fundo preto
                 'region': rgb_roi      # CRÍTICO: Define o bounding box com contexto local
-            })
+            }, stage='thumbnail_rgb', dataset=S2_DATASET))
             
             # Gerar URL ANTERIOR (buscar no intervalo de 30 a 60 dias atrás) para o PDF
             prev_thumb_url = None
@@ -321,14 +390,16 @@ def analyze_farm(roi, start_date, end_date, size_ha):
                 prev_end_date = start_date # today - 30
                 prev_start_date = prev_end_date - datetime.timedelta(days=30) # today - 60
                 
-                _, _, _, prev_composite = get_sentinel2_indices(rgb_roi, start_date=prev_start_date.strftime('%Y-%m-%d'), end_date=prev_end_date.strftime('%Y-%m-%d'))
+                _, _, _, prev_composite = get_sentinel2_indices(roi, start_date=prev_start_date.strftime('%Y-%m-%d'), end_date=prev_end_date.strftime('%Y-%m-%d'), region=rgb_roi)
                 prev_visual_rgb = prev_composite.select(['B4', 'B3', 'B2']).visualize(min=0, max=0.3)
                 
-                prev_thumb_url = prev_visual_rgb.getThumbURL({
+                prev_thumb_url = stored_thumbnail(image_key, (prev_start_date, prev_end_date),
+                                                  {'kind': 'rgb', 'min': 0, 'max': 0.3, 'dimensions': 600, 'format': 'png'},
+                                                  lambda: ee_backend.thumb_url(prev_visual_rgb, {
                     'dimensions': 600, 
                     'format': 'png',   # PNG suporta transparência (evita tela preta se houver buraco sem dados)
                     'region': rgb_roi      
-                })
+                }, stage='thumbnail_prev_rgb', dataset=S2_DATASET))
             except Exception as e:
                 sys.stderr.write(f"Warning: Failed to generate PREVIOUS thumb URL: {e}\n")
                 prev_thumb_url = None
@@ -351,11 +422,14 @@ def analyze_farm(roi, start_date, end_date, size_ha):
                 visual_thermal = lst_img.visualize(min=min_vis, max=max_vis, palette=palette)
                 
                 try:
-                    thermal_url = visual_thermal.getThumbURL({
+                    thermal_url = stored_thumbnail(image_key, (start_date_str, end_date_str),
+                                                   {'kind': 'thermal', 'min': min_vis, 'max': max_vis, 'palette': palette,
+                                                    'dimensions': 600, 'format': 'jpg'},
+                                                   lambda: ee_backend.thumb_url(visual_thermal, {
                         'dimensions': 600,
                         'format': 'jpg',
                         'region': thermal_roi # Usa a região GRANDE
-                    })
+                    }, stage='thumbnail_thermal', dataset=LANDSAT_DATASETS))
                 except Exception as e:
                      sys.stderr.write(f"Warning: Failed to generate thermal thumb URL: {e}\n")
         except Exception as e:
@@ -369,7 +443,9 @@ def analyze_farm(roi, start_date, end_date, size_ha):
         mean_ndvi = val_s2.get('ndvi', 0) if val_s2.get('ndvi') is not None else 0
         area_ha = size_ha
         try:
-            area_ha = roi.area().divide(10000).getInfo()
+            if not deadline.allows('area', 'ee_area'):
+                raise deadline.DeadlineExceeded("sem tempo para a área")
+            area_ha = ee_backend.get_info(roi.area().divide(10000), stage='area')
         except Exception:
             pass
         biomass_t_ha = max(0, 180 * mean_ndvi - 40)
@@ -396,21 +472,26 @@ def analyze_farm(roi, start_date, end_date, size_ha):
             "co2_equivalent": co2_equivalent
         }
         
-        print(json.dumps(result))
+        return result
 
+    except (deadline.DeadlineExceeded, ee_gateway.CircuitOpen):
+        raise
     except Exception as e:
-        print(json.dumps({"error": str(e)}))
-
-def get_landsat_lst(roi, start_date, end_date):
-    """Calcula Temperatura da Superfície (LST) usando Landsat 8/9 (100m resolution)."""
-    # Landsat 8/9 Level 2, Collection 2, Tier 1
-    l9 = ee.ImageCollection("LANDSAT/LC09/C02/T1_L2")
-    l8 = ee.ImageCollection("LANDSAT/LC08/C02/T1_L2")
-    
-    landsat = l9.merge(l8) \
-        .filterDate(start_date, end_date) \
-        .filterBounds(roi) \
+        return {"error": str(e)}
+
+def get_landsat_collection(roi, start_date, end_date):
+    """Coleção Landsat 8/9 Level 2 (Collection 2, Tier 1) filtrada por data, ROI e nuvens < 60%."""
+    return ee_registry.memoize("landsat", LANDSAT_DATASETS, roi, start_date, end_date, lambda: (
+        ee.ImageCollection("LANDSAT/LC09/C02/T1_L2")
+        .merge(ee.ImageCollection("LANDSAT/LC08/C02/T1_L2"))
+        .filterDate(start_date, end_date)
+        .filterBounds(roi)
         .filter(ee.Filter.lt('CLOUD_COVER', 60))
+    ))
+
+def get_landsat_lst(roi, start_date, end_date, region=None):
+    """Calcula Temperatura da Superfície (LST) usando Landsat 8/9 (100m resolution), recortada em `region` (padrão: a ROI)."""
+    landsat = get_landsat_collection(roi, start_date, end_date)
         
     def to_celsius(image):
         # Band ST_B10 is Surface Temperature
@@ -427,7 +508,7 @@ def get_landsat_lst(roi, start_date, end_date):
     
     # Check if empty handled by caller? 
     # Mosaico da média (ou mediana)
-    landsat_mean = processed.select('lst').median().clip(roi)
+    landsat_mean = processed.select('lst').median().clip(region or roi)
     
     return landsat_mean, processed
 
@@ -454,19 +535,79 @@ if __name__ == "__main__":
     end_date = datetime.datetime.now()
     start_date = end_date - datetime.timedelta(days=30)
 
-    analyze_farm(roi, start_date, end_date, args.size)
+    print(json.dumps(analyze_farm(roi, start_date, end_date, args.size,
+                                  roi_box=cluster.roi_bounds(args.lat, args.lon, args.size))))
 
-def get_sentinel2_pixels(roi, start_date, end_date, scale=20):
+def probe_sentinel2_windows(roi, end_date, windows, scale):
     """
-    Fetches raw Sentinel-2 pixels (NDVI, NDWI) for clustering.
+    Checks every candidate date window in a single getInfo() round-trip.
+    Returns {days: {"images": n_images, "valid": n_valid_ndvi_pixels_at_scale}}.
+    Empty windows are guarded server-side (ee.Algorithms.If) so one cloudy window
+    does not fail the whole probe.
+    """
+    probes = {}
+    for days in windows:
+        start_date = end_date - datetime.timedelta(days=days)
+        s2 = get_sentinel2_collection(roi, start_date, end_date)
+        # Same composite object get_sentinel2_pixels uses for the chosen window
+        ndvi = get_sentinel2_indices(roi, start_date, end_date)[0]
+        valid = ndvi.reduceRegion(
+            reducer=ee.Reducer.count(),
+            geometry=roi,
+            scale=scale,
+            maxPixels=1e9
+        ).get('ndvi')
+        probes[str(days)] = ee.Dictionary({
+            "images": s2.size(),
+            "valid": ee.Algorithms.If(s2.size().gt(0), valid, 0)
+        })
+
+    info = ee_backend.get_info(ee.Dictionary(probes), stage='s2_probe', dataset=S2_DATASET, scale=scale)
+    return {int(days): {"images": int(v.get("images") or 0), "valid": int(v.get("valid") or 0)}
+            for days, v in info.items()}
+
+def get_ndvi_time_series_pixels(roi, windows, scale):
+    """
+    NDVI per pixel for several date windows in a single sample().getInfo().
+    windows: [(start_date, end_date), ...]. Windows without clear imagery come back as None.
+    Returns (lats, lons, series) where series[w][i] is the NDVI of pixel i in window w.
+    """
+    # Fully masked placeholder so empty windows yield a masked band instead of no band at all
+    empty = ee.Image.constant([0, 0]).rename(['B8', 'B4']).toFloat().updateMask(0)
+
+    bands = []
+    for i, (start_date, end_date) in enumerate(windows):
+        s2 = get_sentinel2_collection(roi, start_date, end_date).select(['B8', 'B4'])
+        composite = s2.map(lambda img: img.toFloat()).merge(ee.ImageCollection([empty])).median()
+        bands.append(composite.normalizedDifference(['B8', 'B4']).rename(f'w{i}'))
+
+    stack = ee.Image.cat(bands).addBands(ee.Image.pixelLonLat())
+    data = ee_backend.get_info(stack.sample(
+        region=roi,
+        scale=scale,
+        projection='EPSG:4326',
+        dropNulls=False,  # keep pixels that are cloudy in some windows
+        geometries=False
+    ), stage='ndvi_series_sample', dataset=S2_DATASET, scale=scale)
+
+    features = data.get('features', [])
+    lats = [f['properties'].get('latitude') for f in features]
+    lons = [f['properties'].get('longitude') for f in features]
+    series = [[f['properties'].get(f'w{i}') for f in features] for i in range(len(windows))]
+    return lats, lons, series
+
+def get_sentinel2_pixels(roi, start_date, end_date, scale=20, num_pixels=None):
+    """
+    Fetches raw Sentinel-2 pixels (NDVI, NDWI, NDRE) for clustering.
     Scale=20m is a good compromise between precision and performance (S2 is 10m).
+    num_pixels caps the sample size (random subset) when the grid at `scale` is larger.
     """
     try:
         # Reuse existing logic to get images
         ndvi_img, ndwi_img, ndre_img, composite = get_sentinel2_indices(roi, start_date, end_date)
         
         # Create a stack of bands we want to cluster on
-        stack = ndvi_img.addBands(ndwi_img).addBands(ee.Image.pixelLonLat())
+        stack = ndvi_img.addBands(ndwi_img).addBands(ndre_img).addBands(ee.Image.pixelLonLat())
         
         # Sample the region
         # using sample() instead of reduceRegion allows us to get individual points
@@ -476,15 +617,18 @@ def get_sentinel2_pixels(roi, start_date, end_date, scale=20):
         # 100ha at 10m = 10,000 points. Manageable.
         # But let's verify scale.
         
-        pixels = stack.sample(
+        sample_args = dict(
             region=roi,
             scale=scale,  # 20m resolution (4 pixels of 10m combined approx)
             projection='EPSG:4326',
             geometries=True # We need coordinates
         )
+        if num_pixels:
+            sample_args.update(numPixels=int(num_pixels), seed=42)
+        pixels = stack.sample(**sample_args)
         
         # Get data to client side
-        data = pixels.getInfo()
+        data = ee_backend.get_info(pixels, stage='s2_sample', dataset=S2_DATASET, scale=scale)
         
         # Transform to list of dicts
         result = []
@@ -495,10 +639,93 @@ def get_sentinel2_pixels(roi, start_date, end_date, scale=20):
                     "lat": props.get('latitude'),
                     "lon": props.get('longitude'),
                     "ndvi": props.get('ndvi'),
-                    "ndwi": props.get('ndwi')
+                    "ndwi": props.get('ndwi'),
+                    "ndre": props.get('ndre')
                 })
         
         return result
+    except (deadline.DeadlineExceeded, ee_gateway.CircuitOpen):
+        raise
     except Exception as e:
         sys.stderr.write(f"Error fetching S2 pixels: {e}\n")
         return []
+
+# Bands downloaded by the local raster pipeline (see local_raster.py)
+S2_BANDS = ['B2', 'B3', 'B4', 'B5', 'B6', 'B7', 'B8', 'B11']
+S1_BANDS = ['VV', 'VH']
+LST_BANDS = ['ST_B10']
+# Value written where a band is masked (cloud, no image); computePixels has no NaN for masks
+NODATA = -9999
+
+def _with_placeholder(collection, bands):
+    """Merges a fully masked image so an empty collection still yields the bands (masked)."""
+    empty = ee.Image.constant([0] * len(bands)).rename(bands).toFloat().updateMask(0)
+    return collection.map(lambda img: img.select(bands).toFloat()).merge(ee.ImageCollection([empty]))
+
+def get_composite_band_stack(roi, start_date, end_date, bands=None):
+    """
+    Raw composite bands for local index computation, one multi-band image:
+    S2 median reflectance (QA60-masked, /10000), S1 mean linear VV/VH, Landsat median ST_B10 (DN).
+    bands: subset of S2_BANDS + S1_BANDS + LST_BANDS (default: all).
+    """
+    bands = bands or S2_BANDS + S1_BANDS + LST_BANDS
+    parts = []
+
+    s2_bands = [b for b in S2_BANDS if b in bands]
+    if s2_bands:
+        s2 = get_sentinel2_collection(roi, start_date, end_date)
+        parts.append(_with_placeholder(s2, s2_bands).median())
+
+    s1_bands = [b for b in S1_BANDS if b in bands]
+    if s1_bands:
+        s1 = get_sentinel1_collection(roi, start_date, end_date) \
+            .map(lambda img: ee.Image(10).pow(img.select(['VV', 'VH']).divide(10)).copyProperties(img))
+        parts.append(_with_placeholder(s1, s1_bands).mean())
+
+    if 'ST_B10' in bands:
+        landsat = get_landsat_collection(roi, start_date, end_date)
+        parts.append(_with_placeholder(landsat, LST_BANDS).median())
+
+    return ee.Image.cat(parts).select(bands)
+
+def download_band_arrays(image, grid):
+    """
+    Downloads an image as NumPy arrays in one ee.data.computePixels call.
+    grid: {"width", "height", "lon0", "lat0", "dlon", "dlat"} (EPSG:4326, lat0 = top edge).
+    Returns {band: float32 array (height, width)} with NODATA where the band is masked.
+    """
+    data = ee_backend.compute_pixels({
+        'expression': image.unmask(NODATA).toFloat(),
+        'fileFormat': 'NUMPY_NDARRAY',
+        'grid': {
+            'dimensions': {'width': grid['width'], 'height': grid['height']},
+            'affineTransform': {
+                'scaleX': grid['dlon'], 'shearX': 0, 'translateX': grid['lon0'],
+                'shearY': 0, 'scaleY': -grid['dlat'], 'translateY': grid['lat0'],
+            },
+            'crsCode': 'EPSG:4326',
+        },
+    }, stage='band_download')
+    return {name: data[name] for name in data.dtype.names}
+
+def list_acquisitions(roi, start_date, end_date):
+    """
+    Scenes available for the ROI in the window, per sensor, in a single getInfo() round-trip:
+    {"s2" | "s1" | "landsat": [{"id": system:index, "time": acquisition ms}]}.
+    Uses the same collection filters as the analysis, so a listed scene is one it would use.
+    """
+    collections = {
+        "s2": get_sentinel2_scenes(roi, start_date, end_date)
+            .filter(ee.Filter.lt('CLOUDY_PIXEL_PERCENTAGE', 80)),
+        "s1": get_sentinel1_collection(roi, start_date, end_date),
+        "landsat": get_landsat_collection(roi, start_date, end_date),
+    }
+    info = ee_backend.get_info(ee.Dictionary({
+        sensor: ee.Dictionary({
+            "ids": collection.aggregate_array('system:index'),
+            "times": collection.aggregate_array('system:time_start'),
+        })
+        for sensor, collection in collections.items()
+    }), stage='acquisitions')
+    return {sensor: [{"id": i, "time": t} for i, t in zip(v.get("ids") or [], v.get("times") or [])]
+            for sensor, v in info.items()}
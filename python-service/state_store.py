@@ -0,0 +1,54 @@
+import hashlib
+import json
+import os
+import tempfile
+
+# Local per-farm state kept between runs (centroids, label grids, caches...)
+STATE_DIR = os.environ.get(
+    "YVY_STATE_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), ".state")
+)
+
+
+def roi_key(lat, lon, size, polygon=None):
+    """Stable short hash for a farm ROI (polygon if available, else center + size)."""
+    if polygon and len(polygon) >= 3:
+        canonical = [[round(float(c[0]), 6), round(float(c[1]), 6)] for c in polygon]
+    else:
+        canonical = [round(float(lat), 6), round(float(lon), 6), round(float(size or 0), 4)]
+    return hashlib.sha1(json.dumps(canonical).encode()).hexdigest()[:16]
+
+
+def farm_key(farm_id=None, lat=None, lon=None, size=None, polygon=None):
+    """Key for per-farm state: the farm id when the caller sends it, else the ROI hash."""
+    if farm_id is not None:
+        return f"farm-{farm_id}"
+    return f"roi-{roi_key(lat, lon, size, polygon)}"
+
+
+def state_path(namespace, name):
+    directory = os.path.join(STATE_DIR, namespace)
+    os.makedirs(directory, exist_ok=True)
+    return os.path.join(directory, name)
+
+
+def load_json(namespace, key, default=None):
+    try:
+        with open(state_path(namespace, f"{key}.json")) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return default
+
+
+def save_json(namespace, key, data):
+    """Atomic write (temp file + rename) so concurrent readers never see a partial file."""
+    path = state_path(namespace, f"{key}.json")
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w") as f:
+            json.dump(data, f)
+        os.replace(tmp, path)
+    except Exception:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
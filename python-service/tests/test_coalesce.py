@@ -0,0 +1,43 @@
+"""Followers give up at their own deadline; inflight files do not pile up across workers."""
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest  # noqa: E402
+
+import coalesce  # noqa: E402
+import deadline  # noqa: E402
+import state_store  # noqa: E402
+
+
+def test_follower_raises_at_its_deadline():
+    release = threading.Event()
+    leader = threading.Thread(target=coalesce.run, args=("slow", lambda: release.wait(5), "/test"))
+    leader.start()
+    time.sleep(0.05)
+    started = time.monotonic()
+    try:
+        with deadline.request_scope(100):
+            with pytest.raises(deadline.DeadlineExceeded):
+                coalesce.run("slow", lambda: pytest.fail("follower must not compute"), "/test")
+        assert time.monotonic() - started < 1
+    finally:
+        release.set()
+        leader.join()
+
+
+def test_leader_sweeps_stale_inflight_files(tmp_path, monkeypatch):
+    monkeypatch.setattr(state_store, "STATE_DIR", str(tmp_path))
+    monkeypatch.setattr(coalesce, "ACROSS_WORKERS", True)
+    monkeypatch.setattr(coalesce, "_last_sweep", 0.0)
+    old = time.time() - coalesce.WAIT_S - 1
+    for name in ("old.lock", "old.json"):
+        path = state_store.state_path("inflight", name)
+        open(path, "w").close()
+        os.utime(path, (old, old))
+
+    assert coalesce.run("fresh", lambda: {"ok": True}, "/test") == {"ok": True}
+    assert sorted(os.listdir(tmp_path / "inflight")) == ["fresh.json", "fresh.lock"]
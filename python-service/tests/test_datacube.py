@@ -0,0 +1,50 @@
+"""A composite read in progress keeps its chunks while another request compacts the cube."""
+import datetime
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np  # noqa: E402
+
+import cluster  # noqa: E402
+import datacube  # noqa: E402
+import state_store  # noqa: E402
+
+
+def fetch(grid, start, end, bands):
+    return {band: np.full((grid["height"], grid["width"]), start.toordinal() % 100, dtype=np.float32)
+            for band in bands}
+
+
+def test_composite_survives_concurrent_compact(tmp_path, monkeypatch):
+    monkeypatch.setattr(state_store, "STATE_DIR", str(tmp_path))
+    monkeypatch.setattr(datacube, "COMPACT_AFTER", 1000)
+    end_date = datetime.datetime(2026, 10, 1)
+    bounds = cluster.roi_bounds(-15.78, -47.93, 50)
+    index, _ = datacube.sync("farm", bounds, "roi", end_date, days=90, bands=["B4", "B8"], fetch=fetch)
+    steps = sorted(int(s) for s, e in index["steps"].items() if e["complete"])
+
+    read_step = datacube.read_step
+    compactor = []
+
+    def slow_read_step(key, step, index=None):
+        if not compactor:
+            # Another request's sync compacts the cube while this composite is half read
+            def compact():
+                with datacube._lock(key):
+                    datacube.compact(key)
+            compactor.append(threading.Thread(target=compact))
+            compactor[0].start()
+            time.sleep(0.1)
+        return read_step(key, step, index)
+
+    monkeypatch.setattr(datacube, "read_step", slow_read_step)
+    result = datacube.composite("farm", steps)
+    compactor[0].join()
+    assert result is not None and not np.isnan(result["B8"]).all()
+    assert datacube.load_index("farm")["generation"] == 1
+    monkeypatch.setattr(datacube, "read_step", read_step)
+    np.testing.assert_array_equal(datacube.composite("farm", steps)["B8"], result["B8"])
@@ -0,0 +1,51 @@
+"""Circuit breaker recovery after a half-open probe, whatever the probe's outcome."""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest  # noqa: E402
+
+import ee_gateway  # noqa: E402
+
+
+@pytest.fixture
+def breaker(monkeypatch):
+    breaker = ee_gateway.CircuitBreaker(threshold=2, cooldown_s=0.01)
+    monkeypatch.setattr(ee_gateway, "breaker", breaker)
+    monkeypatch.setattr(ee_gateway, "bucket", ee_gateway.TokenBucket(0, 0))
+    monkeypatch.setattr(ee_gateway, "RETRIES", 0)
+    return breaker
+
+
+def fail(exc):
+    def run():
+        raise exc
+    return run
+
+
+def open_breaker(breaker):
+    for _ in range(2):
+        with pytest.raises(RuntimeError):
+            ee_gateway.call("test", fail(RuntimeError("HttpError 503")))
+    assert breaker.state == "open"
+    time.sleep(0.02)
+    assert breaker.state == "half_open"
+
+
+def test_fatal_probe_closes_breaker(breaker):
+    open_breaker(breaker)
+    with pytest.raises(RuntimeError):
+        ee_gateway.call("test", fail(RuntimeError("Image.select: Pattern 'B8' did not match any bands.")))
+    assert breaker.state == "closed" and not breaker.probing
+
+
+def test_unclassified_probe_rearms_breaker(breaker):
+    open_breaker(breaker)
+    with pytest.raises(KeyError):
+        ee_gateway.call("test", fail(KeyError("x")), error_types=(RuntimeError,))
+    assert breaker.state == "open" and not breaker.probing
+    time.sleep(0.02)
+    assert ee_gateway.call("test", lambda: 42) == (42, 0)
+    assert breaker.state == "closed"
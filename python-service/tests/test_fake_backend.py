@@ -0,0 +1,198 @@
+"""
+/satellite and /cluster end to end against the offline Earth Engine stand-in (EE_BACKEND=fake).
+
+Run from python-service/: python -m pytest -q tests
+"""
+import base64
+import io
+import json
+import math
+import os
+import sys
+import tempfile
+
+import pytest
+from pydantic import ValidationError
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# The backend is chosen at import time, so these must be set before app is imported
+os.environ["EE_BACKEND"] = "fake"
+os.environ["YVY_STATE_DIR"] = tempfile.mkdtemp(prefix="yvy-test-")
+os.environ["EE_RATE_PER_S"] = "0"
+
+import app  # noqa: E402
+
+LAT, LON = -15.78, -47.93
+
+
+def body(result):
+    if hasattr(result, "body"):
+        return json.loads(result.body)
+    return result
+
+
+def test_satellite_fake_backend():
+    result = body(app.analyze_satellite(app.SatelliteRequest(farm_id=1, lat=LAT, lon=LON, size=100), accept=None))
+    assert "error" not in result, result
+    for index in ("ndvi", "ndwi", "ndre", "rvi", "temperature"):
+        assert isinstance(result[index], float)
+    assert 0 < result["ndvi"] < 1
+    assert result["satellite_image"].startswith("/images/")
+
+
+def test_cluster_fake_backend():
+    result = body(app.analyze_cluster(app.ClusterRequest(farm_id=1, lat=LAT, lon=LON, size=100), accept=None))
+    assert "error" not in result, result
+    assert len(result["zones"]) == 3
+    assert all(zone["coordinates"] for zone in result["zones"])
+    assert result["raster_image"]
+
+
+def test_cluster_k_range_bounds():
+    base = {"lat": LAT, "lon": LON, "size": 100}
+    assert app.ClusterRequest(**base, k_range=[2, 6]).k_range == [2, 6]
+    for k_range in ([], [3], [2, 5000], [6, 2], [1, 4], [2, 4, 6], [5, 11]):
+        with pytest.raises(ValidationError):
+            app.ClusterRequest(**base, k_range=k_range)
+
+
+def test_cluster_k_range_fake_backend():
+    req = app.ClusterRequest(farm_id=2, lat=LAT, lon=LON, size=100, k_range=[2, 4])
+    result = body(app.analyze_cluster(req, accept=None))
+    assert [solution["k"] for solution in result["solutions"]] == [2, 3, 4]
+
+
+def test_cluster_arrow_carries_grid_bounds():
+    pa = pytest.importorskip("pyarrow")
+    req = app.ClusterRequest(farm_id=3, lat=LAT, lon=LON, size=100)
+    grid = app.analyze_cluster(req, accept=app.encoding.LABEL_GRID)
+    table = app.analyze_cluster(req, accept=app.encoding.ARROW)
+    bounds = json.loads(pa.ipc.open_stream(table.body).schema.metadata[b"bounds"])
+    assert bounds == json.loads(grid.headers["x-raster-bounds"])
+    assert app.encoding.negotiate("application/vnd.apache.arrow.file", app.CLUSTER_FORMATS) is None
+
+
+def test_profile_header_only_when_saved(tmp_path, monkeypatch):
+    pytest.importorskip("httpx")
+    from fastapi.testclient import TestClient
+
+    monkeypatch.setattr(app.profiling, "ENABLED", True)
+    monkeypatch.setattr(app.profiling, "PROFILE_TOKEN", "secret")
+    monkeypatch.setattr(app.profiling, "PROFILE_DIR", str(tmp_path))
+    client = TestClient(app.app)
+    assert "x-profile-id" not in client.get("/ping", headers={"X-Profile": "secret"}).headers
+    response = client.post("/cluster", json={"farm_id": 4, "lat": LAT, "lon": LON, "size": 100},
+                           headers={"X-Profile": "secret"})
+    assert (tmp_path / f"{response.headers['x-profile-id']}.json").exists()
+
+
+def cluster_client():
+    pytest.importorskip("httpx")
+    from fastapi.testclient import TestClient
+    return TestClient(app.app)
+
+
+def test_cluster_expired_deadline_serves_stale():
+    client = cluster_client()
+    body_ = {"farm_id": 5, "lat": LAT, "lon": LON, "size": 100}
+    fresh = client.post("/cluster", json=body_).json()
+    response = client.post("/cluster", json=body_, headers={"X-Deadline-Ms": "1"})
+    assert response.status_code == 200, response.text
+    stale = response.json()
+    assert stale["stale"] is True
+    assert stale["zones"] == fresh["zones"]
+
+
+def test_cluster_circuit_open_fails_fast(monkeypatch):
+    client = cluster_client()
+    body_ = {"farm_id": 6, "lat": LAT, "lon": LON, "size": 100}
+    fresh = client.post("/cluster", json=body_).json()
+
+    breaker = app.ee_gateway.CircuitBreaker(threshold=1, cooldown_s=600)
+    breaker.opened_at = app.time.monotonic()
+    monkeypatch.setattr(app.ee_gateway, "breaker", breaker)
+    calls = []
+    monkeypatch.setattr(app.ee_gateway.metrics, "count",
+                        lambda name, *args, **kwargs: calls.append(name) if name == "yvy_ee_rejected_total" else None)
+
+    stale = client.post("/cluster", json=body_).json()
+    assert stale["stale"] is True and stale["zones"] == fresh["zones"]
+    # The probe hits the open breaker once; the retry ladder is not walked
+    assert len(calls) == 1
+
+    response = client.post("/cluster", json={**body_, "farm_id": 7})
+    assert response.status_code == 503
+    assert "circuit breaker" in response.json()["detail"]
+
+
+def test_cluster_rejects_unknown_engine():
+    base = {"lat": LAT, "lon": LON, "size": 100}
+    for engine in ("auto", "kmeans", "minibatch", "kdtree"):
+        assert app.ClusterRequest(**base, engine=engine).engine == engine
+    with pytest.raises(ValidationError):
+        app.ClusterRequest(**base, engine="bogus")
+
+
+def test_cluster_rejects_unknown_options():
+    base = {"lat": LAT, "lon": LON, "size": 100}
+    for bad in ({"features": "temporl"}, {"pipeline": "gpu"}, {"k": 0}, {"k": 300}, {"selected_k": 1},
+                {"selected_k": 11}):
+        with pytest.raises(ValidationError):
+            app.ClusterRequest(**base, **bad)
+    with pytest.raises(ValidationError):
+        app.SatelliteRequest(**base, pipeline="gpu")
+    with pytest.raises(ValidationError):
+        app.StabilityRequest(**base, features="temporl")
+    assert app.ClusterRequest(**base, k=10, selected_k=2, features="temporal", pipeline="local").k == 10
+
+
+def test_cluster_stability_counts_each_composite_once():
+    base = {"farm_id": 8, "lat": LAT, "lon": LON, "size": 100}
+    first = body(app.analyze_cluster(app.ClusterRequest(**base), accept=None))
+    assert first["stability"]["runs"] == 1
+    # Same-day repeat, a format variant, an engine trial and a k sweep add no run
+    body(app.analyze_cluster(app.ClusterRequest(**base), accept=None))
+    app.analyze_cluster(app.ClusterRequest(**base), accept=app.encoding.LABEL_GRID)
+    trial = body(app.analyze_cluster(app.ClusterRequest(**base, engine="kdtree"), accept=None))
+    sweep = body(app.analyze_cluster(app.ClusterRequest(**base, k_range=[2, 3]), accept=None))
+    assert "stability" not in trial and "stability" not in sweep
+    maps = app.zone_stability.stability_maps(app.stability_key(
+        app.state_store.farm_key(8, LAT, LON, 100, None), None))
+    assert maps["runs"] == 1
+
+
+def test_satellite_bounds_without_thumbnails(monkeypatch):
+    full = body(app.analyze_satellite(app.SatelliteRequest(farm_id=9, lat=LAT, lon=LON, size=100), accept=None))
+    # The deadline leaves no room for thumbnails: the overlay bounds still come back (from the ROI)
+    monkeypatch.setattr(app.deadline, "allows", lambda label, *stages: label != "thumbnails")
+    req = app.SatelliteRequest(farm_id=10, lat=LAT, lon=LON, size=100)
+    degraded = app.run_analyze_farm(req)
+    assert degraded["satellite_image"] is None
+    assert degraded["bounds"] == full["bounds"]
+    # Same box as the EE geometry the thumbnails are cut from
+    radius = math.sqrt(100 * 10000 / math.pi)
+    rgb_roi = app.ee.Geometry.Point([LON, LAT]).buffer(radius).buffer(2 * radius).bounds()
+    corners = app.satellite_analysis.ee_backend.get_info(rgb_roi)["coordinates"][0]
+    assert degraded["bounds"][0] == pytest.approx([min(c[1] for c in corners), min(c[0] for c in corners)], abs=1e-4)
+
+
+def test_fake_renders_only_the_bands_read(monkeypatch):
+    from PIL import Image
+
+    fake = app.ee
+    rendered = []
+    formulas = {name: (lambda name, f: lambda v: rendered.append(name) or f(v))(name, f)
+                for name, f in fake._SENSOR_BANDS["s2"].items()}
+    monkeypatch.setitem(fake._SENSOR_BANDS, "s2", formulas)
+    fake._dataset_scenes.cache_clear()
+    try:
+        roi = fake.Geometry.Point([LON, LAT]).buffer(300)
+        ndvi = (fake.ImageCollection("COPERNICUS/S2_SR_HARMONIZED").filterDate("2026-01-01", "2026-02-01")
+                .median().normalizedDifference(["B8", "B4"]))
+        assert ndvi.reduceRegion(fake.Reducer.mean(), roi, 10).getInfo()["nd"] is not None
+        assert set(rendered) == {"B8", "B4"}
+        # Rendered on a capped grid, delivered at the requested size
+        url = ndvi.visualize(min=0, max=1).getThumbURL({"region": roi, "dimensions": 600})
+    finally:
+        fake._dataset_scenes.cache_clear()
+    assert max(Image.open(io.BytesIO(base64.b64decode(url.split(",", 1)[1]))).size) == 600
@@ -0,0 +1,40 @@
+"""Concurrent updates of the same farm's pixel cube append each window once."""
+import datetime
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np  # noqa: E402
+
+import pixel_cube  # noqa: E402
+import state_store  # noqa: E402
+
+
+def test_concurrent_update_cube_appends_once(tmp_path, monkeypatch):
+    monkeypatch.setattr(state_store, "STATE_DIR", str(tmp_path))
+    lats, lons = [-15.78, -15.79, -15.80], [-47.93, -47.94, -47.95]
+    calls = []
+
+    def fetch(roi, windows, scale):
+        calls.append(len(windows))
+        time.sleep(0.05)  # both requests are inside update_cube at the same time
+        return lats, lons, [[0.5, 0.6, 0.7] for _ in windows]
+
+    end_date = datetime.date(2026, 10, 19)
+    threads = [threading.Thread(target=pixel_cube.update_cube,
+                                args=("farm-1", None, "roi", 20), kwargs={"end_date": end_date, "fetch": fetch})
+               for _ in range(2)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    cube = pixel_cube.load_cube("farm-1")
+    windows = cube["meta"]["windows"]
+    assert calls == [len(pixel_cube.season_windows(end_date))]
+    assert windows == sorted(set(windows))
+    size = os.path.getsize(os.path.join(pixel_cube.cube_dir("farm-1"), "ndvi.f16"))
+    assert size == len(windows) * len(lats) * np.dtype(pixel_cube.DTYPE).itemsize
@@ -0,0 +1,186 @@
+"""
+Request tracing: nested spans written as JSON lines to a rotating trace log.
+
+The HTTP middleware opens a root span per request; metrics.stage() blocks, EE round-trips
+(ee_backend) and cluster fetch attempts open child spans. Each line is one finished span:
+{"trace", "span", "parent", "name", "start", "ms", "status", ...tags}. Tags set with
+annotate() (e.g. the farm ROI key) are copied onto every later span of the same trace.
+
+Summaries: python tracing.py [--since 2026-10-01T00:00] [--until ...] [--name ee.] [--top 20]
+           python tracing.py --trace <trace id>     (one request as an indented tree)
+"""
+import argparse
+import contextlib
+import contextvars
+import datetime
+import glob
+import json
+import logging
+import logging.handlers
+import os
+import threading
+import time
+import uuid
+
+import state_store
+
+TRACE_LOG = os.environ.get("TRACE_LOG", os.path.join(state_store.STATE_DIR, "traces", "trace.jsonl"))
+ENABLED = os.environ.get("TRACING", "1") == "1"
+MAX_MB = float(os.environ.get("TRACE_MAX_MB", "20"))
+BACKUPS = int(os.environ.get("TRACE_BACKUPS", "5"))
+
+# (trace, current span) of the code being run (None outside a traced request)
+_current = contextvars.ContextVar("trace_span", default=None)
+_logger = None
+_logger_lock = threading.Lock()
+
+
+class Trace:
+    def __init__(self):
+        self.id = uuid.uuid4().hex[:16]
+        self.tags = {}
+
+
+class Span:
+    def __init__(self, trace, name, parent, tags):
+        self.trace, self.name, self.parent = trace, name, parent
+        self.id = uuid.uuid4().hex[:8]
+        self.tags = dict(tags)
+
+    def tag(self, **tags):
+        self.tags.update(tags)
+
+
+@contextlib.contextmanager
+def span(name, **tags):
+    """Child span of the current one (a new trace when there is none). Yields the Span (or None if disabled)."""
+    if not ENABLED:
+        yield None
+        return
+    parent = _current.get()
+    trace = parent.trace if parent else Trace()
+    current = Span(trace, name, parent.id if parent else None, tags)
+    token = _current.set(current)
+    started_at = time.time()
+    started = time.perf_counter()
+    status, error = "ok", None
+    try:
+        yield current
+    except BaseException as e:
+        status, error = "error", f"{type(e).__name__}: {e}"[:300]
+        raise
+    finally:
+        _current.reset(token)
+        _write({
+            "trace": trace.id, "span": current.id, "parent": current.parent, "name": name,
+            "start": datetime.datetime.fromtimestamp(started_at).isoformat(timespec="milliseconds"),
+            "ms": round((time.perf_counter() - started) * 1000, 2), "status": status, "error": error,
+            "thread": threading.current_thread().name, **trace.tags, **current.tags,
+        })
+
+
+def annotate(**tags):
+    """Tags every span of the current trace written from now on (e.g. farm=<ROI key>)."""
+    current = _current.get()
+    if current is not None:
+        current.trace.tags.update(tags)
+
+
+def _write(record):
+    global _logger
+    if _logger is None:
+        with _logger_lock:
+            if _logger is None:
+                os.makedirs(os.path.dirname(TRACE_LOG), exist_ok=True)
+                handler = logging.handlers.RotatingFileHandler(
+                    TRACE_LOG, maxBytes=int(MAX_MB * 1e6), backupCount=BACKUPS, delay=True)
+                handler.setFormatter(logging.Formatter("%(message)s"))
+                logger = logging.getLogger("yvy.trace")
+                logger.propagate = False
+                logger.setLevel(logging.INFO)
+                logger.addHandler(handler)
+                _logger = logger
+    try:
+        _logger.info(json.dumps({k: v for k, v in record.items() if v is not None}, default=str))
+    except Exception as e:
+        print(f"⚠️ Trace write failed (non-fatal): {e}")
+
+
+# --- CLI ------------------------------------------------------------------------------------
+
+def read_spans(path=TRACE_LOG, since=None, until=None):
+    """Spans from the log and its rotated backups, oldest file first."""
+    backups = sorted((p for p in glob.glob(path + ".*") if p.rsplit(".", 1)[1].isdigit()),
+                     key=lambda p: int(p.rsplit(".", 1)[1]), reverse=True)
+    for name in backups + [path]:
+        if not os.path.exists(name):
+            continue
+        with open(name) as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if since and record["start"] < since:
+                    continue
+                if until and record["start"] > until:
+                    continue
+                yield record
+
+
+def print_tree(spans):
+    children = {}
+    for s in spans:
+        children.setdefault(s.get("parent"), []).append(s)
+
+    def show(parent, depth):
+        for s in sorted(children.get(parent, []), key=lambda s: s["start"]):
+            extra = {k: v for k, v in s.items()
+                     if k not in ("trace", "span", "parent", "name", "start", "ms", "status", "thread")}
+            flag = "" if s["status"] == "ok" else f" [{s['status']}]"
+            print(f"{s['start'][11:]} {'  ' * depth}{s['name']} {s['ms']:.1f}ms{flag} {json.dumps(extra) if extra else ''}")
+            show(s["span"], depth + 1)
+
+    show(None, 0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Summarize the request trace log")
+    parser.add_argument("--log", default=TRACE_LOG)
+    parser.add_argument("--since", help="ISO timestamp (local time), e.g. 2026-10-01T08:00")
+    parser.add_argument("--until", help="ISO timestamp (local time)")
+    parser.add_argument("--name", help="only spans whose name starts with this (e.g. ee.)")
+    parser.add_argument("--top", type=int, default=20)
+    parser.add_argument("--trace", help="print one trace as a tree")
+    args = parser.parse_args()
+
+    spans = list(read_spans(args.log, args.since, args.until))
+    if args.trace:
+        print_tree([s for s in spans if s["trace"] == args.trace])
+        return
+    if args.name:
+        spans = [s for s in spans if s["name"].startswith(args.name)]
+    if not spans:
+        print("No spans in range")
+        return
+
+    print(f"{len(spans)} spans, {len({s['trace'] for s in spans})} traces\n")
+    by_name = {}
+    for s in spans:
+        by_name.setdefault(s["name"], []).append(s)
+    print(f"{'span':<40} {'count':>7} {'errors':>7} {'p50 ms':>9} {'p95 ms':>9} {'max ms':>9}")
+    for name, group in sorted(by_name.items(), key=lambda kv: -sum(s["ms"] for s in kv[1])):
+        ms = sorted(s["ms"] for s in group)
+        errors = sum(1 for s in group if s["status"] != "ok")
+        print(f"{name:<40} {len(ms):>7} {errors:>7} {ms[len(ms) // 2]:>9.1f} "
+              f"{ms[min(len(ms) - 1, int(len(ms) * 0.95))]:>9.1f} {ms[-1]:>9.1f}")
+
+    print(f"\nSlowest {args.top} spans:")
+    for s in sorted(spans, key=lambda s: -s["ms"])[:args.top]:
+        tags = {k: v for k, v in s.items() if k in ("farm", "stage", "dataset", "scale", "days", "bytes", "features")}
+        flag = "" if s["status"] == "ok" else f" [{s.get('error') or s['status']}]"
+        print(f"{s['ms']:>10.1f}ms  {s['start']}  {s['name']:<28} trace={s['trace']}{flag} {json.dumps(tags) if tags else ''}")
+
+
+if __name__ == "__main__":
+    main()
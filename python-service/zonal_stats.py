@@ -0,0 +1,101 @@
+import numpy as np
+
+# Percentiles reported per zone and band
+PERCENTILES = (10, 50, 90)
+
+
+def zonal_statistics(labels, bands, n_zones=None, percentiles=PERCENTILES):
+    """
+    Per-zone statistics for any number of bands in one vectorized pass per band.
+    labels: int array (n,), zone index per pixel; negative values mean "no zone".
+    bands: {name: array (n,)}; NaN (or None) values are ignored.
+    Returns a list with one entry per zone: {band: {count, mean, std, min, max, p10, p50, p90}}.
+    count/mean/std come from np.bincount; min/max/percentiles from a single
+    (zone, value) lexsort, reading each zone's sorted segment by offset.
+    """
+    labels = np.asarray(labels, dtype=np.int64)
+    if n_zones is None:
+        n_zones = int(labels.max()) + 1 if labels.size else 0
+
+    result = [{} for _ in range(n_zones)]
+    for name, values in bands.items():
+        values = np.asarray(values, dtype=np.float64)
+        valid = (labels >= 0) & (labels < n_zones) & ~np.isnan(values)
+        zone, v = labels[valid], values[valid]
+
+        count = np.bincount(zone, minlength=n_zones)
+        safe = np.maximum(count, 1)
+        mean = np.bincount(zone, weights=v, minlength=n_zones) / safe
+        # Two-pass variance (numerically safer than E[x^2] - E[x]^2)
+        std = np.sqrt(np.bincount(zone, weights=(v - mean[zone]) ** 2, minlength=n_zones) / safe)
+
+        sorted_v = v[np.lexsort((v, zone))]
+        starts = np.concatenate(([0], np.cumsum(count)[:-1]))
+        last = starts + np.maximum(count - 1, 0)
+        quantiles = {}
+        for q in percentiles:
+            # Linear interpolation between closest ranks (same as np.percentile's default)
+            pos = starts + (q / 100.0) * np.maximum(count - 1, 0)
+            lo = np.floor(pos).astype(np.int64)
+            hi = np.minimum(lo + 1, last)
+            frac = pos - lo
+            quantiles[q] = _take(sorted_v, lo) * (1 - frac) + _take(sorted_v, hi) * frac
+
+        for z in range(n_zones):
+            if count[z] == 0:
+                result[z][name] = {"count": 0}
+                continue
+            stats = {
+                "count": int(count[z]),
+                "mean": float(mean[z]),
+                "std": float(std[z]),
+                "min": float(sorted_v[starts[z]]),
+                "max": float(sorted_v[last[z]]),
+            }
+            for q in percentiles:
+                stats[f"p{q}"] = float(quantiles[q][z])
+            result[z][name] = stats
+    return result
+
+
+def pixel_bands(pixels, names=("ndvi", "ndwi", "ndre", "rvi", "ndvi_amplitude", "ndvi_trend")):
+    """Band arrays (None -> NaN) for the bands actually present in a list of pixel dicts."""
+    bands = {}
+    for name in names:
+        if not any(p.get(name) is not None for p in pixels):
+            continue
+        bands[name] = np.array([np.nan if p.get(name) is None else p[name] for p in pixels], dtype=np.float64)
+    return bands
+
+
+def labels_from_polygons(lats, lons, polygons):
+    """
+    Zone index per pixel for user-supplied sub-polygons (talhões), -1 outside all of them.
+    polygons: list of [[lon, lat], ...] rings (GeoJSON order). First match wins on overlaps.
+    Vectorized even-odd ray casting, one pass over each polygon's edges.
+    """
+    lats = np.asarray(lats, dtype=np.float64)
+    lons = np.asarray(lons, dtype=np.float64)
+    labels = np.full(lats.shape, -1, dtype=np.int64)
+    for index, polygon in enumerate(polygons):
+        ring = np.asarray([c[:2] for c in polygon], dtype=np.float64)
+        if len(ring) < 3:
+            continue
+        inside = np.zeros(lats.shape, dtype=bool)
+        x1, y1 = ring[:, 0], ring[:, 1]
+        x2, y2 = np.roll(x1, -1), np.roll(y1, -1)
+        for ax, ay, bx, by in zip(x1, y1, x2, y2):
+            crosses = (ay > lats) != (by > lats)
+            if not crosses.any():
+                continue
+            with np.errstate(divide="ignore", invalid="ignore"):
+                x_cross = ax + (lats - ay) * (bx - ax) / (by - ay)
+            inside ^= crosses & (lons < x_cross)
+        labels[(labels < 0) & inside] = index
+    return labels
+
+
+def _take(values, index):
+    if values.size == 0:
+        return np.zeros(index.shape)
+    return values[np.clip(index, 0, values.size - 1)]
@@ -0,0 +1,169 @@
+import os
+import tempfile
+import threading
+
+import numpy as np
+
+import cluster
+import state_store
+
+# Resolution of the per-farm class grid (cells per side); fixed to the ROI bbox so runs line up
+GRID_RES = int(os.environ.get("ZONE_STABILITY_GRID", "100"))
+N_CLASSES = len(cluster.PRODUCTIVITY_CLASSES)
+NO_CLASS = 255
+# Change map value for cells without a class in this or the previous run
+NO_CHANGE_DATA = -128
+# A cell is "persistent" when it spent at least this fraction of its runs in its modal class
+PERSISTENT_FRACTION = 0.8
+# Run ids remembered per farm to drop repeats (same composite date and settings)
+RECENT_RUN_IDS = 64
+
+# record_run is read-modify-write on the farm's files; serialize it within the process
+_lock = threading.Lock()
+
+
+def class_grid(clean_pixels, labels, sorted_indices, zones, k, lat, lon, size, polygon=None):
+    """
+    Productivity class (index into cluster.PRODUCTIVITY_CLASSES) per cell of a GRID_RES x GRID_RES
+    grid over the ROI bbox. Classes, unlike zone ids, are comparable across runs and across k.
+    Returns (grid uint8 with NO_CLASS outside the ROI, bounds).
+    """
+    bounds = cluster.roi_bounds(lat, lon, size, polygon)
+    grid, mask, bounds = cluster.render_zone_grid(clean_pixels, labels, sorted_indices, k,
+                                                  polygon=polygon, grid_res=GRID_RES, bounds=bounds)
+    lut = np.full(256, NO_CLASS, dtype=np.uint8)
+    for i, zone in enumerate(zones):
+        lut[i] = cluster.productivity_class(zone["ndvi_avg"])
+    classes = lut[grid]
+
+    if mask is None:
+        # Circular ROI: keep the cells inside the inscribed ellipse of the bbox
+        centre = (GRID_RES - 1) / 2.0
+        rows, cols = np.ogrid[:GRID_RES, :GRID_RES]
+        inside = ((rows - centre) ** 2 + (cols - centre) ** 2) <= (GRID_RES / 2.0) ** 2
+    else:
+        inside = mask > 0
+    classes[~inside] = NO_CLASS
+    return classes, bounds
+
+
+def record_run(key, classes, bounds, run_id=None):
+    """
+    Folds one run's class grid into the farm's history, in O(cells):
+    counts[c, row, col] += 1 for the cell's class, and the change map is this grid minus the last one.
+    A different grid shape or bounds (farm boundary edited) starts a new history.
+    run_id identifies the observation (composite date + settings): a run whose id is already in
+    the history is not counted again, so refreshes and format variants do not inflate stability.
+    Returns the summary of the updated history.
+    """
+    with _lock:
+        meta = state_store.load_json(_namespace(key), "meta")
+        shape = [int(s) for s in classes.shape]
+        rounded = [[round(v, 7) for v in corner] for corner in bounds]
+        if meta and (meta.get("shape") != shape or meta.get("bounds") != rounded):
+            print(f"Zone stability {key}: ROI changed, restarting history")
+            meta = None
+
+        if meta and run_id is not None and run_id in meta.get("run_ids", []):
+            counts, last, change = _load(key, "counts"), _load(key, "last"), _load(key, "change")
+            return summarize(counts, last, change, meta)
+
+        if meta:
+            counts = _load(key, "counts")
+            last = _load(key, "last")
+        else:
+            meta = {"shape": shape, "bounds": rounded, "runs": 0}
+            counts = np.zeros((N_CLASSES,) + classes.shape, dtype=np.uint16)
+            last = None
+
+        valid = classes != NO_CLASS
+        rows, cols = np.nonzero(valid)
+        counts[classes[valid], rows, cols] += 1
+
+        change = np.full(classes.shape, NO_CHANGE_DATA, dtype=np.int8)
+        if last is not None:
+            both = valid & (last != NO_CLASS)
+            change[both] = classes[both].astype(np.int8) - last[both].astype(np.int8)
+
+        _save(key, "counts", counts)
+        _save(key, "last", classes)
+        _save(key, "change", change)
+        meta["runs"] += 1
+        if run_id is not None:
+            meta["run_ids"] = (meta.get("run_ids", []) + [run_id])[-RECENT_RUN_IDS:]
+        state_store.save_json(_namespace(key), "meta", meta)
+
+    return summarize(counts, classes, change, meta)
+
+
+def stability_maps(key):
+    """
+    Stored maps for the farm, or None if it has no runs yet:
+    modal class per cell, stability (fraction of the cell's runs spent in that class),
+    current class grid and change versus the previous run.
+    """
+    meta = state_store.load_json(_namespace(key), "meta")
+    if not meta or not meta.get("runs"):
+        return None
+    counts, last, change = _load(key, "counts"), _load(key, "last"), _load(key, "change")
+    modal, stability = _modal(counts)
+    result = summarize(counts, last, change, meta)
+    result.update({"modal": modal, "stability": stability, "current": last, "change": change})
+    return result
+
+
+def summarize(counts, current, change, meta):
+    """Per-class share of cells that are persistent, and the share of cells that changed class."""
+    modal, stability = _modal(counts)
+    observed = modal != NO_CLASS
+    persistent = observed & (stability >= PERSISTENT_FRACTION)
+    compared = change != NO_CHANGE_DATA
+    n_observed = max(int(observed.sum()), 1)
+
+    classes = []
+    for index, (label, color) in enumerate(cluster.PRODUCTIVITY_CLASSES):
+        classes.append({
+            "class": label,
+            "color": color,
+            "current_fraction": float((current == index).sum()) / n_observed,
+            "persistent_fraction": float((persistent & (modal == index)).sum()) / n_observed,
+        })
+    return {
+        "runs": meta["runs"],
+        "bounds": meta["bounds"],
+        "mean_stability": float(stability[observed].mean()) if observed.any() else None,
+        "changed_fraction": float((change[compared] != 0).mean()) if compared.any() else None,
+        "classes": classes,
+    }
+
+
+def _modal(counts):
+    """(modal class uint8 with NO_CLASS for never-observed cells, stability float32 in [0, 1])."""
+    total = counts.sum(axis=0, dtype=np.int64)
+    modal = counts.argmax(axis=0).astype(np.uint8)
+    top = counts.max(axis=0)
+    stability = np.where(total > 0, top / np.maximum(total, 1), 0.0).astype(np.float32)
+    modal[total == 0] = NO_CLASS
+    return modal, stability
+
+
+def _namespace(key):
+    return os.path.join("stability", key)
+
+
+def _load(key, name):
+    return np.load(state_store.state_path(_namespace(key), f"{name}.npy"))
+
+
+def _save(key, name, array):
+    """Atomic .npy write (temp file + rename), same contract as state_store.save_json."""
+    path = state_store.state_path(_namespace(key), f"{name}.npy")
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            np.save(f, array)
+        os.replace(tmp, path)
+    except Exception:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
@@ -22,7 +22,7 @@ export function setupCronJobs() {
 
                 if (result && !result.error && result.reading) {
                     const { ndvi, cloudCover, date } = result.reading;
-                    const status = result.isMock ? "Simulação (Offline)" : "Satélite Sincronizado";
+                    const status = result.isMock ? "Simulação (Offline)" : result.noNewData ? "Sem Novas Imagens (Última Leitura)" : "Satélite Sincronizado";
 
                     let ownerEmail: string | null = null;
                     if (farm.userId) {
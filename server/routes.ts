@@ -399,7 +399,7 @@ async function checkAndSendAlerts(reading: Reading, farmId: number) {
 
 
 // Exported so cron job can use it natively
-export async function syncFarmSatelliteData(farmId: number): Promise<{ message: string, reading?: any, isMock?: boolean, details?: string, error?: string }> {
+export async function syncFarmSatelliteData(farmId: number): Promise<{ message: string, reading?: any, isMock?: boolean, noNewData?: boolean, details?: string, error?: string }> {
   try {
     const farm = await storage.getFarm(farmId);
     if (!farm) {
@@ -411,6 +411,13 @@ export async function syncFarmSatelliteData(farmId: number): Promise<{ message:
         try {
           if (result.error) throw new Error(result.error);
 
+          // Imagens do image_store do Python vêm como "/images/<hash>" quando PUBLIC_BASE_URL não está definido
+          for (const field of ["satellite_image", "thermal_image", "prev_satellite_image"]) {
+            if (typeof result[field] === "string" && result[field].startsWith("/images/")) {
+              result[field] = result[field].replace("/images/", "/api/satellite-images/");
+            }
+          }
+
           const prevReadings = await storage.getReadings(farmId);
           const resultDateObj = new Date(result.date);
           const resultDateStr = resultDateObj.toISOString().split('T')[0];
@@ -506,16 +513,22 @@ export async function syncFarmSatelliteData(farmId: number): Promise<{ message:
       if (process.env.PYTHON_SERVICE_URL) {
         try {
           console.log(`Calling Python Service: ${process.env.PYTHON_SERVICE_URL}/satellite`);
+          // Watermark for incremental sync: only real readings count (mock readings have no image bounds)
+          const latestReading = await storage.getLatestReading(farmId);
+          const since = latestReading?.imageBounds ? latestReading.date : null;
           const controller = new AbortController();
           const timeout = setTimeout(() => controller.abort(), 90000); // 90s timeout (Render cold start)
           const response = await fetch(`${process.env.PYTHON_SERVICE_URL}/satellite`, {
             method: 'POST',
-            headers: { 'Content-Type': 'application/json' },
+            // Python stops (or degrades) its work before we give up on the request
+            headers: { 'Content-Type': 'application/json', 'X-Deadline-Ms': '85000' },
             body: JSON.stringify({
+              farm_id: farm.id,
               lat: farm.latitude,
               lon: farm.longitude,
               size: farm.sizeHa,
-              polygon: farm.polygon || null
+              polygon: farm.polygon || null,
+              since
             }),
             signal: controller.signal
           });
@@ -526,6 +539,11 @@ export async function syncFarmSatelliteData(farmId: number): Promise<{ message:
           }
 
           const result = await response.json();
+          if (result.status === "no_new_data") {
+            console.log(`[Satellite Sync] Farm ${farmId}: no new acquisitions since ${since}, keeping latest reading`);
+            resolve({ message: `Sem novas imagens de satélite desde ${since}`, reading: latestReading, noNewData: true });
+            return;
+          }
           await handleSuccess(result);
           return;
         } catch (e: any) {
@@ -957,6 +975,7 @@ export async function registerRoutes(
           method: 'POST',
           headers: { 'Content-Type': 'application/json' },
           body: JSON.stringify({
+            farm_id: farm.id,
             lat: farm.latitude,
             lon: farm.longitude,
             size: farm.sizeHa,
@@ -1429,6 +1448,26 @@ export async function registerRoutes(
     }
   });
 
+  // Imagens de satélite armazenadas no serviço Python (endereçadas pelo hash do conteúdo, imutáveis)
+  app.get("/api/satellite-images/:hash", async (req, res) => {
+    try {
+      if (!process.env.PYTHON_SERVICE_URL) return res.status(503).send("PYTHON_SERVICE_URL is not set");
+      if (!/^[0-9a-f]{64}$/.test(req.params.hash)) return res.status(400).send("Invalid image hash");
+
+      const response = await fetch(`${process.env.PYTHON_SERVICE_URL}/images/${req.params.hash}`);
+      if (!response.ok) return res.status(response.status).send("Image not found");
+
+      const buffer = Buffer.from(await response.arrayBuffer());
+      res.setHeader("Content-Type", response.headers.get("content-type") || "image/png");
+      res.setHeader("Cache-Control", "public, max-age=31536000, immutable");
+      res.setHeader("ETag", `"${req.params.hash}"`);
+      res.send(buffer);
+    } catch (error: any) {
+      console.error("[Satellite Image] Error fetching stored image:", error);
+      res.status(500).send("Failed to load satellite image");
+    }
+  });
+
   // Endpoint proxy para imagens externas (usado pelo html2canvas no PDF)
   app.get("/api/proxy-image", async (req, res) => {
     try {